@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for evaluating pitch control surfaces for many frames (or events) of a match in parallel, using MetricaSports's tracking & event data.
+The positions and velocities of the players are copied once into a block of shared memory that every worker process reads from,
+so that the tracking data is not pickled and sent to the workers for each frame. Surfaces are returned in the same order as the
+frames (or events) were requested, as soon as they are ready.
+Functions
+----------
+generate_pitch_control_for_frames(): pitch control surfaces for a list of frames (e.g. every Nth frame of a match)
+generate_pitch_control_for_events(): pitch control surfaces at the start frame of a list of events (e.g. every pass in a match)
+"""
+
+import numpy as np
+import time
+import concurrent.futures
+from multiprocessing import shared_memory
+import Metrica_PitchControl as mpc
+
+# state of each worker process (set once per worker by _initialise_worker)
+_worker = {}
+
+def get_player_arrays(tracking, teamname):
+    """ get_player_arrays
+
+    Extracts the player positions and velocities from a tracking DataFrame as a single numpy array
+
+    Parameters
+    -----------
+        tracking: tracking DataFrame for the Home or Away team (must include player velocities, see Metrica_Velocities)
+        teamname: team name "Home" or "Away"
+
+    Returrns
+    -----------
+        player_ids: array of player ids (jersey numbers)
+        arrays: (n_frames,n_players,4) array containing the x, y, vx and vy of each player in each frame
+    """
+    columns = mpc.get_team_columns(tracking, teamname)
+    values = tracking.to_numpy(dtype=float)
+    arrays = np.stack( [values[:,columns[c]] for c in ['x','y','vx','vy']], axis=2 )
+    return columns['ids'], arrays
+
+def generate_pitch_control_for_frames(frames, attacking_teams, tracking_home, tracking_away, params, GK_numbers, ball_positions=None, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, n_workers=None, chunksize=4, cache=None, stats=None):
+    """ generate_pitch_control_for_frames
+
+    Evaluates the pitch control surface over the entire field for each frame in 'frames', spreading the frames across a pool of
+    worker processes. This is a generator: surfaces are yielded in the same order as 'frames'.
+
+    Parameters
+    -----------
+        frames: list of frame numbers (index of the tracking DataFrames) at which to calculate pitch control
+        attacking_teams: the team in possession ("Home" or "Away"), either a single value for all frames or a list with one per frame
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        ball_positions: (n_frames,2) array of ball start positions. Default is to use the ball position in the tracking data
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+        offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+        n_workers: number of worker processes. Default (None) is the number of CPUs. If 1, frames are evaluated in this process.
+        chunksize: number of frames sent to a worker at a time
+        cache: a Metrica_Cache.pitch_control_cache object. Frames already in the cache are not recalculated, and new surfaces are added to it.
+        stats: optional Metrica_PitchControl.pitch_control_stats object. The diagnostics of each frame are collected in the worker process
+               and added to it (see pitch_control_stats.merge() ) as the frame is yielded. Cached frames are not included.
+
+    Yields
+    -----------
+        frame: frame number
+        PPCFa: Pitch control surface (dimen (n_grid_cells_y,n_grid_cells_x) ) containing pitch control probability for the attcking team.
+    """
+    rows = tracking_home.index.get_indexer(frames)
+    assert np.all(rows>=0), "Frames not found in tracking data"
+    if isinstance(attacking_teams, str):
+        attacking_teams = [attacking_teams]*len(rows)
+    if ball_positions is None:
+        ball_positions = tracking_home[['ball_x','ball_y']].to_numpy(dtype=float)[rows]
+    ball_positions = np.asarray(ball_positions, dtype=float).reshape(-1,2)
+    # look up any frames that have already been calculated
+    keys = [None]*len(rows)
+    cached = [None]*len(rows)
+    if cache is not None:
+        keys = [cache.key(frame, team, params, field_dimen, n_grid_cells_x, offsides, ball_start_pos=ball) for frame,team,ball in zip(frames,attacking_teams,ball_positions)]
+        cached = [cache.get(key) for key in keys]
+    todo = [i for i in range(len(rows)) if cached[i] is None]
+    if len(todo)==0:
+        for frame,PPCFa in zip(frames,cached):
+            yield frame, PPCFa
+        return
+    # copy the player positions and velocities for both teams into a single block of shared memory
+    home_ids, home_arrays = get_player_arrays(tracking_home, 'Home')
+    away_ids, away_arrays = get_player_arrays(tracking_away, 'Away')
+    arrays = np.concatenate( (home_arrays, away_arrays), axis=1 )
+    shm = shared_memory.SharedMemory(create=True, size=arrays.nbytes)
+    try:
+        np.ndarray(arrays.shape, dtype=arrays.dtype, buffer=shm.buf)[:] = arrays
+        del arrays, home_arrays, away_arrays
+        offside_masks = {'Home': [None]*len(rows), 'Away': [None]*len(rows)}
+        if offsides:
+            # find the offside players in every frame in one go, rather than in each task
+            offside_masks,_ = mpc.calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames, ball_positions)
+        initargs = (shm.name, (len(tracking_home), len(home_ids)+len(away_ids), 4), home_ids, away_ids, params, GK_numbers, field_dimen, n_grid_cells_x, offsides, stats is not None)
+        tasks = [(frames[i], rows[i], attacking_teams[i], ball_positions[i,0], ball_positions[i,1], offside_masks[attacking_teams[i]][i]) for i in todo]
+        if n_workers==1:
+            _initialise_worker(*initargs)
+            try:
+                for frame,PPCFa in _merge_results(frames, keys, cached, map(_pitch_control_task, tasks), cache, stats):
+                    yield frame, PPCFa
+            finally:
+                _release_worker()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=_initialise_worker, initargs=initargs) as executor:
+                for frame,PPCFa in _merge_results(frames, keys, cached, executor.map(_pitch_control_task, tasks, chunksize=chunksize), cache, stats):
+                    yield frame, PPCFa
+    finally:
+        shm.close()
+        shm.unlink()
+
+def generate_pitch_control_for_events(event_ids, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, n_workers=None, chunksize=4, cache=None, stats=None):
+    """ generate_pitch_control_for_events
+
+    Evaluates the pitch control surface over the entire field at the moment of each event in 'event_ids' (see generate_pitch_control_for_frames() ).
+    Equivalent to calling Metrica_PitchControl.generate_pitch_control_for_event( ..., vectorized=True) for each event.
+
+    Parameters
+    -----------
+        event_ids: list of indices (not rows) of the events at which the pitch control surfaces should be calculated
+        events: Dataframe containing the event data
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+        offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+        n_workers: number of worker processes. Default (None) is the number of CPUs. If 1, events are evaluated in this process.
+        chunksize: number of events sent to a worker at a time
+        cache: a Metrica_Cache.pitch_control_cache object. Events already in the cache are not recalculated, and new surfaces are added to it.
+        stats: optional Metrica_PitchControl.pitch_control_stats object to add the diagnostics of each event to (see generate_pitch_control_for_frames() )
+
+    Yields
+    -----------
+        event_id: Index of the event
+        PPCFa: Pitch control surface (dimen (n_grid_cells_y,n_grid_cells_x) ) containing pitch control probability for the attcking team.
+    """
+    event_ids = list(event_ids)
+    frames = events.loc[event_ids,'Start Frame'].values
+    teams = events.loc[event_ids,'Team'].values
+    ball_positions = events.loc[event_ids,['Start X','Start Y']].to_numpy(dtype=float)
+    surfaces = generate_pitch_control_for_frames(frames, teams, tracking_home, tracking_away, params, GK_numbers, ball_positions=ball_positions,
+                                                 field_dimen=field_dimen, n_grid_cells_x=n_grid_cells_x, offsides=offsides, n_workers=n_workers, chunksize=chunksize, cache=cache, stats=stats)
+    for event_id,(frame,PPCFa) in zip(event_ids, surfaces):
+        yield event_id, PPCFa
+
+def _merge_results(frames, keys, cached, results, cache, stats=None):
+    # combine cached surfaces with newly calculated ones (in the original order), adding the new ones to the cache and their diagnostics to stats
+    for frame,key,PPCFa in zip(frames, keys, cached):
+        if PPCFa is None:
+            PPCFa,task_stats = next(results)
+            if stats is not None:
+                stats.merge(task_stats)
+            if cache is not None:
+                cache.put(key, PPCFa)
+        yield frame, PPCFa
+
+def _initialise_worker(shm_name, shape, home_ids, away_ids, params, GK_numbers, field_dimen, n_grid_cells_x, offsides, collect_stats=False):
+    # attach to the shared tracking arrays (once per worker process)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['arrays'] = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    _worker['ids'] = {'Home': home_ids, 'Away': away_ids}
+    _worker['slices'] = {'Home': slice(0,len(home_ids)), 'Away': slice(len(home_ids),shape[1])}
+    _worker['GKid'] = {'Home': GK_numbers[0], 'Away': GK_numbers[1]}
+    _worker['settings'] = (params, GK_numbers, field_dimen, n_grid_cells_x, offsides)
+    _worker['collect_stats'] = collect_stats
+
+def _release_worker():
+    _worker.pop('arrays', None)
+    _worker.pop('shm').close()
+
+def _pitch_control_task(task):
+    frame_id, row, attacking_teamname, ball_x, ball_y, offside = task
+    params, GK_numbers, field_dimen, n_grid_cells_x, offsides = _worker['settings']
+    assert attacking_teamname in ['Home','Away'], "Team in possession must be either home or away"
+    # diagnostics for this frame only (sent back with the surface and merged into the caller's stats object)
+    stats = mpc.pitch_control_stats() if _worker['collect_stats'] else None
+    if stats is not None:
+        stats.frame = frame_id
+        t0 = time.perf_counter()
+    defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+    teams = {}
+    for teamname in [attacking_teamname, defending_teamname]:
+        frame = _worker['arrays'][row, _worker['slices'][teamname]]
+        teams[teamname] = mpc.team_state(_worker['ids'][teamname], teamname, frame[:,:2], frame[:,2:], params, _worker['GKid'][teamname])
+    ball_start_pos = np.array([ball_x, ball_y])
+    if offsides:
+        teams[attacking_teamname].offside = offside[teams[attacking_teamname].inframe]
+    if stats is not None:
+        stats.time['setup'] += time.perf_counter()-t0
+    PPCFa,_,_ = mpc.generate_pitch_control_for_team_states(teams[attacking_teamname], teams[defending_teamname], ball_start_pos, params, field_dimen, n_grid_cells_x, stats=stats)
+    return PPCFa, stats
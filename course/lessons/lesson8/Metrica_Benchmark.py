@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for benchmarking the speed and accuracy of the pitch control model (Metrica_PitchControl) on synthetic frames.
+Synthetic frames are generated with a chosen number of players per team and 'congestion' (how tightly the outfield players are packed
+around the ball), and the pitch control surface of each frame is calculated with each engine: the original per-cell calculation
+('scalar'), the vectorized engine ('vectorized'), adaptive refinement ('adaptive') and the semi-analytic integrator ('analytic'), as
+well as single calls to calculate_pitch_control_at_target ('target'). For each engine, grid size, number of players and congestion the
+median and 95th percentile time per surface (or per target) is reported, along with the maximum deviation from the reference (euler)
+integrator.
+
+Results can be saved as a JSON baseline, and later runs compared to it to catch regressions in speed or accuracy:
+    python Metrica_Benchmark.py --save baseline.json
+    python Metrica_Benchmark.py --compare baseline.json
+
+Functions
+----------
+generate_synthetic_match(): tracking and event data for a set of independent synthetic frames
+run_benchmark(): time each engine over a range of grid sizes, player numbers and congestion
+save_baseline(): save the results of run_benchmark() as a JSON file
+compare_to_baseline(): list any results that are slower or less accurate than a saved baseline
+"""
+
+import numpy as np
+import pandas as pd
+import json
+import time
+import Metrica_PitchControl as mpc
+
+# engines that can be benchmarked
+ENGINES = ['scalar','vectorized','adaptive','analytic','target']
+
+def generate_synthetic_match(n_frames=10, n_players=11, congestion=0.5, field_dimen=(106.,68.,), seed=0):
+    """ generate_synthetic_match
+
+    Generates tracking data (with velocities) and events for 'n_frames' independent synthetic frames. In each frame the ball is placed at
+    random, the two goalkeepers are near their goals (the home team defends the left goal) and the outfield players are scattered around
+    the ball, more tightly the higher the congestion. Each frame has one event: a pass by the home or away team (alternately) from the ball
+    position to a random position.
+
+    Parameters
+    -----------
+        n_frames: number of frames. Default is 10
+        n_players: number of players in each team (including the goalkeeper). Default is 11
+        congestion: between 0 (outfield players spread over the whole field) and 1 (players within a few metres of the ball). Default is 0.5
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        seed: seed of the random number generator
+
+    Returrns
+    -----------
+        tracking_home: tracking DataFrame for the Home team
+        tracking_away: tracking DataFrame for the Away team
+        events: Dataframe containing the event data
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+    """
+    rng = np.random.default_rng(seed)
+    half = np.array(field_dimen)/2.
+    frames = np.arange(1, n_frames+1)
+    ball = rng.uniform(-0.8, 0.8, (n_frames,2))*half
+    spread = 5. + (1.-congestion)*45. # standard deviation of the outfield player positions about the ball (m)
+    tracking = {}
+    for teamname,goal_x in [('Home',-half[0]),('Away',half[0])]:
+        data = {'Period': np.ones(n_frames,dtype=int), 'Time [s]': (frames-1)*0.04}
+        for pid in range(1, n_players+1):
+            if pid==1:
+                position = np.column_stack( (np.full(n_frames,goal_x*0.95), np.zeros(n_frames)) ) + rng.normal(0,1.,(n_frames,2))
+            else:
+                position = ball + rng.normal(0, spread, (n_frames,2))
+            position = np.clip(position, -half, half)
+            velocity = rng.normal(0, 2., (n_frames,2))
+            name = "%s_%d_" % (teamname,pid)
+            data[name+'x'],data[name+'y'] = position[:,0],position[:,1]
+            data[name+'vx'],data[name+'vy'] = velocity[:,0],velocity[:,1]
+            data[name+'speed'] = np.hypot(velocity[:,0],velocity[:,1])
+        data['ball_x'],data['ball_y'] = ball[:,0],ball[:,1]
+        tracking[teamname] = pd.DataFrame(data, index=pd.Index(frames,name='Frame'))
+    end = rng.uniform(-1, 1, (n_frames,2))*half
+    events = pd.DataFrame( {'Team': np.where(frames%2==1,'Home','Away'), 'Type': 'PASS', 'Period': 1,
+                            'Start Frame': frames, 'End Frame': frames+25, 'Start X': ball[:,0], 'Start Y': ball[:,1], 'End X': end[:,0], 'End Y': end[:,1]} )
+    return tracking['Home'], tracking['Away'], events, ('1','1')
+
+def run_benchmark(engines=ENGINES, grid_sizes=(25,50,100), player_counts=(11,), congestions=(0.,0.5,1.), n_frames=5, n_targets=200, params=None, seed=0, verbose=True):
+    """ run_benchmark
+
+    Times each pitch control engine on synthetic frames (see generate_synthetic_match() ) for every combination of grid size, number of
+    players and congestion, and measures the maximum deviation of its surfaces from the reference (euler) integrator. The reference surfaces
+    are calculated with the vectorized engine, which agrees with the original per-cell calculation to ~1e-15.
+
+    Parameters
+    -----------
+        engines: list of engines to benchmark (see ENGINES). Default is all of them
+        grid_sizes: list of grid sizes (n_grid_cells_x). Default is (25,50,100)
+        player_counts: list of numbers of players in each team. Default is (11,)
+        congestions: list of congestion levels (see generate_synthetic_match() ). Default is (0,0.5,1)
+        n_frames: number of frames (surfaces) timed for each combination. Default is 5
+        n_targets: number of calls to calculate_pitch_control_at_target timed for each combination (engine 'target'). Default is 200
+        params: Dictionary of model parameters. Default is default_model_params()
+        seed: seed of the random number generator
+        verbose: if True, print each result as it is found
+
+    Returrns
+    -----------
+        results: list of dictionaries, one per engine and combination, containing 'engine', 'n_grid_cells_x', 'n_players', 'congestion',
+                 'median_ms' and 'p95_ms' (time per surface, or per target for the 'target' engine) and 'max_deviation'
+    """
+    if params is None:
+        params = mpc.default_model_params()
+    analytic_params = dict(params, integration_method='analytic')
+    results = []
+    for n_players in player_counts:
+        for congestion in congestions:
+            tracking_home,tracking_away,events,GK_numbers = generate_synthetic_match(n_frames, n_players, congestion, seed=seed)
+            for g,n_grid_cells_x in enumerate(grid_sizes):
+                reference = [mpc.generate_pitch_control_for_event(i, events, tracking_home, tracking_away, params, GK_numbers, n_grid_cells_x=n_grid_cells_x, vectorized=True)[0] for i in events.index]
+                for engine in engines:
+                    assert engine in ENGINES, "Unknown engine: %s" % (engine)
+                    if engine=='target' and g>0:
+                        continue # the time per target does not depend on the grid size
+                    if engine=='target':
+                        times,deviation = _time_targets(events, tracking_home, tracking_away, params, GK_numbers, n_targets, seed)
+                    else:
+                        times = []
+                        deviation = 0.
+                        for i in events.index:
+                            options = {'vectorized': engine!='scalar', 'adaptive': engine=='adaptive'}
+                            start = time.perf_counter()
+                            PPCFa,_,_ = mpc.generate_pitch_control_for_event(i, events, tracking_home, tracking_away, analytic_params if engine=='analytic' else params,
+                                                                             GK_numbers, n_grid_cells_x=n_grid_cells_x, **options)
+                            times.append( time.perf_counter()-start )
+                            deviation = max( deviation, float(np.max(np.abs(PPCFa-reference[i]))) )
+                    result = {'engine': engine, 'n_grid_cells_x': n_grid_cells_x, 'n_players': n_players, 'congestion': congestion,
+                              'median_ms': 1000*float(np.median(times)), 'p95_ms': 1000*float(np.percentile(times,95)), 'max_deviation': deviation}
+                    if verbose:
+                        print("%-10s grid %3d  players %2d  congestion %.2f:  median %9.3f ms  p95 %9.3f ms  max deviation %.2e" %
+                              (engine, n_grid_cells_x, n_players, congestion, result['median_ms'], result['p95_ms'], deviation))
+                    results.append(result)
+    return results
+
+def _time_targets(events, tracking_home, tracking_away, params, GK_numbers, n_targets, seed):
+    # time single calls to calculate_pitch_control_at_target at random targets, compared with the vectorized engine at the same targets
+    rng = np.random.default_rng(seed)
+    times = []
+    deviation = 0.
+    for n in range(n_targets):
+        i = events.index[n % len(events)]
+        pass_frame = events.loc[i]['Start Frame']
+        attacking_teamname = events.loc[i].Team
+        ball_start_pos = np.array([events.loc[i]['Start X'],events.loc[i]['Start Y']])
+        target = rng.uniform(-1, 1, 2)*np.array([53.,34.])
+        teams = {}
+        players = {}
+        for teamname,tracking,GKid in [('Home',tracking_home,GK_numbers[0]),('Away',tracking_away,GK_numbers[1])]:
+            players[teamname] = mpc.initialise_players(tracking.loc[pass_frame], teamname, params, GKid)
+            teams[teamname] = mpc.initialise_team_state(tracking.loc[pass_frame], teamname, params, GKid)
+        defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+        attacking_players = mpc.check_offsides(players[attacking_teamname], players[defending_teamname], ball_start_pos, GK_numbers)
+        mpc.check_offsides_team(teams[attacking_teamname], teams[defending_teamname], ball_start_pos, GK_numbers)
+        start = time.perf_counter()
+        PPCFatt,_ = mpc.calculate_pitch_control_at_target(target, attacking_players, players[defending_teamname], ball_start_pos, params)
+        times.append( time.perf_counter()-start )
+        reference,_ = mpc.calculate_pitch_control_at_targets(target[np.newaxis], teams[attacking_teamname], teams[defending_teamname], ball_start_pos, params)
+        deviation = max( deviation, abs(PPCFatt-reference[0]) )
+    return times, float(deviation)
+
+def save_baseline(results, filename):
+    """ save_baseline
+
+    Saves the results of run_benchmark() as a JSON file.
+
+    Parameters
+    -----------
+        results: list of results from run_benchmark()
+        filename: name of the JSON file
+    """
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1)
+
+def compare_to_baseline(results, filename, time_tolerance=1.5, deviation_tolerance=1e-3):
+    """ compare_to_baseline
+
+    Compares the results of run_benchmark() with a baseline saved by save_baseline(), and lists every result that is slower than the
+    baseline by more than a factor of 'time_tolerance' (in median time), or that deviates from the reference integrator by more than
+    'deviation_tolerance' more than the baseline did. Results without a matching baseline entry are ignored.
+
+    Parameters
+    -----------
+        results: list of results from run_benchmark()
+        filename: name of the JSON baseline file
+        time_tolerance: largest acceptable ratio of the median time to that of the baseline. Default is 1.5
+        deviation_tolerance: largest acceptable increase in the maximum deviation from the reference integrator. Default is 1e-3
+
+    Returrns
+    -----------
+        regressions: list of messages describing each regression (empty if there are none)
+    """
+    with open(filename) as f:
+        baseline = json.load(f)
+    key = lambda r: (r['engine'], r['n_grid_cells_x'], r['n_players'], r['congestion'])
+    baseline = {key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = baseline.get(key(r))
+        if b is None:
+            continue
+        name = "%s (grid %d, %d players, congestion %.2f)" % key(r)
+        if r['median_ms'] > time_tolerance*b['median_ms']:
+            regressions.append( "%s: median time %.3f ms, baseline %.3f ms" % (name, r['median_ms'], b['median_ms']) )
+        if r['max_deviation'] > b['max_deviation'] + deviation_tolerance:
+            regressions.append( "%s: max deviation %.2e, baseline %.2e" % (name, r['max_deviation'], b['max_deviation']) )
+    return regressions
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Benchmark the pitch control model on synthetic frames")
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--grid-sizes', nargs='+', type=int, default=[25,50,100])
+    parser.add_argument('--players', nargs='+', type=int, default=[11])
+    parser.add_argument('--congestion', nargs='+', type=float, default=[0.,0.5,1.])
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--save', metavar='BASELINE', help="save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare the results with a JSON baseline (exit code 1 if there are regressions)")
+    args = parser.parse_args()
+    results = run_benchmark(args.engines, args.grid_sizes, args.players, args.congestion, args.frames)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        regressions = compare_to_baseline(results, args.compare)
+        for message in regressions:
+            print("REGRESSION: " + message)
+        sys.exit( 1 if regressions else 0 )
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for caching pitch control surfaces, so that they are not recalculated each time the same frame is analysed (for example
+when re-running a notebook, or evaluating several EPV quantities at the same event).
+Surfaces are identified by the match, frame, team in possession, ball start position, a hash of the model parameters, the grid and 
+the offsides flag, so changing any of these automatically gives a different cache entry. Recently used surfaces are kept in memory (up to 'maxsize'
+surfaces) and, if a cache directory is given, every surface is also stored on disk and memory-mapped when read back.
+Functions
+----------
+params_hash(): a short hash of a dictionary of model parameters
+Classes
+---------
+The 'pitch_control_cache' class stores pitch control surfaces in memory and (optionally) on disk.
+"""
+
+import numpy as np
+import collections
+import hashlib
+import os
+
+def params_hash(params):
+    """ params_hash
+
+    Returns a short hash of a dictionary of model parameters (default model parameters can be generated using Metrica_PitchControl.default_model_params() )
+    Any change to any of the parameters gives a different hash.
+
+    Parameters
+    -----------
+        params: Dictionary of model parameters
+
+    Returrns
+    -----------
+        hash: hexadecimal string
+    """
+    # (individual player parameters are dictionaries, which are sorted so that the order they were filled in does not matter)
+    items = [ (k, sorted(params[k].items()) if isinstance(params[k],dict) else np.asarray(params[k]).tolist()) for k in sorted(params) ]
+    return hashlib.sha1( repr(items).encode() ).hexdigest()[:16]
+
+class pitch_control_cache(object):
+    """
+    pitch_control_cache() class
+
+    Least-recently-used cache of pitch control surfaces, with an optional persistent store on disk (one .npy file per surface,
+    memory-mapped when read). Pass an instance as the 'cache' argument of Metrica_PitchControl.generate_pitch_control_for_event() or the
+    batch functions in Metrica_Batch.
+
+    The ball start position is part of the key (to the nearest cm), as the same frame is evaluated from the ball position in the tracking
+    data by some functions (e.g. Metrica_Batch.generate_pitch_control_for_frames() ) and from the event start position by others
+    (e.g. Metrica_PitchControl.generate_pitch_control_for_event() ).
+
+    __init__ Parameters
+    -----------
+    match_id: identifier of the match (e.g. the Metrica game_id), included in every key. Required when 'cachedir' is given, as surfaces
+        of different matches would otherwise share keys on disk (one cache directory can then be safely reused for several matches)
+    maxsize: maximum number of surfaces kept in memory. Default is 256
+    cachedir: directory of the on-disk store. Default is None (memory only)
+
+    methods include:
+    -----------
+    key(frame, attacking_team, params, field_dimen, n_grid_cells_x, offsides, mode, ball_start_pos): the cache key of a pitch control surface
+    get(key): the cached surface for 'key' (None if not cached)
+    put(key, PPCFa): add a surface to the cache
+
+    """
+    def __init__(self, match_id=None, maxsize=256, cachedir=None):
+        assert cachedir is None or match_id is not None, "a match_id is required when pitch control surfaces are stored on disk"
+        self.match_id = match_id
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if cachedir is not None:
+            os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, frame, attacking_team, params, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, mode='', ball_start_pos=None):
+        # 'mode' distinguishes surfaces evaluated with different approximations (e.g. adaptive refinement)
+        # the ball start position is rounded to the nearest cm (None or NaN: the ball is assumed to be at each target)
+        ball = 'nan' if ball_start_pos is None or np.any(np.isnan(ball_start_pos)) else '%.2f_%.2f' % (ball_start_pos[0], ball_start_pos[1])
+        return "%s_%d_%s_%s_%gx%g_%d_%d_b%s%s" % (self.match_id, frame, attacking_team, params_hash(params), field_dimen[0], field_dimen[1], n_grid_cells_x, offsides, ball, mode)
+
+    def get(self, key):
+        if key in self.surfaces:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return self.surfaces[key]
+        fname = self.filename(key)
+        if fname is not None and os.path.exists(fname):
+            PPCFa = np.load(fname, mmap_mode='r')
+            self.remember(key, PPCFa)
+            self.hits += 1
+            return PPCFa
+        self.misses += 1
+        return None
+
+    def put(self, key, PPCFa):
+        fname = self.filename(key)
+        if fname is not None and not os.path.exists(fname):
+            # write to a temporary file first, so that a partly written file is never read
+            tmpname = fname[:-4] + '.%d.tmp.npy' % os.getpid()
+            np.save(tmpname, PPCFa)
+            os.replace(tmpname, fname)
+        self.remember(key, PPCFa)
+
+    def remember(self, key, PPCFa):
+        self.surfaces[key] = PPCFa
+        self.surfaces.move_to_end(key)
+        while len(self.surfaces)>self.maxsize:
+            self.surfaces.popitem(last=False)
+
+    def filename(self, key):
+        if self.cachedir is None:
+            return None
+        return os.path.join(self.cachedir, key + '.npy')
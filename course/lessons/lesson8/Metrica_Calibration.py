@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for calibrating the ball control parameters of the pitch control model (lambda_att, lambda_def, lambda_gk and tti_sigma, see
+Metrica_PitchControl.default_model_params) by maximising the likelihood of the outcome of every pass in a match: the probability that
+the passing team controls the ball at the end of a successful pass, and that the opposition controls it at the end of an unsuccessful one.
+
+The arrival times of every player at the end of every pass do not depend on these parameters, so they are calculated once
+(calculate_pass_arrival_times). The pitch control model is then solved for all passes, and for several sets of parameters at once,
+in a single vectorized integration (pass_log_likelihood). This also gives the finite-difference gradient used by the optimizer
+in one call, so that fitting a full match takes seconds.
+
+Functions
+----------
+calculate_pass_arrival_times(): arrival time of each player, and the ball, at the end of each pass
+pass_log_likelihood(): log-likelihood of the pass outcomes for a batch of parameter sets
+fit_pitch_control_params(): the parameters that maximise the likelihood of the pass outcomes
+"""
+
+import numpy as np
+import scipy.optimize as optimize
+import Metrica_PitchControl as mpc
+
+# parameters that can be fitted (in the order of the columns of the parameter sets passed to pass_log_likelihood)
+FIT_PARAMS = ['lambda_att','lambda_def','lambda_gk','tti_sigma']
+
+def calculate_pass_arrival_times(event_ids, events, tracking_home, tracking_away, params, GK_numbers, offsides=True):
+    """ calculate_pass_arrival_times
+
+    Calculates the arrival time of every player at the end position of each pass, and the ball travel time, at the start frame of the pass.
+    Offside players of the passing team are left out. These only depend on the players' speed and reaction time, so they can be reused
+    to evaluate the likelihood for any values of the ball control parameters.
+
+    Parameters
+    -----------
+        event_ids: indices of the passes in 'events'. Passes with event Type 'PASS' are treated as successful, and any other (e.g. 'BALL LOST')
+                   as unsuccessful (the ball was controlled by the other team at the end position)
+        events: Dataframe containing the event data
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+
+    Returrns
+    -----------
+        passes: dictionary containing the following arrays (with one column per pass, and rows padded to the largest number of players):
+                'tau': (n_players,n_passes) arrival times (passing team first, then the other team)
+                'attacking': (n_players,n_passes) True for players of the passing team
+                'gk': (n_players,n_passes) True for the goalkeeper of the other team
+                'player': (n_players,n_passes) True for rows that are players (rather than padding)
+                'ball_travel_time': (n_passes,) ball travel times
+                'success': (n_passes,) True for successful passes
+                'event_ids': (n_passes,) the event id of each pass
+    """
+    event_ids = np.asarray(event_ids)
+    frames = events.loc[event_ids,'Start Frame'].values
+    teams = events.loc[event_ids,'Team'].values
+    start = events.loc[event_ids,['Start X','Start Y']].to_numpy(dtype=float)
+    end = events.loc[event_ids,['End X','End Y']].to_numpy(dtype=float)
+    if offsides:
+        offside_masks,_ = mpc.calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames, start)
+    columns = {'Home': mpc.get_team_columns(tracking_home, 'Home'), 'Away': mpc.get_team_columns(tracking_away, 'Away')}
+    tracking = {'Home': tracking_home, 'Away': tracking_away}
+    GKid = {'Home': GK_numbers[0], 'Away': GK_numbers[1]}
+    tau = []
+    for i,(frame,attacking_teamname) in enumerate(zip(frames,teams)):
+        assert attacking_teamname in ['Home','Away'], "Team in possession must be either home or away"
+        defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+        attacking_team = mpc.initialise_team_state(tracking[attacking_teamname].loc[frame], attacking_teamname, params, GKid[attacking_teamname], columns[attacking_teamname])
+        defending_team = mpc.initialise_team_state(tracking[defending_teamname].loc[frame], defending_teamname, params, GKid[defending_teamname], columns[defending_teamname])
+        onside = ~offside_masks[attacking_teamname][i][attacking_team.inframe] if offsides else np.ones(len(attacking_team.ids),dtype=bool)
+        tau.append( ( attacking_team.time_to_intercept(end[i:i+1])[onside,0], defending_team.time_to_intercept(end[i:i+1])[:,0], defending_team.is_gk ) )
+    n_players = max( [len(a)+len(d) for a,d,_ in tau] + [0] )
+    passes = {'tau': np.zeros( (n_players,len(tau)) ), 'attacking': np.zeros( (n_players,len(tau)), dtype=bool ),
+              'gk': np.zeros( (n_players,len(tau)), dtype=bool ), 'player': np.zeros( (n_players,len(tau)), dtype=bool )}
+    for i,(tau_att,tau_def,is_gk) in enumerate(tau):
+        n_att,n_def = len(tau_att),len(tau_def)
+        passes['tau'][:n_att+n_def,i] = np.concatenate( (tau_att,tau_def) )
+        passes['attacking'][:n_att,i] = True
+        passes['gk'][n_att:n_att+n_def,i] = is_gk
+        passes['player'][:n_att+n_def,i] = True
+    passes['ball_travel_time'] = mpc.calculate_ball_travel_time(end, start, params)
+    passes['success'] = events.loc[event_ids,'Type'].values=='PASS'
+    passes['event_ids'] = event_ids
+    return passes
+
+def pass_log_likelihood(passes, param_sets, params, chunk_size=512, min_probability=1e-4):
+    """ pass_log_likelihood
+
+    Log-likelihood of the outcomes of a set of passes, for each of a batch of parameter sets. The pitch control model is solved at the end
+    of every pass for every parameter set in one vectorized calculation (with every player included, and no 'short-cut' tests, so that
+    the likelihood is a smooth function of the parameters).
+
+    Parameters
+    -----------
+        passes: arrival times at the end of each pass (see calculate_pass_arrival_times() )
+        param_sets: (n_sets,4) array of parameter sets, each giving lambda_att, lambda_def, lambda_gk and tti_sigma (see FIT_PARAMS)
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() ). Sets the integration
+                method and timestep
+        chunk_size: number of (pass, parameter set) pairs integrated together. Default is 512
+        min_probability: probabilities of the observed outcome are not allowed to be lower than this, so that a single unexpected pass does
+                         not dominate the likelihood. Default is 1e-4
+
+    Returrns
+    -----------
+        log_likelihood: (n_sets,) array of the log-likelihood of the pass outcomes for each parameter set
+    """
+    param_sets = np.atleast_2d( np.asarray(param_sets, dtype=float) )
+    n_sets,n_passes = len(param_sets),len(passes['success'])
+    # one column for each (parameter set, pass) pair
+    tau = np.tile( passes['tau'], n_sets )
+    attacking = np.tile( passes['attacking'], n_sets )
+    gk = np.tile( passes['gk'], n_sets )
+    player = np.tile( passes['player'], n_sets )
+    ball_travel_time = np.tile( passes['ball_travel_time'], n_sets )
+    lambda_att,lambda_def,lambda_gk,tti_sigma = [ np.repeat(param_sets[:,i], n_passes) for i in range(4) ]
+    lam = np.where( attacking, lambda_att, np.where(gk, lambda_gk, lambda_def) ) * player
+    solve = mpc.get_pitch_control_solver(params)
+    PPCFatt = np.zeros( len(ball_travel_time) )
+    PPCFdef = np.zeros( len(ball_travel_time) )
+    for start in range(0, len(ball_travel_time), chunk_size):
+        cells = slice(start, start+chunk_size)
+        PPCF,_,_ = solve(tau[:,cells], lam[:,cells], ball_travel_time[cells], params, tti_sigma=tti_sigma[cells])
+        PPCFatt[cells] = np.sum( PPCF*attacking[:,cells], axis=0 )
+        PPCFdef[cells] = np.sum( PPCF*~attacking[:,cells], axis=0 )
+    success = np.tile( passes['success'], n_sets )
+    probability = np.where( success, PPCFatt, PPCFdef )
+    return np.log( np.maximum(probability, min_probability) ).reshape(n_sets, n_passes).sum(axis=1)
+
+def fit_pitch_control_params(passes, params, fit=FIT_PARAMS, bounds=None, rel_step=1e-3, verbose=False):
+    """ fit_pitch_control_params
+
+    Finds the ball control parameters that maximise the likelihood of the pass outcomes (see pass_log_likelihood() ), using L-BFGS-B.
+    At each step the likelihood and its finite-difference gradient are evaluated together in one vectorized call.
+
+    Parameters
+    -----------
+        passes: arrival times at the end of each pass (see calculate_pass_arrival_times() )
+        params: Dictionary of model parameters, giving the starting point of the fit and the values of any parameters that are not fitted
+        fit: list of the parameters to fit (any of 'lambda_att', 'lambda_def', 'lambda_gk' and 'tti_sigma'). Default is all of them
+        bounds: optional dictionary of (lower,upper) bounds for each fitted parameter. Default is (0.1,50) for the lambdas and (0.05,2) for tti_sigma
+        rel_step: relative step used for the finite-difference gradient. Default is 1e-3
+        verbose: if True, print the log-likelihood at each evaluation
+
+    Returrns
+    -----------
+        fitted_params: copy of params with the fitted values, with kappa_def and the 'short-cut' parameters time_to_control_att/def updated to match
+        log_likelihood: the maximum log-likelihood
+    """
+    default_bounds = {'lambda_att': (0.1,50.), 'lambda_def': (0.1,50.), 'lambda_gk': (0.1,50.), 'tti_sigma': (0.05,2.)}
+    if bounds is not None:
+        default_bounds.update(bounds)
+    columns = [FIT_PARAMS.index(p) for p in fit]
+    base = np.array( [params[p] for p in FIT_PARAMS], dtype=float )
+    def param_sets(x, steps):
+        # parameter set x, followed by one set for each fitted parameter with a small step in that parameter
+        sets = np.tile( base, (1+len(steps),1) )
+        sets[:,columns] = x
+        for i,h in enumerate(steps):
+            sets[1+i,columns[i]] += h
+        return sets
+    def objective(x):
+        steps = rel_step*np.maximum(np.abs(x),1e-2)
+        log_likelihood = pass_log_likelihood(passes, param_sets(x,steps), params)
+        if verbose:
+            print("%s: log-likelihood %1.3f" % (', '.join('%s=%1.3f' % (p,v) for p,v in zip(fit,x)), log_likelihood[0]))
+        return -log_likelihood[0], -(log_likelihood[1:]-log_likelihood[0])/steps
+    result = optimize.minimize(objective, base[columns], jac=True, method='L-BFGS-B', bounds=[default_bounds[p] for p in fit])
+    fitted_params = dict(params)
+    for p,v in zip(fit,result.x):
+        fitted_params[p] = float(v)
+    fitted_params['kappa_def'] = fitted_params['lambda_def']/fitted_params['lambda_att']
+    # keep the same 'time_to_control_veto' (see default_model_params() )
+    veto_factor = params['time_to_control_att'] / (np.sqrt(3)*params['tti_sigma']/np.pi + 1/params['lambda_att'])
+    fitted_params['time_to_control_att'] = veto_factor * (np.sqrt(3)*fitted_params['tti_sigma']/np.pi + 1/fitted_params['lambda_att'])
+    fitted_params['time_to_control_def'] = veto_factor * (np.sqrt(3)*fitted_params['tti_sigma']/np.pi + 1/fitted_params['lambda_def'])
+    return fitted_params, -result.fun
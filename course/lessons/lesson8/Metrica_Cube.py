@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for storing the pitch control surfaces of many frames (e.g. a full match) compactly on disk as a single 'cube'
+(frames x n_grid_cells_y x n_grid_cells_x), and reading them back instantly using a memory map.
+Surfaces can be stored as float32, or quantized to uint8 (steps of 1/255) or uint16 (steps of 1/65535). A full match at 25Hz on
+a 50x32 grid is about 17GB in float64, 5.5GB in float32 and 1.4GB in uint8.
+
+File layout: a header (a text header containing the grid, storage type, scale factor, hash of the model parameters
+and the location of the other blocks), followed by the surfaces (written in chunks of frames as they are calculated),
+followed by the frame number of each surface.
+
+Functions
+----------
+write_pitch_control_cube(): write a sequence of (frame, surface) pairs (e.g. from Metrica_Batch) to a cube file
+Classes
+---------
+The 'pitch_control_cube' class reads a cube file.
+"""
+
+import numpy as np
+import json
+import Metrica_Cache as mcache
+
+# file signature; the header block is padded to a multiple of _HEADER_BLOCK bytes
+_MAGIC = b'PCCUBE1\n'
+_HEADER_BLOCK = 4096
+
+# supported storage types (and the value that represents a pitch control probability of 1)
+_STORAGE = {'float32': 1., 'uint8': 255., 'uint16': 65535.}
+
+def write_pitch_control_cube(filename, surfaces, xgrid, ygrid, params, dtype='float32', chunk_frames=250):
+    """ write_pitch_control_cube
+
+    Writes a sequence of pitch control surfaces to a cube file. Surfaces are written to disk in chunks as they arrive, so the
+    whole match never needs to be held in memory.
+
+    Parameters
+    -----------
+        filename: name of the cube file
+        surfaces: iterable of (frame, PPCFa) pairs, e.g. the output of Metrica_Batch.generate_pitch_control_for_frames()
+        xgrid: Positions of the pixels in the x-direction (field length)
+        ygrid: Positions of the pixels in the y-direction (field width)
+        params: Dictionary of model parameters used to calculate the surfaces (only a hash is stored)
+        dtype: storage type, 'float32', 'uint8' or 'uint16'. Default is 'float32'
+        chunk_frames: number of surfaces buffered before each write. Default is 250 (10 seconds at 25Hz)
+
+    Returrns
+    -----------
+        n_frames: the number of surfaces written
+    """
+    assert dtype in _STORAGE, "Storage type must be one of %s" % ', '.join(_STORAGE)
+    vmax = _STORAGE[dtype]
+    shape = (len(ygrid),len(xgrid))
+    frames = []
+    header = {'dtype': dtype, 'scale': 1./vmax, 'shape': [0,shape[0],shape[1]],
+              'xgrid': np.asarray(xgrid,dtype=float).tolist(), 'ygrid': np.asarray(ygrid,dtype=float).tolist(), 'params_hash': mcache.params_hash(params),
+              'index_offset': 0}
+    # reserve space for the header (the number of frames and location of the frame index are filled in at the end)
+    header_size = _HEADER_BLOCK * ( (len(_MAGIC) + 8 + len(json.dumps(header)) + 64) // _HEADER_BLOCK + 1 )
+    with open(filename, 'wb') as f:
+        f.write( b'\0'*header_size )
+        chunk = []
+        for frame,PPCFa in surfaces:
+            assert np.shape(PPCFa)==shape, "Surface for frame %d does not match the grid" % (frame)
+            frames.append(frame)
+            chunk.append(PPCFa)
+            if len(chunk)==chunk_frames:
+                f.write( _quantize(np.stack(chunk), dtype, vmax).tobytes() )
+                chunk = []
+        if len(chunk)>0:
+            f.write( _quantize(np.stack(chunk), dtype, vmax).tobytes() )
+        index_offset = f.tell()
+        f.write( np.asarray(frames, dtype='<i8').tobytes() )
+        header['shape'][0] = len(frames)
+        header['index_offset'] = index_offset
+        f.seek(0)
+        f.write( _MAGIC + np.int64(header_size).astype('<i8').tobytes() + json.dumps(header).encode() )
+    return len(frames)
+
+def _quantize(PPCF, dtype, vmax):
+    if dtype=='float32':
+        return PPCF.astype('<f4')
+    return np.rint( np.clip(PPCF,0.,1.)*vmax ).astype( '<'+np.dtype(dtype).str[1:] )
+
+class pitch_control_cube(object):
+    """
+    pitch_control_cube() class
+
+    Read access to a cube file written by write_pitch_control_cube(). The surfaces are memory-mapped, so opening a cube is
+    instant and only the frames that are used are read from disk.
+
+    __init__ Parameters
+    -----------
+    filename: name of the cube file
+
+    Attributes include:
+    -----------
+    frames: frame number of each surface in the cube
+    xgrid, ygrid: positions of the pixels in the x and y directions
+    params_hash: hash of the model parameters used (compare with Metrica_Cache.params_hash(params) )
+    dtype, scale: storage type, and the pitch control probability of one storage unit
+    data: memory-mapped (n_frames,n_grid_cells_y,n_grid_cells_x) array of stored values
+
+    methods include:
+    -----------
+    index(frame): the position of 'frame' in the cube
+    raw(start_frame, stop_frame): stored (not rescaled) values of a range of frames, without copying
+    surface(frame): the pitch control surface (float32) of a frame
+    surfaces(frames): the pitch control surfaces of several frames
+
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            assert f.read(len(_MAGIC))==_MAGIC, "%s is not a pitch control cube" % (filename)
+            header_size = int( np.frombuffer(f.read(8), dtype='<i8')[0] )
+            header = json.loads( f.read(header_size-len(_MAGIC)-8).rstrip(b'\0').decode() )
+        self.filename = filename
+        self.dtype = header['dtype']
+        self.scale = header['scale']
+        self.xgrid = np.array(header['xgrid'])
+        self.ygrid = np.array(header['ygrid'])
+        self.params_hash = header['params_hash']
+        n_frames = header['shape'][0]
+        self.frames = np.memmap(filename, dtype='<i8', mode='r', offset=header['index_offset'], shape=(n_frames,)) if n_frames>0 else np.zeros(0,dtype=int)
+        self.data = np.memmap(filename, dtype='<'+np.dtype(self.dtype).str[1:], mode='r', offset=header_size, shape=tuple(header['shape'])) if n_frames>0 else np.zeros(header['shape'],dtype=self.dtype)
+        # frames are usually written in increasing order, which allows a binary search
+        self.sorted = bool( np.all(np.diff(self.frames)>0) )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def index(self, frame):
+        if self.sorted:
+            i = np.searchsorted(self.frames, frame)
+            if i<len(self.frames) and self.frames[i]==frame:
+                return int(i)
+        else:
+            i = np.flatnonzero(self.frames==frame)
+            if len(i)>0:
+                return int(i[0])
+        raise KeyError("Frame %d is not in the cube" % (frame))
+
+    def raw(self, start_frame, stop_frame):
+        # stored values of all frames from start_frame up to (not including) stop_frame; a view of the memory map
+        assert self.sorted, "Frames in the cube are not in order"
+        return self.data[ np.searchsorted(self.frames, start_frame) : np.searchsorted(self.frames, stop_frame) ]
+
+    def surface(self, frame):
+        values = self.data[self.index(frame)]
+        if self.dtype=='float32':
+            return values
+        return values.astype('float32') * np.float32(self.scale)
+
+    def surfaces(self, frames):
+        values = self.data[ [self.index(frame) for frame in frames] ]
+        if self.dtype=='float32':
+            return values
+        return values.astype('float32') * np.float32(self.scale)
@@ -15,15 +15,21 @@ Data can be found at: https://github.com/metrica-sports/sample-data
 Main Functions
 ----------
 load_EPV_grid(): load pregenerated EPV surface from file. 
+get_EPV_at_locations(): EPV values (nearest cell or bilinear interpolation) at an array of locations
 calculate_epv_added(): Calculates the expected possession value added by a pass
+calculate_epv_added_for_passes(): Calculates the expected possession value added by every pass in a list (e.g. all the passes in a match)
 find_max_value_added_target(): Finds the *maximum* expected possession value that could have been achieved for a pass (defined by the event_id) by searching the entire field for the best target.
+find_top_pass_options(): Finds the best few (well separated) targets, or teammates, that could have been passed to at each of a list of events
+select_top_options(): Selects the best few of a set of options that are at least a given distance apart
     
 @author: Laurie Shaw (@EightyFivePoint)
 """
 
 import numpy as np
+import pandas as pd
 import Metrica_PitchControl as mpc
 import Metrica_IO as mio
+import Metrica_Batch as mbatch
 
 def load_EPV_grid(fname='EPV_grid.csv'):
     """ load_EPV_grid(fname='EPV_grid.csv')
@@ -73,7 +79,55 @@ def get_EPV_at_location(position,EPV,attack_direction,field_dimen=(106.,68.)):
         iy = (y+field_dimen[1]/2.-0.0001)/dy
         return EPV[int(iy),int(ix)]
     
-def calculate_epv_added( event_id, events, tracking_home, tracking_away, GK_numbers, EPV, params):
+def get_EPV_at_locations(positions, EPV, attack_direction, field_dimen=(106.,68.), interpolation='nearest'):
+    """ get_EPV_at_locations
+    
+    Returns the EPV value at each of an array of (x,y) locations (the vectorized version of get_EPV_at_location() ). Rather than flipping 
+    the EPV grid for teams attacking right->left, the column (or x position) that is looked up is mirrored.
+    
+    Parameters
+    -----------
+        positions: (N,2) array of (x,y) pitch positions
+        EPV: tuple Expected Possession value grid (loaded using load_EPV_grid() )
+        attack_direction: attack direction (1: left->right, -1: right->left), either a single value or an (N,) array with one per position
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        interpolation: 'nearest' to use the value of the grid cell containing each position (as get_EPV_at_location() ), or 'bilinear'
+                       to interpolate between the centres of the surrounding cells. Default is 'nearest'
+            
+    Returrns
+    -----------
+        EPV_values: (N,) array of EPV values at the input positions (zero for positions off the field, NaN for NaN positions)
+        
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1,2)
+    direction = np.broadcast_to( np.asarray(attack_direction), (len(positions),) )
+    x,y = positions[:,0],positions[:,1]
+    ny,nx = EPV.shape
+    dx = field_dimen[0]/float(nx)
+    dy = field_dimen[1]/float(ny)
+    EPV_values = np.zeros( len(positions) )
+    EPV_values[ np.isnan(x) | np.isnan(y) ] = np.nan
+    with np.errstate(invalid='ignore'):
+        on_field = (np.abs(x)<=field_dimen[0]/2.) & (np.abs(y)<=field_dimen[1]/2.) # Positions off the field have zero EPV
+    x,y,direction = x[on_field],y[on_field],direction[on_field]
+    if interpolation=='nearest':
+        ix = np.clip( ((x+field_dimen[0]/2.-0.0001)/dx).astype(int), 0, nx-1 )
+        iy = np.clip( ((y+field_dimen[1]/2.-0.0001)/dy).astype(int), 0, ny-1 )
+        ix = np.where( direction==-1, nx-1-ix, ix )
+        EPV_values[on_field] = EPV[iy,ix]
+    else:
+        assert interpolation=='bilinear', "Unknown interpolation: %s" % (interpolation)
+        # position in units of cells from the centre of the first cell (mirrored for teams attacking right->left)
+        fx = np.clip( (np.where(direction==-1,-x,x)+field_dimen[0]/2.)/dx-0.5, 0., nx-1. )
+        fy = np.clip( (y+field_dimen[1]/2.)/dy-0.5, 0., ny-1. )
+        ix = np.minimum( fx.astype(int), nx-2 ) if nx>1 else np.zeros(len(fx),dtype=int)
+        iy = np.minimum( fy.astype(int), ny-2 ) if ny>1 else np.zeros(len(fy),dtype=int)
+        wx,wy = fx-ix,fy-iy
+        ix1,iy1 = np.minimum(ix+1,nx-1),np.minimum(iy+1,ny-1)
+        EPV_values[on_field] = (1-wy)*( (1-wx)*EPV[iy,ix] + wx*EPV[iy,ix1] ) + wy*( (1-wx)*EPV[iy1,ix] + wx*EPV[iy1,ix1] )
+    return EPV_values
+
+def calculate_epv_added( event_id, events, tracking_home, tracking_away, GK_numbers, EPV, params, pass_risk=False):
     """ calculate_epv_added
     
     Calculates the expected possession value added by a pass
@@ -87,6 +141,8 @@ def calculate_epv_added( event_id, events, tracking_home, tracking_away, GK_numb
         GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
         EPV: tuple Expected Possession value grid (loaded using load_EPV_grid() )
         params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        pass_risk: If True, also discount the EPV at the target by the probability that the pass is intercepted on the way 
+                   (see Metrica_PitchControl.calculate_pass_interception_probability() ). Default is False
         
     Returrns
     -----------
@@ -103,18 +159,21 @@ def calculate_epv_added( event_id, events, tracking_home, tracking_away, GK_numb
     home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
     if pass_team=='Home':
         attack_direction = home_attack_direction
-        attacking_players = mpc.initialise_players(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
-        defending_players = mpc.initialise_players(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
+        attacking_team = mpc.initialise_team_state(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        defending_team = mpc.initialise_team_state(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
     elif pass_team=='Away':
         attack_direction = home_attack_direction*-1
-        defending_players = mpc.initialise_players(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
-        attacking_players = mpc.initialise_players(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])    
+        defending_team = mpc.initialise_team_state(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        attacking_team = mpc.initialise_team_state(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])    
     # flag any players that are offside
-    attacking_players = mpc.check_offsides( attacking_players, defending_players, pass_start_pos, GK_numbers)
-    # pitch control grid at pass start location
-    Patt_start,_ = mpc.calculate_pitch_control_at_target(pass_start_pos, attacking_players, defending_players, pass_start_pos, params)
-    # pitch control grid at pass end location
-    Patt_target,_ = mpc.calculate_pitch_control_at_target(pass_target_pos, attacking_players, defending_players, pass_start_pos, params)
+    attacking_team = mpc.check_offsides_team( attacking_team, defending_team, pass_start_pos, GK_numbers)
+    # pitch control at pass start and end locations (in a single call)
+    Patt,_ = mpc.calculate_pitch_control_at_targets(np.array([pass_start_pos,pass_target_pos]), attacking_team, defending_team, pass_start_pos, params)
+    Patt_start,Patt_target = Patt
+    if pass_risk:
+        # probability that the pass reaches the target
+        P_intercept,_ = mpc.calculate_pass_interception_probability(pass_start_pos, pass_target_pos, defending_team, params)
+        Patt_target = Patt_target*(1-P_intercept[0])
     
     # EPV at start location
     EPV_start = get_EPV_at_location(pass_start_pos, EPV, attack_direction=attack_direction)
@@ -133,11 +192,74 @@ def calculate_epv_added( event_id, events, tracking_home, tracking_away, GK_numb
 
     return EEPV_added, EPV_difference
 
-def find_max_value_added_target( event_id, events, tracking_home, tracking_away, GK_numbers, EPV, params ):
+def calculate_epv_added_for_passes( event_ids, events, tracking_home, tracking_away, GK_numbers, EPV, params, pass_risk=False):
+    """ calculate_epv_added_for_passes
+    
+    Calculates the expected possession value added by each pass in a list (see calculate_epv_added() ). The direction of play, the 
+    tracking data columns of each team and the offside players at every pass are found once for all passes, rather than for each pass.
+    
+    Parameters
+    -----------
+        event_ids: list of indices (not rows) of the pass events, e.g. every pass in a match
+        events: Dataframe containing the event data
+        tracking_home: tracking DataFrame for the Home team
+        tracking_away: tracking DataFrame for the Away team
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        EPV: tuple Expected Possession value grid (loaded using load_EPV_grid() )
+        params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        pass_risk: If True, also discount the EPV at the target by the probability that the pass is intercepted on the way 
+                   (see Metrica_PitchControl.calculate_pass_interception_probability() ). Default is False
+        
+    Returrns
+    -----------
+        EEPV_added: (n_passes,) array of the expected EPV value-added of each pass
+        EPV_difference: (n_passes,) array of the raw change in EPV (ignoring pitch control) between end and start points of each pass
+    """
+    event_ids = np.asarray(event_ids)
+    frames = events.loc[event_ids,'Start Frame'].values
+    teams = events.loc[event_ids,'Team'].values
+    pass_start_pos = events.loc[event_ids,['Start X','Start Y']].to_numpy(dtype=float)
+    pass_target_pos = events.loc[event_ids,['End X','End Y']].to_numpy(dtype=float)
+    # match-level context: direction of play, tracking data columns and offside players at every pass
+    home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
+    attack_direction = {'Home': home_attack_direction, 'Away': -home_attack_direction}
+    columns = {'Home': mpc.get_team_columns(tracking_home, 'Home'), 'Away': mpc.get_team_columns(tracking_away, 'Away')}
+    values = {'Home': tracking_home.to_numpy(dtype=float), 'Away': tracking_away.to_numpy(dtype=float)}
+    rows = tracking_home.index.get_indexer(frames)
+    GKid = {'Home': GK_numbers[0], 'Away': GK_numbers[1]}
+    offside_masks,_ = mpc.calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames, pass_start_pos)
+    # EPV at start and end locations of every pass
+    directions = np.array( [attack_direction[team] for team in teams] )
+    EPV_start = get_EPV_at_locations(pass_start_pos, EPV, directions)
+    EPV_target = get_EPV_at_locations(pass_target_pos, EPV, directions)
+    Patt_start = np.zeros( len(event_ids) )
+    Patt_target = np.zeros( len(event_ids) )
+    for i,(row,attacking_teamname) in enumerate(zip(rows,teams)):
+        assert attacking_teamname in ['Home','Away'], "Team in possession must be either home or away"
+        defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+        attacking_team = mpc.initialise_team_state(values[attacking_teamname][row], attacking_teamname, params, GKid[attacking_teamname], columns[attacking_teamname])
+        defending_team = mpc.initialise_team_state(values[defending_teamname][row], defending_teamname, params, GKid[defending_teamname], columns[defending_teamname])
+        attacking_team.offside = offside_masks[attacking_teamname][i][attacking_team.inframe]
+        # pitch control at pass start and end locations (in a single call)
+        Patt,_ = mpc.calculate_pitch_control_at_targets(np.array([pass_start_pos[i],pass_target_pos[i]]), attacking_team, defending_team, pass_start_pos[i], params)
+        Patt_start[i],Patt_target[i] = Patt
+        if pass_risk:
+            P_intercept,_ = mpc.calculate_pass_interception_probability(pass_start_pos[i], pass_target_pos[i], defending_team, params)
+            Patt_target[i] *= 1-P_intercept[0]
+    EEPV_added = Patt_target*EPV_target - Patt_start*EPV_start
+    EPV_difference = EPV_target - EPV_start
+    return EEPV_added, EPV_difference
+
+def find_max_value_added_target( event_id, events, tracking_home, tracking_away, GK_numbers, EPV, params, cache=None, pass_risk=False, branch_and_bound=False, stats=None ):
     """ find_max_value_added_target
     
     Finds the *maximum* expected possession value that could have been achieved for a pass (defined by the event_id) by searching the entire field for the best target.
     
+    With branch_and_bound=True, the full pitch control surface is not calculated. Since pitch control is at most 1, the EPV of each cell 
+    is an upper bound on its expected EPV. Cells are evaluated in batches (of increasing size) in order of decreasing EPV, and the search 
+    stops as soon as no remaining cell has a higher EPV than the best expected EPV found so far. This gives the same maximum and location
+    (evaluated with the vectorized pitch control model), usually after evaluating a small fraction of the cells.
+    
     Parameters
     -----------
         event_id: Index (not row) of the pass event to calculate EPV-added score
@@ -147,6 +269,11 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
         GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
         EPV: tuple Expected Possession value grid (loaded using load_EPV_grid() )
         params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        cache: a Metrica_Cache.pitch_control_cache object, used to avoid recalculating the pitch control surface (see generate_pitch_control_for_event() )
+        pass_risk: If True, also discount the EPV at each target by the probability that a pass to it is intercepted on the way 
+                   (see Metrica_PitchControl.calculate_pass_interception_probability() ). Default is False
+        branch_and_bound: If True, only evaluate pitch control in the cells that could contain the maximum (see above). 'cache' is not used. Default is False
+        stats: optional Metrica_PitchControl.pitch_control_stats object (with branch_and_bound=True), e.g. to count the cells evaluated (stats.n_targets)
         
     Returrns
     -----------
@@ -158,6 +285,9 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
     pass_frame = events.loc[event_id]['Start Frame']
     pass_team = events.loc[event_id].Team
     
+    if branch_and_bound:
+        return _search_max_value_added_target(pass_start_pos, pass_frame, pass_team, tracking_home, tracking_away, GK_numbers, EPV, params, pass_risk, stats)
+    
     # direction of play for atacking team (so we know whether to flip the EPV grid)
     home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
     if pass_team=='Home':
@@ -179,7 +309,14 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
     EPV_start = get_EPV_at_location(pass_start_pos, EPV, attack_direction=attack_direction)
 
     # calculate pitch control surface at moment of the pass
-    PPCF,xgrid,ygrid = mpc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True)
+    PPCF,xgrid,ygrid = mpc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, cache=cache)
+    
+    if pass_risk:
+        # probability that a pass to each cell reaches it
+        defending_team = mpc.initialise_team_state(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1]) if pass_team=='Home' else mpc.initialise_team_state(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        xx,yy = np.meshgrid(xgrid,ygrid)
+        P_intercept,_ = mpc.calculate_pass_interception_probability(pass_start_pos, np.column_stack( (xx.ravel(), yy.ravel()) ), defending_team, params)
+        PPCF = PPCF*(1-P_intercept.reshape(PPCF.shape))
     
     # EPV surface at instance of the pass
     if attack_direction == -1:
@@ -199,4 +336,170 @@ def find_max_value_added_target( event_id, events, tracking_home, tracking_away,
     # location of maximum
     max_target_location = (xgrid[maxEPV_idx[1]], ygrid[maxEPV_idx[0]])
 
-    return maxEPV_added, max_target_location
\ No newline at end of file
+    return maxEPV_added, max_target_location
+
+def _search_max_value_added_target(pass_start_pos, pass_frame, pass_team, tracking_home, tracking_away, GK_numbers, EPV, params, pass_risk, stats, batch_size=16):
+    # branch-and-bound version of find_max_value_added_target()
+    home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
+    if pass_team=='Home':
+        attack_direction = home_attack_direction
+        attacking_team = mpc.initialise_team_state(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        defending_team = mpc.initialise_team_state(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
+    elif pass_team=='Away':
+        attack_direction = home_attack_direction*-1
+        defending_team = mpc.initialise_team_state(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        attacking_team = mpc.initialise_team_state(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
+    attacking_team = mpc.check_offsides_team( attacking_team, defending_team, pass_start_pos, GK_numbers)
+    # Expected EPV at current ball position
+    Patt_start,_ = mpc.calculate_pitch_control_at_targets(pass_start_pos, attacking_team, defending_team, pass_start_pos, params)
+    EEPV_start = Patt_start[0]*get_EPV_at_location(pass_start_pos, EPV, attack_direction=attack_direction)
+    # arrival times at every cell of the pitch control grid (cheap compared to solving the model)
+    xgrid,ygrid = mpc.get_pitch_grid(field_dimen = (106.,68.,), n_grid_cells_x = 50)
+    assert EPV.shape==(len(ygrid),len(xgrid)), "EPV grid must match the pitch control grid"
+    EPV_cells = ( np.fliplr(EPV) if attack_direction==-1 else EPV ).ravel()
+    xx,yy = np.meshgrid(xgrid,ygrid)
+    target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+    onside = ~attacking_team.offside
+    tau_att = attacking_team.time_to_intercept(target_positions)[onside]
+    tau_def = defending_team.time_to_intercept(target_positions)
+    ball_travel_time = mpc.calculate_ball_travel_time(target_positions, pass_start_pos, params)
+    # the expected EPV is known without solving the model where one team has full control (unless it is discounted by the pass risk)
+    attack_wins,defence_wins = mpc.check_pitch_control_shortcuts(np.nanmin(tau_att,axis=0), np.nanmin(tau_def,axis=0), ball_travel_time, params)
+    known = defence_wins | (attack_wins & (not pass_risk))
+    EEPV_known = np.where( defence_wins, 0., EPV_cells )[known]
+    best_value,best_cell = -np.inf,-1
+    if np.any(known):
+        best_value,best_cell = np.max(EEPV_known), np.flatnonzero(known)[np.argmax(EEPV_known)]
+    # other cells in order of decreasing EPV (an upper bound of their expected EPV, as pitch control is at most 1)
+    order = np.flatnonzero(~known)
+    order = order[ np.argsort( -EPV_cells[order], kind='stable' ) ]
+    start = 0
+    while start<len(order) and EPV_cells[order[start]]>=best_value:
+        cells = order[start:start+batch_size]
+        # only evaluate the cells that could beat the best expected EPV found so far
+        cells = cells[ EPV_cells[cells]>=best_value ]
+        PPCF,_ = mpc.integrate_pitch_control(tau_att[:,cells], tau_def[:,cells], attacking_team.lambda_att[onside], defending_team.lambda_def, ball_travel_time[cells], params, stats=stats)
+        if pass_risk:
+            P_intercept,_ = mpc.calculate_pass_interception_probability(pass_start_pos, target_positions[cells], defending_team, params)
+            PPCF = PPCF*(1-P_intercept)
+        EEPV = PPCF*EPV_cells[cells]
+        # the first cell (in the order of the grid) with the largest value, as np.argmax() of the full surface
+        i = np.lexsort( (cells, -EEPV) )[0]
+        if EEPV[i]>best_value or (EEPV[i]==best_value and cells[i]<best_cell):
+            best_value,best_cell = EEPV[i],cells[i]
+        start += batch_size
+        batch_size *= 2
+    maxEPV_added = best_value - EEPV_start
+    max_target_location = (target_positions[best_cell,0], target_positions[best_cell,1])
+    return maxEPV_added, max_target_location
+
+def find_top_pass_options( event_ids, events, tracking_home, tracking_away, GK_numbers, EPV, params, k=5, min_separation=10., teammates=False, pass_risk=False, n_workers=None, cache=None ):
+    """ find_top_pass_options
+    
+    Finds the 'k' targets with the highest expected EPV (pitch control x EPV, as find_max_value_added_target() ) at the moment of each 
+    event in a list. Each target must be at least 'min_separation' meters from the targets ranked above it (non-maximum suppression), so
+    that the options are not just neighbouring cells of the same region. If teammates=True, the options are restricted to the positions 
+    of the (onside) teammates of the player on the ball. The pitch control surface is evaluated once for each event (in parallel, see 
+    Metrica_Batch.generate_pitch_control_for_events() ).
+    
+    Parameters
+    -----------
+        event_ids: list of indices (not rows) of the events, e.g. every pass in a match
+        events: Dataframe containing the event data
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        EPV: tuple Expected Possession value grid (loaded using load_EPV_grid() )
+        params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        k: number of options for each event. Default is 5
+        min_separation: minimum distance (in meters) between the options of an event. Default is 10m
+        teammates: If True, the options are the positions of the teammates of the player on the ball (the attacking player nearest 
+                   to the ball), excluding any that are offside. Default is False (any cell of the pitch control grid)
+        pass_risk: If True, also discount the EPV at each target by the probability that a pass to it is intercepted on the way 
+                   (see Metrica_PitchControl.calculate_pass_interception_probability() ). Default is False
+        n_workers: number of worker processes used to calculate the pitch control surfaces. Default (None) is the number of CPUs
+        cache: a Metrica_Cache.pitch_control_cache object, used to avoid recalculating the pitch control surfaces
+        
+    Returrns
+    -----------
+        options: DataFrame with one row per option: the 'event_id', the 'rank' of the option (0 is the best), the target position 'x' 
+                 and 'y', its expected EPV 'EEPV' and (if teammates=True) the id of the 'player' at the target
+    """
+    event_ids = list(event_ids)
+    frames = events.loc[event_ids,'Start Frame'].values
+    teams = events.loc[event_ids,'Team'].values
+    pass_start_pos = events.loc[event_ids,['Start X','Start Y']].to_numpy(dtype=float)
+    home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
+    attack_direction = {'Home': home_attack_direction, 'Away': -home_attack_direction}
+    EPV_grids = {1: EPV, -1: np.fliplr(EPV)}
+    xgrid,ygrid = mpc.get_pitch_grid(field_dimen = (106.,68.,), n_grid_cells_x = 50)
+    assert EPV.shape==(len(ygrid),len(xgrid)), "EPV grid must match the pitch control grid"
+    xx,yy = np.meshgrid(xgrid,ygrid)
+    target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+    if teammates or pass_risk:
+        # player positions at every event
+        columns = {'Home': mpc.get_team_columns(tracking_home, 'Home'), 'Away': mpc.get_team_columns(tracking_away, 'Away')}
+        values = {'Home': tracking_home.to_numpy(dtype=float), 'Away': tracking_away.to_numpy(dtype=float)}
+        rows = tracking_home.index.get_indexer(frames)
+        GKid = {'Home': GK_numbers[0], 'Away': GK_numbers[1]}
+    if teammates:
+        offside_masks,_ = mpc.calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames, pass_start_pos)
+    options = []
+    surfaces = mbatch.generate_pitch_control_for_events(event_ids, events, tracking_home, tracking_away, params, GK_numbers, n_workers=n_workers, cache=cache)
+    for i,(event_id,PPCFa) in enumerate(surfaces):
+        attacking_teamname = teams[i]
+        defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+        EEPV = PPCFa*EPV_grids[attack_direction[attacking_teamname]]
+        if pass_risk:
+            defending_team = mpc.initialise_team_state(values[defending_teamname][rows[i]], defending_teamname, params, GKid[defending_teamname], columns[defending_teamname])
+            P_intercept,_ = mpc.calculate_pass_interception_probability(pass_start_pos[i], target_positions, defending_team, params)
+            EEPV = EEPV*(1-P_intercept.reshape(EEPV.shape))
+        if teammates:
+            attacking_team = mpc.initialise_team_state(values[attacking_teamname][rows[i]], attacking_teamname, params, GKid[attacking_teamname], columns[attacking_teamname])
+            candidates = ~offside_masks[attacking_teamname][i][attacking_team.inframe]
+            # the player on the ball is the attacking player nearest to the ball
+            candidates[ np.argmin( np.hypot(*(attacking_team.position-pass_start_pos[i]).T) ) ] = False
+            positions = attacking_team.position[candidates]
+            players = attacking_team.ids[candidates]
+            # expected EPV of the cell that each teammate is in
+            ix = np.clip( np.rint( (positions[:,0]-xgrid[0])/(xgrid[1]-xgrid[0]) ).astype(int), 0, len(xgrid)-1 )
+            iy = np.clip( np.rint( (positions[:,1]-ygrid[0])/(ygrid[1]-ygrid[0]) ).astype(int), 0, len(ygrid)-1 )
+            candidate_EEPV = EEPV[iy,ix]
+        else:
+            positions = target_positions
+            players = np.full( len(target_positions), None )
+            candidate_EEPV = EEPV.ravel()
+        for rank,j in enumerate( select_top_options(positions, candidate_EEPV, k, min_separation) ):
+            options.append( (event_id, rank, positions[j,0], positions[j,1], candidate_EEPV[j], players[j]) )
+    options = pd.DataFrame(options, columns=['event_id','rank','x','y','EEPV','player'])
+    if not teammates:
+        options = options.drop(columns='player')
+    return options
+
+def select_top_options(positions, values, k, min_separation):
+    """ select_top_options
+    
+    Selects the 'k' best of a set of options by greedy non-maximum suppression: the best remaining option is taken, and every other
+    option within 'min_separation' of it is removed
+    
+    Parameters
+    -----------
+        positions: (N,2) array of the (x,y) position of each option
+        values: (N,) array of the value of each option
+        k: maximum number of options to select
+        min_separation: minimum distance (in meters) between the selected options
+        
+    Returrns
+    -----------
+        chosen: list of the indices of the selected options, best first
+    """
+    values = np.array(values, dtype=float)
+    chosen = []
+    while len(chosen)<k and len(values)>0:
+        j = np.argmax(values)
+        if not np.isfinite(values[j]):
+            break
+        chosen.append(j)
+        values[ np.hypot(*(positions-positions[j]).T)<min_separation ] = -np.inf
+        values[j] = -np.inf
+    return chosen
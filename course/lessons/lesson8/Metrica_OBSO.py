@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module for calculating off-ball scoring opportunity (OBSO) surfaces over whole matches, using MetricaSports's tracking & event data.
+OBSO is described in "Beyond Expected Goals" by William Spearman (2018). Here the OBSO at each location on the field is the product of
+the pitch control of the team in possession (Metrica_PitchControl), the EPV of the location (Metrica_EPV) and the probability that
+the ball is moved to that location next (a ball transition kernel centred on the ball). Summed over the field, it is the expected
+EPV of the next ball move.
+
+Surfaces are evaluated on a schedule of frames (e.g. every 5th frame), in parallel and with an optional cache (see Metrica_Batch), and
+each frame is reduced to a compact summary: the maximum and total OBSO and the best few (well separated) locations. Summaries are
+appended to a text file as they are calculated, so an interrupted run can be restarted and continues from the last frame written.
+
+Functions
+----------
+ball_transition_kernel(): probability that the ball is moved to each cell of the grid next
+get_possession_teams(): the team in possession at each of a list of frames, from the event data
+calculate_obso_surface(): the OBSO surface for a single frame
+generate_obso_for_match(): OBSO summaries for a schedule of frames, written to a (restartable) summary file
+read_obso_summary(): read a summary file written by generate_obso_for_match()
+"""
+
+import numpy as np
+import pandas as pd
+import os
+import Metrica_PitchControl as mpc
+import Metrica_EPV as mepv
+import Metrica_Batch as mbatch
+import Metrica_Cache as mcache
+import Metrica_IO as mio
+
+def ball_transition_kernel(xgrid, ygrid, ball_position, sigma=14.):
+    """ ball_transition_kernel
+
+    Probability that the ball is moved to each cell of the grid next: a 2D gaussian centred on the ball, normalised to sum to 1 over the field
+
+    Parameters
+    -----------
+        xgrid: Positions of the pixels in the x-direction (field length)
+        ygrid: Positions of the pixels in the y-direction (field width)
+        ball_position: (x,y) position of the ball
+        sigma: standard deviation of the gaussian in meters (roughly the spread of the distance that the ball is moved). Default is 14m
+
+    Returrns
+    -----------
+        transition: (len(ygrid),len(xgrid)) array of the probability of moving the ball to each cell
+    """
+    # the gaussian is separable, so only evaluate it along each axis
+    kx = np.exp( -0.5*( (np.asarray(xgrid)-ball_position[0])/sigma )**2 )
+    ky = np.exp( -0.5*( (np.asarray(ygrid)-ball_position[1])/sigma )**2 )
+    transition = np.outer(ky,kx)
+    return transition/transition.sum()
+
+def get_possession_teams(frames, events):
+    """ get_possession_teams
+
+    The team in possession at each of a list of frames: the team of the most recent event that started at or before the frame
+
+    Parameters
+    -----------
+        frames: list of frame numbers
+        events: Dataframe containing the event data
+
+    Returrns
+    -----------
+        teams: array of the team in possession ("Home" or "Away") at each frame, or None before the first event
+    """
+    events = events[ events['Team'].isin(['Home','Away']) ].sort_values('Start Frame', kind='stable')
+    last_event = np.searchsorted( events['Start Frame'].values, np.asarray(frames), side='right' ) - 1
+    teams = events['Team'].values[ np.maximum(last_event,0) ].astype(object)
+    teams[ last_event<0 ] = None
+    return teams
+
+def calculate_obso_surface(PPCFa, EPV_surface, transition):
+    """ calculate_obso_surface
+
+    The OBSO surface for a single frame
+
+    Parameters
+    -----------
+        PPCFa: Pitch control surface for the team in possession (see Metrica_PitchControl.generate_pitch_control_for_event() )
+        EPV_surface: EPV at each cell of the same grid, for the direction of play of the team in possession (e.g. using Metrica_EPV.get_EPV_at_locations() )
+        transition: probability of moving the ball to each cell of the same grid (see ball_transition_kernel() )
+
+    Returrns
+    -----------
+        OBSO: OBSO surface (same shape as PPCFa)
+    """
+    return PPCFa*EPV_surface*transition
+
+def generate_obso_for_match(filename, tracking_home, tracking_away, events, params, GK_numbers, EPV, frame_step=5, frames=None, n_top=3, min_separation=10.,
+                            transition_sigma=14., field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, n_workers=None, chunksize=4, cache=None, flush_every=100, stats=None):
+    """ generate_obso_for_match
+
+    Calculates the OBSO surface at every 'frame_step'th frame of a match (or a given list of frames) and appends a summary of each frame
+    to 'filename': the frame, the team in possession, the maximum and total OBSO, and the position and OBSO of the best 'n_top' locations
+    (at least 'min_separation' meters apart, see Metrica_EPV.select_top_options() ). Frames where no team is in possession yet, or the
+    ball position is unknown, are skipped.
+
+    If 'filename' already exists, the frames it contains are not recalculated, so a run that was interrupted (or a longer frame schedule)
+    continues where it left off. The first line of the file records the settings (a hash of the model parameters, the grid, etc.), which
+    must match those of the run that is continued. Pitch control surfaces are calculated in parallel using all CPUs by default
+    (see Metrica_Batch.generate_pitch_control_for_frames() ).
+
+    Parameters
+    -----------
+        filename: name of the summary file
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        events: Dataframe containing the event data (used to find the team in possession)
+        params: Dictionary of pitch control model parameters (default model parameters can be generated using default_model_params() )
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        EPV: tuple Expected Possession value grid (loaded using Metrica_EPV.load_EPV_grid() )
+        frame_step: evaluate every 'frame_step'th frame of the tracking data. Default is 5
+        frames: optional list of frames to evaluate instead
+        n_top: number of locations recorded for each frame. Default is 3
+        min_separation: minimum distance (in meters) between the recorded locations. Default is 10m
+        transition_sigma: standard deviation of the ball transition kernel in meters (see ball_transition_kernel() ). Default is 14m
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+        offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+        n_workers: number of worker processes. Default (None) is the number of CPUs. If 1, frames are evaluated in this process.
+        chunksize: number of frames sent to a worker at a time
+        cache: a Metrica_Cache.pitch_control_cache object. Frames already in the cache are not recalculated, and new surfaces are added to it.
+        flush_every: number of frames between writes of the summary file to disk. Default is 100
+        stats: optional Metrica_PitchControl.pitch_control_stats object to add the diagnostics of the pitch control calculations to
+
+    Returrns
+    -----------
+        n_frames: number of frames added to the summary file
+    """
+    if frames is None:
+        frames = tracking_home.index[::frame_step]
+    frames = np.asarray(frames)
+    teams = get_possession_teams(frames, events)
+    ball_positions = tracking_home.loc[frames,['ball_x','ball_y']].to_numpy(dtype=float)
+    settings = '# params_hash=%s field_dimen=%s n_grid_cells_x=%d offsides=%s transition_sigma=%g n_top=%d min_separation=%g' % (
+                mcache.params_hash(params), tuple(field_dimen), n_grid_cells_x, offsides, transition_sigma, n_top, min_separation)
+    done = _read_completed_frames(filename, settings)
+    todo = np.flatnonzero( (teams!=None) & ~np.any(np.isnan(ball_positions),axis=1) & ~np.isin(frames, list(done)) )
+    if len(todo)==0:
+        return 0
+    # EPV at every cell of the grid, for each direction of play
+    xgrid,ygrid = mpc.get_pitch_grid(field_dimen, n_grid_cells_x)
+    xx,yy = np.meshgrid(xgrid,ygrid)
+    target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+    home_attack_direction = mio.find_playing_direction(tracking_home,'Home')
+    EPV_surfaces = {team: mepv.get_EPV_at_locations(target_positions, EPV, direction, field_dimen, interpolation='bilinear').reshape(xx.shape)
+                    for team,direction in (('Home',home_attack_direction),('Away',-home_attack_direction))}
+    surfaces = mbatch.generate_pitch_control_for_frames(frames[todo], teams[todo], tracking_home, tracking_away, params, GK_numbers, ball_positions=ball_positions[todo],
+                                                        field_dimen=field_dimen, n_grid_cells_x=n_grid_cells_x, offsides=offsides, n_workers=n_workers, chunksize=chunksize, cache=cache, stats=stats)
+    n_frames = 0
+    new_file = not os.path.exists(filename) or os.path.getsize(filename)==0
+    with open(filename, 'a') as f:
+        if new_file:
+            f.write( settings + '\n' + ','.join(_summary_columns(n_top)) + '\n' )
+        for i,(frame,PPCFa) in zip(todo, surfaces):
+            OBSO = calculate_obso_surface(PPCFa, EPV_surfaces[teams[i]], ball_transition_kernel(xgrid, ygrid, ball_positions[i], transition_sigma))
+            top = mepv.select_top_options(target_positions, OBSO.ravel(), n_top, min_separation)
+            row = [ '%d' % (frame), teams[i], '%.6g' % (OBSO.max()), '%.6g' % (OBSO.sum()) ]
+            for j in range(n_top):
+                row += [ '%.2f' % (target_positions[top[j],0]), '%.2f' % (target_positions[top[j],1]), '%.6g' % (OBSO.ravel()[top[j]]) ] if j<len(top) else ['nan']*3
+            f.write( ','.join(row) + '\n' )
+            n_frames += 1
+            if n_frames % flush_every == 0:
+                f.flush()
+    return n_frames
+
+def read_obso_summary(filename):
+    """ read_obso_summary
+
+    Reads a summary file written by generate_obso_for_match()
+
+    Parameters
+    -----------
+        filename: name of the summary file
+
+    Returrns
+    -----------
+        summary: DataFrame (indexed by frame) with columns 'team', 'max', 'sum' and the 'x', 'y' and 'obso' of each of the top locations ('x0', 'y0', 'obso0', 'x1', ...)
+    """
+    return pd.read_csv(filename, comment='#', index_col='frame')
+
+def _summary_columns(n_top):
+    return ['frame','team','max','sum'] + [ '%s%d' % (c,j) for j in range(n_top) for c in ('x','y','obso') ]
+
+def _read_completed_frames(filename, settings):
+    # frames already in the summary file (after removing any incomplete last line left by an interrupted run)
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, 'rb+') as f:
+        content = f.read()
+        if content.count(b'\n')<2:
+            # the settings and column names were not written completely: start again
+            f.truncate(0)
+            return set()
+        if not content.endswith(b'\n'):
+            f.truncate( content.rfind(b'\n')+1 )
+    with open(filename) as f:
+        assert f.readline().rstrip('\n')==settings, "%s was written with different settings" % (filename)
+    return set( read_obso_summary(filename).index )
@@ -15,13 +15,36 @@ Functions
 calculate_pitch_control_at_target(): calculate the pitch control probability for the attacking and defending teams at a specified target position on the ball.
 generate_pitch_control_for_event(): this function evaluates pitch control surface over the entire field at the moment
 of the given event (determined by the index of the event passed as an input)
+generate_pitch_control_for_team_states(): evaluates the pitch control surface over the entire field for a pair of team_state objects
+adaptive_pitch_control_surface(): evaluates a (high-resolution) pitch control surface by refining a coarse grid only where it is contested
+calculate_pitch_control_at_targets(): vectorized pitch control probability for the attacking and defending teams at a set of target positions
+calculate_ball_travel_time(): time for the ball to reach each of a set of target positions
+calculate_pass_interception_probability(): probability that each of a set of passes is intercepted by the defending team along the path of the ball
+integrate_pitch_control(): vectorized solution of the pitch control model for many target positions at once, given the arrival times
+of every player at every target (used by generate_pitch_control_for_event when vectorized=True)
+solve_pitch_control_euler(), solve_pitch_control_analytic(), solve_pitch_control_adaptive(): reference, approximate and adaptive timestep 
+solutions of the model used by integrate_pitch_control()
+get_pitch_control_solver(): the solver for the integration method set in the model parameters
+check_pitch_control_shortcuts(): finds the target positions at which one team has full control, without solving the model
+get_player_params(): the value of a model parameter for each of a set of players (allowing for individual player parameters)
+calculate_accelerated_time_to_intercept(): acceleration-limited arrival times of a set of players at a set of target positions
+calculate_offside_masks(): the offside line and offside players of each team in every frame of a match
+generate_pitch_control_for_frame_sequence(): pitch control surfaces for a sequence of frames, reusing the solution from earlier frames where possible
 Classes
 ---------
 The 'player' class collects and stores trajectory information for each player required by the pitch control calculations.
+The 'team_state' class stores the same information for a whole team as arrays (one element per player), for the vectorized calculations.
+The 'time_to_intercept_field' class stores the arrival time of each player at every cell of a grid, so that it can be shared and updated between frames.
+The 'pitch_control_stats' class collects diagnostics (short-cuts, integration steps, convergence failures, time per stage) from the calculations.
+The 'incremental_pitch_control' class evaluates pitch control for consecutive frames, only re-integrating cells that have changed.
+The 'what_if_pitch_control' class updates a pitch control surface interactively as individual players are moved.
 @author: Laurie Shaw (@EightyFivePoint)
 """
 
 import numpy as np
+import math
+import time
+import copy
 
 
 def initialise_players(team,teamname,params,GKid):
@@ -94,6 +117,438 @@ def check_offsides( attacking_players, defending_players, ball_position, GK_numb
     attacking_players = [p for p in attacking_players if p.position[0]*defending_half<=offside_line]
     return attacking_players
 
+def get_team_columns(team, teamname):
+    """
+    get_team_columns(team,teamname)
+    
+    find the player ids and the positions of their position & velocity columns in the tracking data, so that team states can be
+    built directly from rows of the tracking data array (see initialise_team_state() ) without parsing the column names each time
+    
+    Parameters
+    -----------
+    
+    team: tracking DataFrame (or a single row of it) for the home or away team. Must include player velocities (see Metrica_Velocities)
+    teamname: team name "Home" or "Away"
+    
+    Returns
+    -----------
+    
+    columns: dictionary containing the player 'ids' and the integer column indices of their 'x', 'y', 'vx' and 'vy' columns
+    
+    """
+    keys = list( team.keys() )
+    # get player ids (in the same order as initialise_players)
+    player_ids = np.unique( [ c.split('_')[1] for c in keys if c[:4] == teamname ] )
+    columns = {'ids': player_ids}
+    for suffix in ['x','y','vx','vy']:
+        columns[suffix] = np.array( [ keys.index("%s_%s_%s" % (teamname,p,suffix)) for p in player_ids ], dtype=int )
+    return columns
+
+def initialise_team_state(team, teamname, params, GKid, columns=None):
+    """
+    initialise_team_state(team,teamname,params,GKid,columns=None)
+    
+    create a team_state object that holds the positions and velocities of all the players in the team (that are on the field)
+    
+    Parameters
+    -----------
+    
+    team: row (i.e. instant) of either the home or away team tracking Dataframe. If 'columns' is given, this can also be
+          the corresponding row of the tracking data as a numpy array (e.g. tracking_home.values[i])
+    teamname: team name "Home" or "Away"
+    params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+    GKid: player id (jersey number) of the team's goalkeeper
+    columns: output of get_team_columns(). Calculate this once for the whole tracking DataFrame to avoid repeating it for every frame.
+        
+    Returns
+    -----------
+    
+    team: team_state object for the team at the given instant
+    
+    """    
+    if columns is None:
+        columns = get_team_columns(team, teamname)
+    values = np.asarray(team, dtype=float)
+    position = np.column_stack( (values[columns['x']], values[columns['y']]) )
+    velocity = np.column_stack( (values[columns['vx']], values[columns['vy']]) )
+    return team_state(columns['ids'], teamname, position, velocity, params, GKid)
+
+def check_offsides_team( attacking_team, defending_team, ball_position, GK_numbers, verbose=False, tol=0.2):
+    """
+    check_offsides_team( attacking_team, defending_team, ball_position, GK_numbers, verbose=False, tol=0.2):
+    
+    team_state version of check_offsides(). Rather than removing offside players, it flags them in the 'offside' mask of attacking_team
+    so that they are ignored in the vectorized pitch control calculations.
+    
+    Parameters
+    -----------
+        attacking_team: team_state object for the attacking team (team in possession)
+        defending_team: team_state object for the defending team
+        ball_position: Current position of the ball (start position for a pass). If set to NaN, function will assume that the ball is already at the target position.
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        verbose: if True, print a message each time a player is found to be offside
+        tol: A tolerance parameter that allows a player to be very marginally offside (up to 'tol' m) without being flagged offside. Default: 0.2m
+            
+    Returrns
+    -----------
+        attacking_team: team_state object for the attacking team with the 'offside' mask set
+    """    
+    # find jersey number of defending goalkeeper (just to establish attack direction)
+    defending_GK_id = GK_numbers[1] if attacking_team.teamname=='Home' else GK_numbers[0]
+    # make sure defending goalkeeper is actually on the field!
+    assert defending_GK_id in defending_team.ids, "Defending goalkeeper jersey number not found in defending players"
+    # use defending goalkeeper x position to figure out which half he is defending (-1: left goal, +1: right goal)
+    defending_half = np.sign( defending_team.position[defending_team.ids==defending_GK_id,0][0] )
+    # find the x-position of the second-deepest defeending player (including GK)
+    second_deepest_defender_x = np.sort( defending_half*defending_team.position[:,0] )[-2]
+    # define offside line as being the maximum of second_deepest_defender_x, ball position and half-way line
+    offside_line = max(second_deepest_defender_x,defending_half*ball_position[0],0.0)+tol
+    # any attacking players with x-position greater than the offside line are offside
+    attacking_team.offside = attacking_team.position[:,0]*defending_half>offside_line
+    if verbose:
+        for pid in attacking_team.ids[attacking_team.offside]:
+            print("player %s in %s team is offside" % (pid, attacking_team.teamname) )
+    return attacking_team
+
+def calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames=None, ball_positions=None, tol=0.2):
+    """
+    calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames=None, ball_positions=None, tol=0.2)
+    
+    Finds the offside line and the offside players of each team (as the attacking team) in every frame in one pass over the tracking data, 
+    so that batch calculations can look up the offside players rather than calling check_offsides_team() for each frame.
+    The line is defined as in check_offsides_team(), but the half that each team is defending is found once per period (from their 
+    goalkeeper if they are on the field, otherwise from the average position of the team), so that it does not fail when the goalkeeper 
+    has been substituted or is missing from the tracking data. If a team has fewer than two players on the field, only the ball position 
+    and half-way line are used.
+    
+    Parameters
+    -----------
+        tracking_home: tracking DataFrame for the Home team
+        tracking_away: tracking DataFrame for the Away team
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        frames: list of frame numbers (index of the tracking DataFrames) at which to find offside players. Default (None) is every frame
+        ball_positions: (n_frames,2) array of ball positions in each of these frames. Default is to use the ball position in the tracking data.
+                        A NaN ball position is ignored.
+        tol: A tolerance parameter that allows a player to be very marginally offside (up to 'tol' m) without being flagged offside. Default: 0.2m
+            
+    Returrns
+    -----------
+        offside_masks: dictionary containing, for the attacking team 'Home' and 'Away', an (n_frames,n_players) boolean array flagging the players 
+                       that are offside. Players are in the same order as get_team_columns() 
+        offside_lines: dictionary containing, for the attacking team 'Home' and 'Away', the x-position of the offside line in each frame (excluding 'tol')
+    """    
+    rows = np.arange(len(tracking_home)) if frames is None else tracking_home.index.get_indexer(frames)
+    assert np.all(rows>=0), "Frames not found in tracking data"
+    if ball_positions is None:
+        ball_positions = tracking_home[['ball_x','ball_y']].to_numpy(dtype=float)[rows]
+    ball_x = np.asarray(ball_positions, dtype=float).reshape(-1,2)[:,0]
+    periods = tracking_home['Period'].to_numpy() if 'Period' in tracking_home.columns else np.zeros(len(tracking_home))
+    x = {}
+    for teamname,tracking in zip(['Home','Away'],[tracking_home,tracking_away]):
+        columns = get_team_columns(tracking, teamname)
+        x[teamname] = (columns['ids'], tracking.to_numpy(dtype=float)[:,columns['x']])
+    offside_masks = {}
+    offside_lines = {}
+    for attacking_teamname,defending_teamname,GKid in [('Home','Away',GK_numbers[1]),('Away','Home',GK_numbers[0])]:
+        ids,defending_x = x[defending_teamname]
+        # half defended in each period (-1: left goal, +1: right goal)
+        defending_half = np.ones(len(tracking_home))
+        for period in np.unique(periods):
+            in_period = periods==period
+            gk_x = defending_x[in_period][:,ids==GKid].ravel()
+            gk_x = gk_x[~np.isnan(gk_x)]
+            if len(gk_x)>0:
+                defending_half[in_period] = np.sign( np.median(gk_x) ) or 1.
+            elif np.any( ~np.isnan(defending_x[in_period]) ):
+                defending_half[in_period] = np.sign( np.nanmean(defending_x[in_period]) ) or 1.
+        defending_half = defending_half[rows]
+        # x-position of the second-deepest defending player (including GK), ignoring players not on the field
+        depth = defending_half[:,np.newaxis]*defending_x[rows]
+        depth[np.isnan(depth)] = -np.inf
+        second_deepest_defender_x = np.sort(depth, axis=1)[:,-2] if depth.shape[1]>1 else np.full(len(rows),-np.inf)
+        # offside line is the maximum of second_deepest_defender_x, ball position and half-way line
+        offside_line = np.fmax( np.maximum(second_deepest_defender_x, 0.), defending_half*ball_x )
+        _,attacking_x = x[attacking_teamname]
+        with np.errstate(invalid='ignore'):
+            offside_masks[attacking_teamname] = attacking_x[rows]*defending_half[:,np.newaxis] > (offside_line+tol)[:,np.newaxis]
+        offside_lines[attacking_teamname] = defending_half*offside_line
+    return offside_masks, offside_lines
+
+# keys of the individual player parameters in 'params' (see default_model_params) 
+_PLAYER_PARAMS = {'max_player_speed': 'player_max_speed', 'max_player_accel': 'player_max_accel', 'reaction_time': 'player_reaction_time'}
+
+def get_player_params(params, key, teamname, ids):
+    """
+    get_player_params(params, key, teamname, ids)
+    
+    Returns the value of a model parameter for each of a set of players, taking individual values from params (e.g. params['player_max_speed']
+    for key='max_player_speed') where they are given, and the value for all players (params[key]) otherwise.
+    
+    Parameters
+    -----------
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        key: 'max_player_speed', 'max_player_accel' or 'reaction_time'
+        teamname: team name "Home" or "Away"
+        ids: player ids (jersey numbers)
+            
+    Returrns
+    -----------
+        values: array with the value for each player
+    """
+    individual = params.get(_PLAYER_PARAMS[key], {})
+    default = float(params[key])
+    return np.array( [ float(individual.get("%s_%s" % (teamname,pid), default)) for pid in ids ] )
+
+class team_state(object):
+    """
+    team_state() class
+    
+    Class defining the state of a whole team at a given instant. Stores the same information as a list of 'player' objects, but 
+    as arrays with one element (or row) per player so that the pitch control calculations can be vectorized over players.
+    
+    __init__ Parameters
+    -----------
+    ids: array of player ids (jersey numbers)
+    teamname: team name "Home" or "Away"
+    position: (n_players,2) array of player positions. Players with a NaN position (i.e. not on the field) are dropped
+    velocity: (n_players,2) array of player velocities. NaN velocities are set to zero
+    params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+    GKid: player id (jersey number) of the team's goalkeeper
+    
+    attributes include:
+    -----------
+    position, velocity, reaction_time, vmax, amax, lambda_att, lambda_def: contiguous float arrays (one element or row per player)
+    tti_model: the time-to-intercept model ('straight' or 'acceleration', see default_model_params() )
+    is_gk: boolean mask of the goalkeeper
+    offside: boolean mask of offside players (set by check_offsides_team(), initially all False)
+    inframe: boolean mask of the input players that are on the field (e.g. to select the rows of calculate_offside_masks() for this team)
+    
+    methods include:
+    -----------
+    time_to_intercept(target_positions): time taken for each player to get to each target position given current position
+    
+    """
+    def __init__(self,ids,teamname,position,velocity,params,GKid):
+        inframe = ~np.any( np.isnan(position), axis=1 )
+        self.inframe = inframe # which of the input players are on the field
+        self.ids = np.asarray(ids)[inframe]
+        self.teamname = teamname
+        self.position = np.ascontiguousarray( position[inframe], dtype=float )
+        self.velocity = np.ascontiguousarray( velocity[inframe], dtype=float )
+        self.velocity[ np.any( np.isnan(self.velocity), axis=1 ) ] = 0.
+        n = len(self.ids)
+        self.is_gk = self.ids == GKid
+        self.offside = np.zeros(n, dtype=bool)
+        self.vmax = get_player_params(params, 'max_player_speed', teamname, self.ids) # player max speed in m/s
+        self.amax = get_player_params(params, 'max_player_accel', teamname, self.ids) # player max acceleration in m/s/s
+        self.reaction_time = get_player_params(params, 'reaction_time', teamname, self.ids) # player reaction time in 's'
+        self.tti_model = params.get('time_to_intercept_model','straight')
+        self.tti_sigma = params['tti_sigma'] # standard deviation of sigmoid function (see Eq 4 in Spearman, 2018)
+        self.lambda_att = np.full(n, float(params['lambda_att'])) # ball control parameter when attacking
+        self.lambda_def = np.where(self.is_gk, params['lambda_gk'], params['lambda_def']) # ball control parameter when defending
+        
+    def time_to_intercept(self, target_positions):
+        # Time to intercept assumes that each player continues moving at current velocity for 'reaction_time' seconds
+        # and then runs at full speed to the target position. Returns an (n_players,N) array
+        if self.tti_model=='acceleration':
+            return calculate_accelerated_time_to_intercept(self.position, self.velocity, target_positions, self.reaction_time, self.vmax, self.amax)
+        r_reaction = self.position + self.velocity*self.reaction_time[:,np.newaxis]
+        distance = np.hypot( target_positions[np.newaxis,:,0]-r_reaction[:,np.newaxis,0], target_positions[np.newaxis,:,1]-r_reaction[:,np.newaxis,1] )
+        return self.reaction_time[:,np.newaxis] + distance/self.vmax[:,np.newaxis]
+
+def calculate_accelerated_time_to_intercept(position, velocity, target_positions, reaction_time, vmax, amax):
+    """ calculate_accelerated_time_to_intercept
+    
+    Acceleration-limited time to intercept. Each player continues moving at their current velocity for 'reaction_time' seconds, and then 
+    accelerates towards the target: dv/dt = alpha*(vmax*e - v), where e is the direction of the target and alpha = amax/vmax (so the player 
+    starts accelerating at amax from rest, and their speed tends to vmax). The positions the player can reach after a time t form a disc 
+    (Fujimura & Sugihara, 2005), and the arrival time is the first time that the disc contains the target.
+    
+    In units of time 1/alpha, distance vmax/alpha and speed vmax, the arrival time only depends on the distance to the target and the 
+    components of the player's velocity towards and across it. It is tabulated once (see _accelerated_tti_table() ) and interpolated, so 
+    the cost is close to that of the straight-line model. Speeds above vmax are reduced to vmax.
+    
+    Parameters
+    -----------
+        position: (n_players,2) array of player positions
+        velocity: (n_players,2) array of player velocities
+        target_positions: (N,2) array of target positions
+        reaction_time: player reaction time in seconds, either a single value or one per player
+        vmax: maximum player speed (m/s), either a single value or one per player
+        amax: maximum player acceleration (m/s/s), either a single value or one per player
+        
+    Returrns
+    -----------
+        tau: (n_players,N) array of the arrival time of each player at each target position
+    """
+    n = len(position)
+    reaction_time,vmax,amax = [ np.broadcast_to(np.asarray(v,dtype=float),(n,))[:,np.newaxis] for v in (reaction_time,vmax,amax) ]
+    alpha = amax/vmax
+    r_reaction = position + velocity*reaction_time
+    dx = target_positions[np.newaxis,:,0]-r_reaction[:,np.newaxis,0]
+    dy = target_positions[np.newaxis,:,1]-r_reaction[:,np.newaxis,1]
+    distance = np.hypot(dx,dy)
+    # velocity in units of vmax (no faster than vmax), and its components towards and across the direction of the target
+    speed = np.hypot(velocity[:,0],velocity[:,1])[:,np.newaxis]
+    scale = 1./np.maximum(vmax,speed)
+    ux,uy = velocity[:,0,np.newaxis]*scale, velocity[:,1,np.newaxis]*scale
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u_par = np.where( distance>0, (ux*dx+uy*dy)/distance, 0. )
+        u_perp = np.where( distance>0, np.abs(ux*dy-uy*dx)/distance, 0. )
+    d = distance*alpha/vmax
+    table = _accelerated_tti_table()
+    # interpolate in the table (in sqrt(distance), u_par, u_perp)
+    fi = np.sqrt(d)/table['ds']
+    fj = (u_par+1.)/table['du']
+    fk = u_perp/table['du']
+    shape = table['tau'].shape
+    i = np.clip( fi.astype(int), 0, shape[0]-2 )
+    j = np.clip( fj.astype(int), 0, shape[1]-2 )
+    k = np.clip( fk.astype(int), 0, shape[2]-2 )
+    wi,wj,wk = np.clip(fi-i,0.,1.),np.clip(fj-j,0.,1.),np.clip(fk-k,0.,1.)
+    flat = table['tau'].ravel()
+    index = (i*shape[1]+j)*shape[2]+k
+    tau = 0.
+    for di,wi_ in ((0,1.-wi),(1,wi)):
+        for dj,wj_ in ((0,1.-wj),(1,wj)):
+            for dk,wk_ in ((0,1.-wk),(1,wk)):
+                tau = tau + wi_*wj_*wk_*flat[ index + (di*shape[1]+dj)*shape[2]+dk ]
+    # beyond the table the player is at full speed long before arriving, so the disc is centred at (u_par,u_perp) with radius tau-1
+    far = d>table['d_max']
+    tau = np.where( far, 1. + np.hypot(d-u_par,u_perp), tau )
+    return reaction_time + tau/alpha
+
+def _accelerated_time_to_intercept_scalar(position, velocity, r_final, reaction_time, vmax, amax):
+    # calculate_accelerated_time_to_intercept() for a single player and target (avoids the overhead of numpy for scalars)
+    table = _accelerated_tti_table()
+    alpha = amax/vmax
+    vx,vy = float(velocity[0]),float(velocity[1])
+    dx = r_final[0] - (position[0]+vx*reaction_time)
+    dy = r_final[1] - (position[1]+vy*reaction_time)
+    distance = math.hypot(dx,dy)
+    if distance==0:
+        return reaction_time
+    scale = 1./max(vmax,math.hypot(vx,vy))
+    u_par = (vx*dx+vy*dy)*scale/distance
+    u_perp = abs(vx*dy-vy*dx)*scale/distance
+    d = distance*alpha/vmax
+    if d>table['d_max']:
+        return reaction_time + (1. + math.hypot(d-u_par,u_perp))/alpha
+    tau = table['tau']
+    fi,fj,fk = math.sqrt(d)/table['ds'], (u_par+1.)/table['du'], u_perp/table['du']
+    i,j,k = min(int(fi),tau.shape[0]-2), min(int(fj),tau.shape[1]-2), min(int(fk),tau.shape[2]-2)
+    wi,wj,wk = min(fi-i,1.), min(fj-j,1.), min(fk-k,1.)
+    c = tau[i:i+2,j:j+2,k:k+2].tolist()
+    t = 0.
+    for di,wi_ in ((0,1.-wi),(1,wi)):
+        for dj,wj_ in ((0,1.-wj),(1,wj)):
+            t += wi_*wj_*( (1.-wk)*c[di][dj][0] + wk*c[di][dj][1] )
+    return reaction_time + t/alpha
+
+_ACCEL_TTI_TABLE = {}
+
+def _accelerated_tti_table():
+    # dimensionless arrival times on a grid of sqrt(distance) x u_par x u_perp, calculated on first use
+    if not _ACCEL_TTI_TABLE:
+        ds,du,d_max = 0.02, 0.1, 20.
+        s = np.arange(0., np.sqrt(d_max)+ds, ds)
+        u_par = np.arange(-1., 1.+du/2, du)
+        u_perp = np.arange(0., 1.+du/2, du)
+        d,p,q = np.meshgrid(s**2, u_par, u_perp, indexing='ij')
+        def reach(t):
+            # >=0 once the target is within the disc of positions that can be reached at time t
+            g = 1.-np.exp(-t)
+            return t - g - np.hypot(d-g*p, g*q)
+        # find the first time step at which the target can be reached, then refine by bisection
+        dt = 0.05
+        lo = np.zeros(d.shape)
+        hi = np.full(d.shape, np.nan)
+        for t in np.arange(0., d_max+5., dt):
+            new = np.isnan(hi) & (reach(np.full(d.shape,t))>=0)
+            hi[new] = t
+            lo[new] = max(t-dt,0.)
+        for it in range(30):
+            mid = (lo+hi)/2.
+            inside = reach(mid)>=0
+            hi = np.where(inside, mid, hi)
+            lo = np.where(inside, lo, mid)
+        _ACCEL_TTI_TABLE.update( tau=hi, ds=ds, du=du, d_max=d_max )
+    return _ACCEL_TTI_TABLE
+
+class time_to_intercept_field(object):
+    """
+    time_to_intercept_field() class
+    
+    Arrival time of each player at every cell of a grid (as team_state.time_to_intercept() ), stored per player so that it can be shared
+    between calculations on the same frame (pitch control, EPV target search, pressure on the ball) and updated cheaply from one frame to
+    the next. The squared x and y distances to the grid lines are calculated separately for each player and combined, rather than 
+    evaluating the distance to every cell from scratch. A player's field is only recalculated if their position after the reaction time
+    (position + velocity*reaction_time), reaction time or maximum speed has changed (by more than 'tol' metres for the position).
+    With the 'acceleration' time-to-intercept model the fields of players whose velocity or acceleration has changed are also recalculated.
+    
+    __init__ Parameters
+    -----------
+    xgrid: Positions of the pixels in the x-direction (field length)
+    ygrid: Positions of the pixels in the y-direction (field width)
+    tol: a player's field is reused if their position after the reaction time has moved by no more than 'tol' metres (the arrival times are 
+         then wrong by up to tol/vmax seconds). Default is 0 (always recalculate if anything has changed)
+    
+    methods include:
+    -----------
+    update(team): (n_players,n_grid_cells_y,n_grid_cells_x) array of arrival times of each player in a team_state object at each cell
+    clear(): forget all stored fields
+    
+    attributes include:
+    -----------
+    n_updated, n_reused: total number of player fields that were recalculated and reused
+    
+    """
+    def __init__(self, xgrid, ygrid, tol=0.):
+        self.xgrid = np.asarray(xgrid, dtype=float)
+        self.ygrid = np.asarray(ygrid, dtype=float)
+        self.tol = tol
+        self.clear()
+        
+    def clear(self):
+        self.players = {} # (teamname,id) -> (position after reaction time, reaction time, vmax, arrival time field)
+        self.n_updated = 0
+        self.n_reused = 0
+        
+    def update(self, team):
+        r_reaction = team.position + team.velocity*team.reaction_time[:,np.newaxis]
+        keys = [(team.teamname,pid) for pid in team.ids]
+        accelerated = team.tti_model=='acceleration'
+        changed = []
+        for i,key in enumerate(keys):
+            stored = self.players.get(key)
+            if stored is None or stored[1]!=team.reaction_time[i] or stored[2]!=team.vmax[i] or np.hypot(*(r_reaction[i]-stored[0]))>self.tol:
+                changed.append(i)
+            elif accelerated and ( stored[4] is None or stored[4][0]!=team.amax[i] or np.hypot(*(team.velocity[i]-stored[4][1]))*team.reaction_time[i]>self.tol ):
+                # with the acceleration model the arrival times also depend on the current velocity
+                changed.append(i)
+        if changed:
+            if accelerated:
+                tau = calculate_accelerated_time_to_intercept(team.position[changed], team.velocity[changed], self.target_positions(), 
+                                                              team.reaction_time[changed], team.vmax[changed], team.amax[changed])
+                tau = tau.reshape( len(changed), len(self.ygrid), len(self.xgrid) )
+            else:
+                r = r_reaction[changed]
+                dx2 = ( self.xgrid[np.newaxis,:]-r[:,0,np.newaxis] )**2
+                dy2 = ( self.ygrid[np.newaxis,:]-r[:,1,np.newaxis] )**2
+                tau = team.reaction_time[changed,np.newaxis,np.newaxis] + np.sqrt( dy2[:,:,np.newaxis]+dx2[:,np.newaxis,:] )/team.vmax[changed,np.newaxis,np.newaxis]
+            for j,i in enumerate(changed):
+                state = (team.amax[i], team.velocity[i].copy()) if accelerated else None
+                self.players[keys[i]] = (r_reaction[i], team.reaction_time[i], team.vmax[i], tau[j], state)
+        self.n_updated += len(changed)
+        self.n_reused += len(keys)-len(changed)
+        if len(keys)==0:
+            return np.zeros( (0,len(self.ygrid),len(self.xgrid)) )
+        return np.stack( [self.players[key][3] for key in keys] )
+    
+    def target_positions(self):
+        xx,yy = np.meshgrid(self.xgrid,self.ygrid)
+        return np.column_stack( (xx.ravel(), yy.ravel()) )
+
 class player(object):
     """
     player() class
@@ -119,8 +574,10 @@ class player(object):
         self.is_gk = self.id == GKid
         self.teamname = teamname
         self.playername = "%s_%s_" % (teamname,pid)
-        self.vmax = params['max_player_speed'] # player max speed in m/s. Could be individualised
-        self.reaction_time = params['reaction_time'] # player reaction time in 's'. Could be individualised
+        self.vmax = get_player_params(params, 'max_player_speed', teamname, [pid])[0] # player max speed in m/s
+        self.reaction_time = get_player_params(params, 'reaction_time', teamname, [pid])[0] # player reaction time in 's'
+        self.amax = get_player_params(params, 'max_player_accel', teamname, [pid])[0] # player max acceleration in m/s/s (only used by the 'acceleration' time-to-intercept model)
+        self.tti_model = params.get('time_to_intercept_model','straight')
         self.tti_sigma = params['tti_sigma'] # standard deviation of sigmoid function (see Eq 4 in Spearman, 2018)
         self.lambda_att = params['lambda_att'] # standard deviation of sigmoid function (see Eq 4 in Spearman, 2018)
         self.lambda_def = params['lambda_gk'] if self.is_gk else params['lambda_def'] # factor of 3 ensures that anything near the GK is likely to be claimed by the GK
@@ -141,6 +598,9 @@ class player(object):
         self.PPCF = 0. # initialise this for later
         # Time to intercept assumes that the player continues moving at current velocity for 'reaction_time' seconds
         # and then runs at full speed to the target position.
+        if self.tti_model=='acceleration':
+            self.time_to_intercept = _accelerated_time_to_intercept_scalar(self.position, self.velocity, r_final, self.reaction_time, self.vmax, self.amax)
+            return self.time_to_intercept
         r_reaction = self.position + self.velocity*self.reaction_time
         self.time_to_intercept = self.reaction_time + np.linalg.norm(r_final-r_reaction)/self.vmax
         return self.time_to_intercept
@@ -152,6 +612,83 @@ class player(object):
 
 """ Generate pitch control map """
 
+class pitch_control_stats(object):
+    """
+    pitch_control_stats() class
+    
+    Collects diagnostics from the pitch control calculations, to help choose the numerical parameters (int_dt, max_int_time and 
+    time_to_control_veto, see default_model_params() ). Pass an instance as the 'stats' argument of generate_pitch_control_for_event()
+    (or calculate_pitch_control_at_target(), calculate_pitch_control_at_targets(), generate_pitch_control_for_team_states(), 
+    generate_pitch_control_for_frame_sequence(), Metrica_Batch.generate_pitch_control_for_frames() ) and it accumulates over all calls.
+    
+    __init__ Parameters
+    -----------
+    on_failure: optional function called as on_failure(frame, target_position, total_probability) each time the integration fails to converge
+    
+    attributes include:
+    -----------
+    n_targets: number of target positions evaluated
+    n_attack_shortcut, n_defence_shortcut: number of target positions where the attacking / defending team was given full control without integrating
+    n_integrated: number of target positions where the model was integrated
+    steps: histogram of the number of integration steps taken at each integrated target position (steps[k] is the number of targets that took k steps)
+    failures: list of (frame, target_position, total_probability) for each target position where the integration failed to converge
+    time: dictionary of the time (in seconds) spent in each stage: 'setup' (players and offsides), 'time_to_intercept', 'shortcuts' and 'integration'
+    frame, targets: the frame and target positions currently being evaluated (set by the calculating functions, and recorded with any failures)
+    
+    methods include:
+    -----------
+    add_integrations(steps, converged, target_positions, total_probability, elapsed=0.): record the result of integrating at a set of target positions
+    merge(other): add the diagnostics collected by another pitch_control_stats object (e.g. in a worker process, see Metrica_Batch)
+    summary(): dictionary of the main diagnostics (fractions of short-cuts, mean and maximum steps, failures and times)
+    
+    """
+    def __init__(self, on_failure=None):
+        self.on_failure = on_failure
+        self.n_targets = 0
+        self.n_attack_shortcut = 0
+        self.n_defence_shortcut = 0
+        self.n_integrated = 0
+        self.steps = np.zeros(0, dtype=int)
+        self.failures = []
+        self.time = {'setup': 0., 'time_to_intercept': 0., 'shortcuts': 0., 'integration': 0.}
+        self.frame = None
+        self.targets = None
+        
+    def add_integrations(self, steps, converged, target_positions, total_probability, elapsed=0.):
+        steps = np.asarray(steps, dtype=int)
+        self.n_integrated += len(steps)
+        counts = np.bincount(steps)
+        if len(counts)>len(self.steps):
+            self.steps = np.concatenate( (self.steps, np.zeros(len(counts)-len(self.steps), dtype=int)) )
+        self.steps[:len(counts)] += counts
+        for k in np.flatnonzero( ~np.asarray(converged) ):
+            failure = (self.frame, tuple(target_positions[k]), float(total_probability[k]))
+            self.failures.append(failure)
+            if self.on_failure is not None:
+                self.on_failure(*failure)
+        self.time['integration'] += elapsed
+        
+    def merge(self, other):
+        self.n_targets += other.n_targets
+        self.n_attack_shortcut += other.n_attack_shortcut
+        self.n_defence_shortcut += other.n_defence_shortcut
+        self.n_integrated += other.n_integrated
+        if len(other.steps)>len(self.steps):
+            self.steps = np.concatenate( (self.steps, np.zeros(len(other.steps)-len(self.steps), dtype=int)) )
+        self.steps[:len(other.steps)] += other.steps
+        for failure in other.failures:
+            self.failures.append(failure)
+            if self.on_failure is not None:
+                self.on_failure(*failure)
+        for stage,elapsed in other.time.items():
+            self.time[stage] = self.time.get(stage,0.) + elapsed
+        
+    def summary(self):
+        n = max(self.n_targets,1)
+        return {'n_targets': self.n_targets, 'attack_shortcut_fraction': self.n_attack_shortcut/n, 'defence_shortcut_fraction': self.n_defence_shortcut/n,
+                'integrated_fraction': self.n_integrated/n, 'mean_steps': np.dot(np.arange(len(self.steps)),self.steps)/max(self.n_integrated,1),
+                'max_steps': len(self.steps)-1, 'n_failures': len(self.failures), 'time': dict(self.time)}
+
 def default_model_params(time_to_control_veto=3):
     """
     default_model_params()
@@ -172,9 +709,15 @@ def default_model_params(time_to_control_veto=3):
     # key parameters for the model, as described in Spearman 2018
     params = {}
     # model parameters
-    params['max_player_accel'] = 7. # maximum player acceleration m/s/s, not used in this implementation
+    params['max_player_accel'] = 7. # maximum player acceleration m/s/s, only used if time_to_intercept_model is 'acceleration'
     params['max_player_speed'] = 5. # maximum player speed m/s
     params['reaction_time'] = 0.7 # seconds, time taken for player to react and change trajectory. Roughly determined as vmax/amax
+    # optional individual player parameters: dictionaries of player name (e.g. 'Home_5') -> value, e.g. params['player_max_speed'] = Metrica_Velocities.calc_player_max_speeds(tracking_home)
+    # Any player not in the dictionary uses the value for all players above.
+    params['player_max_speed'] = {} # maximum speed of individual players in m/s
+    params['player_max_accel'] = {} # maximum acceleration of individual players in m/s/s
+    params['player_reaction_time'] = {} # reaction time of individual players in seconds
+    params['time_to_intercept_model'] = 'straight' # 'straight': run at max speed in a straight line after the reaction time. 'acceleration': accelerate towards the target (see calculate_accelerated_time_to_intercept)
     params['tti_sigma'] = 0.45 # Standard deviation of sigmoid function in Spearman 2018 ('s') that determines uncertainty in player arrival time
     params['kappa_def'] =  1. # kappa parameter in Spearman 2018 (=1.72 in the paper) that gives the advantage defending players to control ball, I have set to 1 so that home & away players have same ball control probability
     params['lambda_att'] = 4.3 # ball control parameter for attacking team
@@ -185,13 +728,16 @@ def default_model_params(time_to_control_veto=3):
     params['int_dt'] = 0.04 # integration timestep (dt)
     params['max_int_time'] = 10 # upper limit on integral time
     params['model_converge_tol'] = 0.01 # assume convergence when PPCF>0.99 at a given location.
+    params['integration_method'] = 'euler' # 'euler' integrates with fixed timestep int_dt. 'analytic' is an approximation with about 10x faster integration (see solve_pitch_control_analytic). 'adaptive' uses an error-controlled timestep (see solve_pitch_control_adaptive)
+    params['analytic_int_width'] = 1.0 # length of the integration intervals of the 'analytic' method, in units of tti_sigma (see solve_pitch_control_analytic for the speed and accuracy)
+    params['adaptive_int_tol'] = 1e-3 # maximum error in control probability per step for the 'adaptive' method
     # The following are 'short-cut' parameters. We do not need to calculated PPCF explicitly when a player has a sufficient head start. 
     # A sufficient head start is when the a player arrives at the target location at least 'time_to_control' seconds before the next player
     params['time_to_control_att'] = time_to_control_veto*np.log(10) * (np.sqrt(3)*params['tti_sigma']/np.pi + 1/params['lambda_att'])
     params['time_to_control_def'] = time_to_control_veto*np.log(10) * (np.sqrt(3)*params['tti_sigma']/np.pi + 1/params['lambda_def'])
     return params
 
-def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True):
+def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, vectorized=False, adaptive=False, cache=None, player_contributions=False, stats=None):
     """ generate_pitch_control_for_event
     
     Evaluates pitch control surface over the entire field at the moment of the given event (determined by the index of the event passed as an input)
@@ -208,6 +754,16 @@ def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_a
         n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
                         n_grid_cells_y will be calculated based on n_grid_cells_x and the field dimensions
         offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+        vectorized: If True, evaluate every grid cell at once using integrate_pitch_control() rather than looping over the cells
+                    with calculate_pitch_control_at_target(). Results agree to within params['model_converge_tol']. Default is False.
+        adaptive: If True, evaluate a coarse grid first and only refine the cells near contested regions of the surface (implies
+                  vectorized=True, see generate_pitch_control_for_team_states() ). Useful for high-resolution surfaces. Default is False.
+        cache: a Metrica_Cache.pitch_control_cache object. If given, the surface is taken from the cache when it has already been
+               calculated for this frame (and team in possession, parameters, grid and offsides flag), and added to it otherwise.
+        player_contributions: If True, also return the pitch control surface of each individual player (implies vectorized=True, not 
+                              available in adaptive mode, and the cache is not used). Default is False.
+        stats: optional pitch_control_stats object, updated with the number of target positions that were decided by each short-cut, 
+               the number of integration steps, any failures to converge (with the frame and target position) and the time spent in each stage.
         
     UPDATE (tutorial 4): Note new input arguments ('GK_numbers' and 'offsides')
         
@@ -217,44 +773,283 @@ def generate_pitch_control_for_event(event_id, events, tracking_home, tracking_a
                Surface for the defending team is just 1-PPCFa.
         xgrid: Positions of the pixels in the x-direction (field length)
         ygrid: Positions of the pixels in the y-direction (field width)
+        PPCFplayers: (only if player_contributions=True) Pitch control surface of each player (dimen (n_players,n_grid_cells_y,n_grid_cells_x) )
+        player_names: (only if player_contributions=True) name of each player in PPCFplayers (e.g. 'Home_5'), attacking players first
     """
     # get the details of the event (frame, team in possession, ball_start_position)
     pass_frame = events.loc[event_id]['Start Frame']
     pass_team = events.loc[event_id].Team
     ball_start_pos = np.array([events.loc[event_id]['Start X'],events.loc[event_id]['Start Y']])
     # break the pitch down into a grid
-    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
-    dx = field_dimen[0]/n_grid_cells_x
-    dy = field_dimen[1]/n_grid_cells_y
-    xgrid = np.arange(n_grid_cells_x)*dx - field_dimen[0]/2. + dx/2.
-    ygrid = np.arange(n_grid_cells_y)*dy - field_dimen[1]/2. + dy/2.
+    xgrid,ygrid = get_pitch_grid(field_dimen, n_grid_cells_x)
+    n_grid_cells_y = len(ygrid)
+    if cache is not None and not player_contributions:
+        cache_key = cache.key(pass_frame, pass_team, params, field_dimen, n_grid_cells_x, offsides, mode='_adaptive' if adaptive else '', ball_start_pos=ball_start_pos)
+        PPCFa = cache.get(cache_key)
+        if PPCFa is not None:
+            return PPCFa,xgrid,ygrid
+        PPCFa,xgrid,ygrid = generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, field_dimen, n_grid_cells_x, offsides, vectorized, adaptive, stats=stats)
+        cache.put(cache_key, PPCFa)
+        return PPCFa,xgrid,ygrid
+    if stats is not None:
+        stats.frame = pass_frame
+        t0 = time.perf_counter()
     # initialise pitch control grids for attacking and defending teams 
     PPCFa = np.zeros( shape = (len(ygrid), len(xgrid)) )
     PPCFd = np.zeros( shape = (len(ygrid), len(xgrid)) )
     # initialise player positions and velocities for pitch control calc (so that we're not repeating this at each grid cell position)
+    vectorized = vectorized or adaptive or player_contributions
+    if vectorized:
+        # the vectorized calculation uses team_state objects rather than lists of player objects
+        initialise, check = initialise_team_state, check_offsides_team
+    else:
+        initialise, check = initialise_players, check_offsides
     if pass_team=='Home':
-        attacking_players = initialise_players(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
-        defending_players = initialise_players(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
+        attacking_team = initialise(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        defending_team = initialise(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
     elif pass_team=='Away':
-        defending_players = initialise_players(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
-        attacking_players = initialise_players(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
+        defending_team = initialise(tracking_home.loc[pass_frame],'Home',params,GK_numbers[0])
+        attacking_team = initialise(tracking_away.loc[pass_frame],'Away',params,GK_numbers[1])
     else:
         assert False, "Team in possession must be either home or away"
         
     # find any attacking players that are offside and remove them from the pitch control calculation
     if offsides:
-        attacking_players = check_offsides( attacking_players, defending_players, ball_start_pos, GK_numbers)
+        attacking_team = check( attacking_team, defending_team, ball_start_pos, GK_numbers)
+    if stats is not None:
+        stats.time['setup'] += time.perf_counter()-t0
+    if player_contributions:
+        PPCFa,xgrid,ygrid,PPCFplayers = generate_pitch_control_for_team_states(attacking_team, defending_team, ball_start_pos, params, field_dimen, n_grid_cells_x, player_contributions=True, stats=stats)
+        player_names = ["%s_%s" % (team.teamname,pid) for team in (attacking_team,defending_team) for pid in team.ids]
+        return PPCFa,xgrid,ygrid,PPCFplayers,player_names
+    if vectorized:
+        # calculate pitch control model at every location on the pitch in one go
+        return generate_pitch_control_for_team_states(attacking_team, defending_team, ball_start_pos, params, field_dimen, n_grid_cells_x, adaptive=adaptive, stats=stats)
     # calculate pitch pitch control model at each location on the pitch
     for i in range( len(ygrid) ):
         for j in range( len(xgrid) ):
             target_position = np.array( [xgrid[j], ygrid[i]] )
-            PPCFa[i,j],PPCFd[i,j] = calculate_pitch_control_at_target(target_position, attacking_players, defending_players, ball_start_pos, params)
+            PPCFa[i,j],PPCFd[i,j] = calculate_pitch_control_at_target(target_position, attacking_team, defending_team, ball_start_pos, params, stats)
     # check probabilitiy sums within convergence
     checksum = np.sum( PPCFa + PPCFd ) / float(n_grid_cells_y*n_grid_cells_x ) 
     assert 1-checksum < params['model_converge_tol'], "Checksum failed: %1.3f" % (1-checksum)
     return PPCFa,xgrid,ygrid
 
-def calculate_pitch_control_at_target(target_position, attacking_players, defending_players, ball_start_pos, params):
+def get_pitch_grid(field_dimen = (106.,68.,), n_grid_cells_x = 50):
+    """ get_pitch_grid
+    
+    Breaks the pitch down into a grid of cells, as used for the pitch control surfaces
+    
+    Parameters
+    -----------
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+                        n_grid_cells_y will be calculated based on n_grid_cells_x and the field dimensions
+        
+    Returrns
+    -----------
+        xgrid: Positions of the pixels in the x-direction (field length)
+        ygrid: Positions of the pixels in the y-direction (field width)
+    """
+    n_grid_cells_y = int(n_grid_cells_x*field_dimen[1]/field_dimen[0])
+    dx = field_dimen[0]/n_grid_cells_x
+    dy = field_dimen[1]/n_grid_cells_y
+    xgrid = np.arange(n_grid_cells_x)*dx - field_dimen[0]/2. + dx/2.
+    ygrid = np.arange(n_grid_cells_y)*dy - field_dimen[1]/2. + dy/2.
+    return xgrid,ygrid
+
+def generate_pitch_control_for_team_states(attacking_team, defending_team, ball_start_pos, params, field_dimen = (106.,68.,), n_grid_cells_x = 50, adaptive=False, adaptive_levels=3, adaptive_band=(0.1,0.9), player_contributions=False, tti_field=None, stats=None):
+    """ generate_pitch_control_for_team_states
+    
+    Evaluates the pitch control surface over the entire field for a given instant, described by the team_state objects of the 
+    attacking and defending teams (any offside players must already be flagged, see check_offsides_team() )
+    
+    In adaptive mode, the model is first evaluated on a coarse grid (every 2^adaptive_levels cells), which is then refined by halving
+    the spacing of the grid at each level. At each level, a new cell is only evaluated if the surrounding cells of the previous level
+    are contested (pitch control within 'adaptive_band') or disagree (some are below the band and others above it). All other cells
+    are saturated regions of the surface and are filled in by bilinear interpolation.
+    
+    Parameters
+    -----------
+        attacking_team: team_state object for the attacking team (team in possession)
+        defending_team: team_state object for the defending team
+        ball_start_pos: Current position of the ball (start position for a pass). If set to NaN, function will assume that the ball is already at the target position.
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+        adaptive: If True, use adaptive refinement rather than evaluating every cell. Worthwhile for high-resolution grids (e.g. 
+                  n_grid_cells_x=210). Default is False
+        adaptive_levels: Maximum number of refinement levels in adaptive mode. The coarse grid evaluates every 2^adaptive_levels cells (but no 
+                         more than 5m apart, see adaptive_pitch_control_surface() ). Default is 3
+        adaptive_band: (lower,upper) range of pitch control probability that is considered contested in adaptive mode. Default is (0.1,0.9)
+        player_contributions: If True, also return the pitch control surface of each individual player (not available in adaptive mode). Default is False
+        tti_field: optional time_to_intercept_field object (on the same grid) to take the players' arrival times from (not used in adaptive mode)
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() )
+        
+    Returrns
+    -----------
+        PPCFa: Pitch control surface (dimen (n_grid_cells_x,n_grid_cells_y) ) containing pitch control probability for the attcking team.
+               Surface for the defending team is just 1-PPCFa.
+        xgrid: Positions of the pixels in the x-direction (field length)
+        ygrid: Positions of the pixels in the y-direction (field width)
+        PPCFplayers: (only if player_contributions=True) Pitch control surface of each player (dimen (n_players,n_grid_cells_y,n_grid_cells_x) ),
+                     players of attacking_team first, then those of defending_team. Summing over the attacking players gives PPCFa.
+    """
+    xgrid,ygrid = get_pitch_grid(field_dimen, n_grid_cells_x)
+    if player_contributions:
+        assert not adaptive, "Individual player contributions are not available in adaptive mode"
+        xx,yy = np.meshgrid(xgrid,ygrid)
+        target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+        PPCFatt,PPCFdef,PPCFplayers = calculate_pitch_control_at_targets(target_positions, attacking_team, defending_team, ball_start_pos, params, player_contributions=True, tti_field=tti_field, stats=stats)
+        PPCFa = PPCFatt.reshape( len(ygrid), len(xgrid) )
+        checksum = np.sum( PPCFatt + PPCFdef ) / float( PPCFa.size ) 
+        assert 1-checksum < params['model_converge_tol'], "Checksum failed: %1.3f" % (1-checksum)
+        return PPCFa,xgrid,ygrid,PPCFplayers.reshape( -1, len(ygrid), len(xgrid) )
+    if adaptive:
+        PPCFa,PPCFd = adaptive_pitch_control_surface(xgrid, ygrid, attacking_team, defending_team, ball_start_pos, params, adaptive_levels, adaptive_band, stats=stats)
+    else:
+        xx,yy = np.meshgrid(xgrid,ygrid)
+        target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+        PPCFatt,PPCFdef = calculate_pitch_control_at_targets(target_positions, attacking_team, defending_team, ball_start_pos, params, tti_field=tti_field, stats=stats)
+        PPCFa = PPCFatt.reshape( len(ygrid), len(xgrid) )
+        PPCFd = PPCFdef.reshape( len(ygrid), len(xgrid) )
+    # check probabilitiy sums within convergence
+    checksum = np.sum( PPCFa + PPCFd ) / float( PPCFa.size ) 
+    assert 1-checksum < params['model_converge_tol'], "Checksum failed: %1.3f" % (1-checksum)
+    return PPCFa,xgrid,ygrid
+
+def adaptive_pitch_control_surface(xgrid, ygrid, attacking_team, defending_team, ball_start_pos, params, levels=3, band=(0.1,0.9), max_spacing=5., stats=None):
+    """ adaptive_pitch_control_surface
+    
+    Evaluates the pitch control surface on the grid defined by xgrid and ygrid, using adaptive refinement (see generate_pitch_control_for_team_states() )
+    
+    Parameters
+    -----------
+        xgrid: Positions of the pixels in the x-direction (field length)
+        ygrid: Positions of the pixels in the y-direction (field width)
+        attacking_team: team_state object for the attacking team (team in possession)
+        defending_team: team_state object for the defending team
+        ball_start_pos: Current position of the ball (start position for a pass). If set to NaN, function will assume that the ball is already at the target position.
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        levels: Number of refinement levels. The coarse grid evaluates every 2^levels cells. Default is 3
+        band: (lower,upper) range of pitch control probability that is considered contested. Default is (0.1,0.9)
+        max_spacing: largest spacing (in meters) of the cells of the coarse grid; fewer levels are used if necessary. Default is 5m, which
+                     keeps the maximum deviation from the full surface to about 0.05 (it grows to 0.1-0.6 for a spacing of 8-17m)
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() )
+        
+    A cell is evaluated if any of the surrounding cells of the previous level are contested or disagree, or if a player (after their 
+    reaction time) or the ball is within the surrounding cells (or one cell beyond them), as a player's region of control can lie 
+    between the cells of the previous level. Other cells are interpolated.
+        
+    Returrns
+    -----------
+        PPCFa: Pitch control surface (dimen (len(ygrid),len(xgrid)) ) for the attacking team
+        PPCFd: Pitch control surface (dimen (len(ygrid),len(xgrid)) ) for the defending team
+    """
+    PPCFa = np.full( (len(ygrid),len(xgrid)), np.nan )
+    PPCFd = np.full( (len(ygrid),len(xgrid)), np.nan )
+    def lattice(n, stride):
+        # indices of the cells evaluated at a given refinement level (always including the last row/column of the grid)
+        return np.union1d( np.arange(0,n,stride), [n-1] )
+    def evaluate(iy, ix):
+        targets = np.column_stack( (xgrid[ix], ygrid[iy]) )
+        PPCFa[iy,ix],PPCFd[iy,ix] = calculate_pitch_control_at_targets(targets, attacking_team, defending_team, ball_start_pos, params, stats=stats)
+    # positions of the players after their reaction time (and of the ball), in units of grid cells
+    points = [ team.position[players] + team.velocity[players]*team.reaction_time[players,np.newaxis] 
+               for team,players in ((attacking_team,~attacking_team.offside),(defending_team,slice(None))) ]
+    if ball_start_pos is not None and not np.any(np.isnan(ball_start_pos)):
+        points.append( np.reshape(ball_start_pos,(1,2)) )
+    points = np.vstack(points)
+    px = ( points[:,0]-xgrid[0] )/( xgrid[1]-xgrid[0] )
+    py = ( points[:,1]-ygrid[0] )/( ygrid[1]-ygrid[0] )
+    # make sure that features of the surface are not lost between the cells of the coarse grid
+    while levels>0 and 2**levels*(xgrid[1]-xgrid[0])>max_spacing:
+        levels -= 1
+    stride = 2**levels
+    old_ix,old_iy = lattice(len(xgrid),stride), lattice(len(ygrid),stride)
+    iy,ix = np.meshgrid(old_iy, old_ix, indexing='ij')
+    evaluate(iy.ravel(), ix.ravel())
+    while stride>1:
+        stride //= 2
+        new_ix,new_iy = lattice(len(xgrid),stride), lattice(len(ygrid),stride)
+        iy,ix = np.meshgrid(new_iy, new_ix, indexing='ij')
+        new = np.isnan( PPCFa[iy,ix] )
+        iy,ix = iy[new],ix[new]
+        # cells of the previous level that surround each new cell
+        x0 = old_ix[ np.searchsorted(old_ix, ix, side='right')-1 ]
+        x1 = old_ix[ np.searchsorted(old_ix, ix, side='left') ]
+        y0 = old_iy[ np.searchsorted(old_iy, iy, side='right')-1 ]
+        y1 = old_iy[ np.searchsorted(old_iy, iy, side='left') ]
+        corners = np.stack( (PPCFa[y0,x0], PPCFa[y0,x1], PPCFa[y1,x0], PPCFa[y1,x1]) )
+        contested = np.any( (corners>band[0]) & (corners<band[1]), axis=0 )
+        disagree = (corners.min(axis=0)<=band[0]) & (corners.max(axis=0)>=band[1])
+        # a player's region of control can fall between the corners of a cell, so also refine every cell near a player (or the ball)
+        near = np.any( (px>=x0[:,np.newaxis]-(x1-x0)[:,np.newaxis]) & (px<=x1[:,np.newaxis]+(x1-x0)[:,np.newaxis]) &
+                       (py>=y0[:,np.newaxis]-(y1-y0)[:,np.newaxis]) & (py<=y1[:,np.newaxis]+(y1-y0)[:,np.newaxis]), axis=1 )
+        refine = contested | disagree | near
+        evaluate(iy[refine], ix[refine])
+        # fill in the saturated cells by bilinear interpolation of the surrounding cells
+        fill = ~refine
+        iy,ix,x0,x1,y0,y1 = iy[fill],ix[fill],x0[fill],x1[fill],y0[fill],y1[fill]
+        wx = np.where( x1>x0, (ix-x0)/np.maximum(x1-x0,1), 0. )
+        wy = np.where( y1>y0, (iy-y0)/np.maximum(y1-y0,1), 0. )
+        for P in (PPCFa,PPCFd):
+            P[iy,ix] = (1-wy)*( (1-wx)*P[y0,x0] + wx*P[y0,x1] ) + wy*( (1-wx)*P[y1,x0] + wx*P[y1,x1] )
+        old_ix,old_iy = new_ix,new_iy
+    return PPCFa,PPCFd
+
+def calculate_pitch_control_at_targets(target_positions, attacking_team, defending_team, ball_start_pos, params, player_contributions=False, tti_field=None, stats=None):
+    """ calculate_pitch_control_at_targets
+    
+    Calculates the pitch control probability for the attacking and defending teams at a set of target positions, using the 
+    vectorized model solution (see integrate_pitch_control() ). This is the multi-target equivalent of calculate_pitch_control_at_target():
+    all targets are evaluated in one pass over the team states, so e.g. the start and end points of a pass, or a set of candidate
+    pass targets, only need a single call.
+    
+    Parameters
+    -----------
+        target_positions: (N,2) numpy array containing the (x,y) positions on the field at which to evaluate pitch control
+        attacking_team: team_state object for the attacking team (team in possession). Players flagged offside are ignored
+        defending_team: team_state object for the defending team
+        ball_start_pos: Current position of the ball (start position for a pass), either a single (x,y) position or an (N,2) array 
+                        with a start position for each target. If set to NaN (or None), function will assume that the ball is already 
+                        at the target position.
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        player_contributions: If True, also return the pitch control probability of each individual player. Default is False
+        tti_field: optional time_to_intercept_field object to take the players' arrival times from. target_positions must then be the cells 
+                   of its grid, in the order given by np.meshgrid(xgrid,ygrid)
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() )
+        
+    Returrns
+    -----------
+        PPCFatt: (N,) array of pitch control probability for the attacking team
+        PPCFdef: (N,) array of pitch control probability for the defending team
+        PPCFplayers: (only if player_contributions=True) (n_att+n_def,N) array of the pitch control probability of each player in 
+                     attacking_team followed by each player in defending_team (zero for offside players)
+    """
+    target_positions = np.asarray(target_positions, dtype=float).reshape(-1,2)
+    onside = ~attacking_team.offside
+    if stats is not None:
+        stats.targets = target_positions
+        t0 = time.perf_counter()
+    if tti_field is not None:
+        tau_att = tti_field.update(attacking_team)[onside].reshape( -1, len(target_positions) )
+        tau_def = tti_field.update(defending_team).reshape( -1, len(target_positions) )
+    else:
+        tau_att = attacking_team.time_to_intercept(target_positions)[onside]
+        tau_def = defending_team.time_to_intercept(target_positions)
+    ball_travel_time = calculate_ball_travel_time(target_positions, ball_start_pos, params)
+    if stats is not None:
+        stats.time['time_to_intercept'] += time.perf_counter()-t0
+    if player_contributions:
+        PPCFatt,PPCFdef,PPCFonside = integrate_pitch_control(tau_att, tau_def, attacking_team.lambda_att[onside], defending_team.lambda_def, ball_travel_time, params, player_contributions=True, stats=stats)
+        # put back a (zero) row for any offside players
+        PPCFplayers = np.zeros( (len(onside)+len(defending_team.ids), len(target_positions)) )
+        PPCFplayers[ np.concatenate( (onside, np.ones(len(defending_team.ids),dtype=bool)) ) ] = PPCFonside
+        return PPCFatt,PPCFdef,PPCFplayers
+    return integrate_pitch_control(tau_att, tau_def, attacking_team.lambda_att[onside], defending_team.lambda_def, ball_travel_time, params, stats=stats)
+
+def calculate_pitch_control_at_target(target_position, attacking_players, defending_players, ball_start_pos, params, stats=None):
     """ calculate_pitch_control_at_target
     
     Calculates the pitch control probability for the attacking and defending teams at a specified target position on the ball.
@@ -266,12 +1061,16 @@ def calculate_pitch_control_at_target(target_position, attacking_players, defend
         defending_players: list of 'player' objects (see player class above) for the players on the defending team
         ball_start_pos: Current position of the ball (start position for a pass). If set to NaN, function will assume that the ball is already at the target position.
         params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() )
         
     Returrns
     -----------
         PPCFatt: Pitch control probability for the attacking team
         PPCFdef: Pitch control probability for the defending team ( 1-PPCFatt-PPCFdef <  params['model_converge_tol'] )
     """
+    if stats is not None:
+        stats.n_targets += 1
+        t0 = time.perf_counter()
     # calculate ball travel time from start position to end position.
     if ball_start_pos is None or any(np.isnan(ball_start_pos)): # assume that ball is already at location
         ball_travel_time = 0.0 
@@ -282,19 +1081,39 @@ def calculate_pitch_control_at_target(target_position, attacking_players, defend
     # first get arrival time of 'nearest' attacking player (nearest also dependent on current velocity)
     tau_min_att = np.nanmin( [p.simple_time_to_intercept(target_position) for p in attacking_players] )
     tau_min_def = np.nanmin( [p.simple_time_to_intercept(target_position ) for p in defending_players] )
+    if stats is not None:
+        t1 = time.perf_counter()
+        stats.time['time_to_intercept'] += t1-t0
     
     # check whether we actually need to solve equation 3
     if tau_min_att-max(ball_travel_time,tau_min_def) >= params['time_to_control_def']:
         # if defending team can arrive significantly before attacking team, no need to solve pitch control model
+        if stats is not None:
+            stats.n_defence_shortcut += 1
         return 0., 1.
     elif tau_min_def-max(ball_travel_time,tau_min_att) >= params['time_to_control_att']:
         # if attacking team can arrive significantly before defending team, no need to solve pitch control model
+        if stats is not None:
+            stats.n_attack_shortcut += 1
         return 1., 0.
     else: 
         # solve pitch control model by integrating equation 3 in Spearman et al.
         # first remove any player that is far (in time) from the target location
         attacking_players = [p for p in attacking_players if p.time_to_intercept-tau_min_att < params['time_to_control_att'] ]
         defending_players = [p for p in defending_players if p.time_to_intercept-tau_min_def < params['time_to_control_def'] ]
+        if params.get('integration_method','euler')!='euler':
+            # use the (approximate) semi-analytic solution or the adaptive timestep integrator instead, see get_pitch_control_solver().
+            # A single target is integrated without numpy
+            solve = _solve_pitch_control_adaptive_scalar if get_pitch_control_solver(params) is solve_pitch_control_adaptive else _solve_pitch_control_analytic_scalar
+            PPCF,converged,steps = solve([p.time_to_intercept for p in attacking_players+defending_players], 
+                                         [p.lambda_att for p in attacking_players] + [p.lambda_def for p in defending_players], ball_travel_time, params)
+            if not converged:
+                print("Integration failed to converge: %1.3f" % (sum(PPCF)) )
+            if stats is not None:
+                stats.add_integrations([steps], [converged], target_position[np.newaxis], [sum(PPCF)], time.perf_counter()-t1)
+            for player,PPCFplayer in zip(attacking_players+defending_players, PPCF):
+                player.PPCF = PPCFplayer
+            return sum(PPCF[:len(attacking_players)]), sum(PPCF[len(attacking_players):])
         # set up integration arrays
         dT_array = np.arange(ball_travel_time-params['int_dt'],ball_travel_time+params['max_int_time'],params['int_dt']) 
         PPCFatt = np.zeros_like( dT_array )
@@ -322,4 +1141,909 @@ def calculate_pitch_control_at_target(target_position, attacking_players, defend
             i += 1
         if i>=dT_array.size:
             print("Integration failed to converge: %1.3f" % (ptot) )
+        if stats is not None:
+            stats.add_integrations([i-1], [i<dT_array.size], target_position[np.newaxis], [ptot], time.perf_counter()-t1)
         return PPCFatt[i-1], PPCFdef[i-1]
+
+def calculate_ball_travel_time(target_positions, ball_start_pos, params):
+    """ calculate_ball_travel_time
+    
+    Time taken for the ball to travel to each target position (at params['average_ball_speed']) 
+    
+    Parameters
+    -----------
+        target_positions: (N,2) numpy array containing the (x,y) positions of the targets
+        ball_start_pos: a single (x,y) start position of the ball, or an (N,2) array with a start position for each target. Where the 
+                        start position is NaN (or None), the ball is assumed to already be at the target position.
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        
+    Returrns
+    -----------
+        ball_travel_time: (N,) array of ball travel times
+    """
+    if ball_start_pos is None: # assume that ball is already at location
+        return np.zeros( len(target_positions) )
+    ball_start_pos = np.asarray(ball_start_pos, dtype=float)
+    if ball_start_pos.ndim==1 and np.any(np.isnan(ball_start_pos)): # assume that ball is already at location
+        return np.zeros( len(target_positions) )
+    ball_travel_time = np.linalg.norm( target_positions - ball_start_pos, axis=-1 )/params['average_ball_speed']
+    ball_travel_time[ np.isnan(ball_travel_time) ] = 0.
+    return ball_travel_time
+
+def calculate_pass_interception_probability(pass_start_pos, pass_target_positions, defending_team, params, n_samples=20):
+    """ calculate_pass_interception_probability
+    
+    Probability that each of a set of passes is intercepted by a defending player while the ball is travelling to the target (pitch 
+    control only considers the target position itself). Each pass is sampled at 'n_samples' points along the straight line from the 
+    start to the target, which the ball reaches at params['average_ball_speed']. While the ball passes through each sample, every defender 
+    who could have arrived there (with the same sigmoid arrival time distribution as the pitch control model) can control it at their
+    usual rate (lambda_def, or lambda_gk for the goalkeeper). The arrival times at the sample points of every pass are evaluated in 
+    a single call, so e.g. every cell of the pitch control grid can be scored as a candidate pass at once.
+    
+    The probability that a pass is completed is then (1-P_intercept)*PPCFatt at the target (see Metrica_EPV.calculate_epv_added() ).
+    
+    Parameters
+    -----------
+        pass_start_pos: start position of the passes, either a single (x,y) position or an (N,2) array with a start position for each pass
+        pass_target_positions: (N,2) numpy array containing the (x,y) target positions of the passes
+        defending_team: team_state object for the defending team
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        n_samples: number of points sampled along each pass. Default is 20
+        
+    Returrns
+    -----------
+        P_intercept: (N,) array of the probability that each pass is intercepted
+        P_defenders: (n_def,N) array of the probability that each pass is intercepted by each player in defending_team (sums to P_intercept)
+    """
+    targets = np.asarray(pass_target_positions, dtype=float).reshape(-1,2)
+    start = np.broadcast_to( np.asarray(pass_start_pos, dtype=float), targets.shape )
+    # sample points at the middle of 'n_samples' equal segments of each pass
+    fraction = ( np.arange(n_samples)+0.5 )/n_samples
+    points = start[:,np.newaxis,:] + fraction[np.newaxis,:,np.newaxis]*(targets-start)[:,np.newaxis,:]
+    length = np.nan_to_num( np.linalg.norm(targets-start, axis=1) ) # ball is already at the target if the start position is NaN
+    ball_time = fraction[np.newaxis,:]*length[:,np.newaxis]/params['average_ball_speed'] # time at which the ball reaches each sample
+    dt = length/n_samples/params['average_ball_speed'] # time that the ball takes to pass through each segment
+    tau = defending_team.time_to_intercept( np.nan_to_num(points).reshape(-1,2) ).reshape( -1, len(targets), n_samples )
+    # rate at which each defender can control the ball at each sample (shape: defenders, passes, samples)
+    sigmoid_factor = np.pi/np.sqrt(3.0)/params['tti_sigma']
+    with np.errstate(over='ignore'):
+        rate = defending_team.lambda_def[:,np.newaxis,np.newaxis]/(1. + np.exp( -sigmoid_factor*(ball_time[np.newaxis,:,:]-tau) ))
+    total_rate = rate.sum(axis=0)
+    # probability that the ball has not been intercepted by the end of each segment
+    S = np.exp( -np.cumsum( total_rate*dt[:,np.newaxis], axis=1 ) )
+    P_segment = np.column_stack( (np.ones(len(targets)), S[:,:-1]) ) - S
+    # the interceptions in each segment are shared between the defenders in proportion to their rate
+    P_defenders = np.einsum( 'dnk,nk->dn', rate, P_segment/np.where(total_rate>0, total_rate, 1.) )
+    return 1.-S[:,-1], P_defenders
+
+def integrate_pitch_control(tau_att, tau_def, lambda_att, lambda_def, ball_travel_time, params, chunk_size=256, time_block=None, player_contributions=False, stats=None):
+    """ integrate_pitch_control
+    
+    Vectorized version of calculate_pitch_control_at_target(): solves the pitch control model (equation 3 in Spearman 2018) for many 
+    target positions at once. The same 'short-cut' tests and the same forward integration (timestep params['int_dt']) are applied
+    to every target, but the players, targets and timesteps are evaluated as arrays of shape (players, targets, timesteps).
+    
+    Because the change in total control probability at each timestep only depends on the total at the previous timestep, the 
+    probability that the ball remains uncontrolled is a cumulative product over timesteps, so the time integral can be evaluated in
+    blocks of 'time_block' timesteps rather than one step at a time.
+    
+    Parameters
+    -----------
+        tau_att: (n_att,N) array of arrival times of the attacking players at each target position (see team_state.time_to_intercept() )
+        tau_def: (n_def,N) array of arrival times of the defending players at each target position
+        lambda_att: (n_att,) array of ball control parameters for the attacking players
+        lambda_def: (n_def,) array of ball control parameters for the defending players
+        ball_travel_time: (N,) array of ball travel times from the ball start position to each target position
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        chunk_size: number of target positions integrated together (limits the size of the (players, targets, timesteps) arrays). Default is 256 (16 times more for the 'adaptive' method, 8 times more for 'analytic')
+        time_block: number of timesteps evaluated together before checking for convergence. Default (None) is the default of the integration method
+                    (not used by the 'adaptive' method)
+        player_contributions: If True, also return the contribution of each individual player to the pitch control of their team. Default is False
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() ). Target positions of 
+               failures are taken from stats.targets, if set
+        
+    The integration method is set by params['integration_method']: 'euler' (default) is the fixed timestep integration of 
+    calculate_pitch_control_at_target() (see solve_pitch_control_euler() ), 'analytic' is an approximation with about 10x faster integration (see solve_pitch_control_analytic() )
+    and 'adaptive' integrates with an error-controlled timestep (see solve_pitch_control_adaptive() ).
+        
+    Returrns
+    -----------
+        PPCFatt: (N,) array of pitch control probability for the attacking team at each target position
+        PPCFdef: (N,) array of pitch control probability for the defending team at each target position
+        PPCFplayers: (only if player_contributions=True) (n_att+n_def,N) array of the pitch control probability of each player (attacking 
+                     players first) at each target position. Where one team has full control without solving the model (see 
+                     check_pitch_control_shortcuts() ), it is assigned to the first player of that team to arrive.
+    """
+    if stats is not None:
+        t0 = time.perf_counter()
+    tau_att = np.asarray(tau_att, dtype=float)
+    tau_def = np.asarray(tau_def, dtype=float)
+    ball_travel_time = np.asarray(ball_travel_time, dtype=float)
+    n_att = tau_att.shape[0]
+    # stack both teams so that they can be integrated together
+    tau = np.vstack( (tau_att, tau_def) )
+    lambdas = np.concatenate( (np.asarray(lambda_att, dtype=float), np.asarray(lambda_def, dtype=float)) )
+    # first get arrival time of 'nearest' attacking and defending player at each target
+    tau_min_att = np.nanmin( tau_att, axis=0 )
+    tau_min_def = np.nanmin( tau_def, axis=0 )
+    PPCFatt = np.zeros( len(ball_travel_time) )
+    PPCFdef = np.zeros( len(ball_travel_time) )
+    # check whether we actually need to solve equation 3
+    attack_wins,defence_wins = check_pitch_control_shortcuts(tau_min_att, tau_min_def, ball_travel_time, params)
+    PPCFdef[defence_wins] = 1.
+    PPCFatt[attack_wins] = 1.
+    contested = np.flatnonzero( ~(defence_wins | attack_wins) )
+    if stats is not None:
+        stats.n_targets += len(ball_travel_time)
+        stats.n_attack_shortcut += np.sum(attack_wins)
+        stats.n_defence_shortcut += np.sum(defence_wins)
+        t1 = time.perf_counter()
+        stats.time['shortcuts'] += t1-t0
+        targets = stats.targets if stats.targets is not None and len(stats.targets)==len(ball_travel_time) else np.full( (len(ball_travel_time),2), np.nan )
+    if player_contributions:
+        PPCFplayers = np.zeros( tau.shape )
+        PPCFplayers[ np.nanargmin(tau_att[:,attack_wins],axis=0), np.flatnonzero(attack_wins) ] = 1.
+        PPCFplayers[ n_att+np.nanargmin(tau_def[:,defence_wins],axis=0), np.flatnonzero(defence_wins) ] = 1.
+    # ignore any player that is far (in time) from the target location
+    with np.errstate(invalid='ignore'):
+        in_range = np.vstack( ( tau_att-tau_min_att < params['time_to_control_att'], tau_def-tau_min_def < params['time_to_control_def'] ) )
+    solve = get_pitch_control_solver(params)
+    # the adaptive integrator takes one (variable) timestep at a time, so it has no timestep axis and can integrate more targets together
+    options = {} if time_block is None or solve is solve_pitch_control_adaptive else {'time_block': time_block}
+    if solve is solve_pitch_control_adaptive:
+        chunk_size *= 16
+    elif solve is solve_pitch_control_analytic:
+        chunk_size *= 8
+    n_failed = 0
+    for start in range(0, len(contested), chunk_size):
+        cells = contested[start:start+chunk_size]
+        lam = np.where( in_range[:,cells], lambdas[:,np.newaxis], 0. )
+        tau_c = np.where( in_range[:,cells], tau[:,cells], 0. )
+        PPCF,converged,steps = solve(tau_c, lam, ball_travel_time[cells], params, **options)
+        n_failed += np.sum(~converged)
+        if stats is not None:
+            stats.add_integrations(steps, converged, targets[cells], PPCF.sum(axis=0))
+        PPCFatt[cells] = PPCF[:n_att].sum(axis=0)
+        PPCFdef[cells] = PPCF[n_att:].sum(axis=0)
+        if player_contributions:
+            PPCFplayers[:,cells] = PPCF
+    if n_failed>0:
+        print("Integration failed to converge at %d target positions" % (n_failed) )
+    if stats is not None:
+        stats.time['integration'] += time.perf_counter()-t1
+    if player_contributions:
+        return PPCFatt, PPCFdef, PPCFplayers
+    return PPCFatt, PPCFdef
+
+def solve_pitch_control_euler(tau, lam, ball_travel_time, params, time_block=50, tti_sigma=None):
+    """ solve_pitch_control_euler
+    
+    Integrates equation 3 of Spearman 2018 with fixed timestep params['int_dt'], exactly as in calculate_pitch_control_at_target(), for
+    a chunk of contested target positions (see integrate_pitch_control() ). This is the reference integrator.
+    
+    Parameters
+    -----------
+        tau: (n_players,N) array of arrival times of each player (of both teams) at each target position
+        lam: (n_players,N) array of ball control parameters (zero for players that are ignored at a target position)
+        ball_travel_time: (N,) array of ball travel times from the ball start position to each target position
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        time_block: number of timesteps evaluated together before checking for convergence. Default is 50
+        tti_sigma: optional (N,) array of the tti_sigma parameter at each target position (e.g. to evaluate several sets of parameters 
+                   at once, see Metrica_Calibration). Default is params['tti_sigma'] everywhere
+        
+    Returrns
+    -----------
+        PPCF: (n_players,N) array of the pitch control contribution of each player at each target position
+        converged: (N,) boolean array, False where the integration failed to converge
+        steps: (N,) array of the number of timesteps (or intervals) integrated at each target position
+    """
+    dt = params['int_dt']
+    n_steps = np.arange(-dt,params['max_int_time'],dt).size
+    sigmoid_factor = np.pi/np.sqrt(3.0)/params['tti_sigma'] if tti_sigma is None else np.pi/np.sqrt(3.0)/np.asarray(tti_sigma)[:,np.newaxis]
+    T0 = ball_travel_time-dt # start of the integration for each target
+    S = np.ones( len(T0) ) # probability that nobody has controlled the ball yet
+    PPCF = np.zeros( lam.shape ) # contribution of each player at each target
+    converged = np.zeros( len(T0), dtype=bool )
+    n_int = np.full( len(T0), n_steps-1 ) # number of timesteps integrated
+    for i0 in range(1, n_steps, time_block):
+        steps = np.arange(i0, min(i0+time_block,n_steps))
+        T = T0[:,np.newaxis] + steps*dt
+        # probability of each player arriving at the target by time T (shape: players, targets, timesteps)
+        with np.errstate(over='ignore'):
+            dPPCFdT = lam[:,:,np.newaxis]/(1. + np.exp( -sigmoid_factor*(T[np.newaxis,:,:]-tau[:,:,np.newaxis]) ) )
+        # probability that the ball is still uncontrolled at the end of each timestep
+        S_steps = S[:,np.newaxis]*np.cumprod( 1. - dPPCFdT.sum(axis=0)*dt, axis=1 )
+        S_prev = np.column_stack( (S, S_steps[:,:-1]) )
+        # stop integrating each target once it has converged (within the convergence tolerance)
+        hit = S_steps <= params['model_converge_tol']
+        last_step = np.where( hit.any(axis=1), steps[np.argmax(hit,axis=1)], n_steps )
+        weight = S_prev * dt * ( (steps[np.newaxis,:]<=last_step[:,np.newaxis]) & ~converged[:,np.newaxis] )
+        PPCF += np.einsum('pct,ct->pc', dPPCFdT, weight)
+        n_int = np.where( hit.any(axis=1) & ~converged, last_step, n_int )
+        converged |= hit.any(axis=1)
+        S = S_steps[:,-1]
+        if converged.all():
+            break
+    return PPCF, converged, n_int
+
+def solve_pitch_control_analytic(tau, lam, ball_travel_time, params, time_block=4, tti_sigma=None):
+    """ solve_pitch_control_analytic
+    
+    Approximate, semi-analytic solution of equation 3 of Spearman 2018 for a chunk of contested target positions (see integrate_pitch_control() ),
+    for bulk analytics that can trade a little accuracy for speed. Selected by setting params['integration_method'] = 'analytic'.
+    
+    The time integral of the sigmoid intercept probability of each player has a closed form (a 'softplus' function), so the 
+    probability S(T) that nobody has controlled the ball by time T is known exactly at any time. The integration is split into a first
+    interval, from the ball arrival time to the arrival time of the first player, and then intervals of params['analytic_int_width']
+    times tti_sigma (0.45s with the default parameters). Within each interval, the share of each player in the total control rate is 
+    approximated by a quadratic function of the integrated total rate, which matches the shares at both ends of the interval and the 
+    exact integral of the player's rate, so the drop in S can be shared between the players in closed form. The exponential in the 
+    sigmoid of each player is only evaluated once at each target, and most targets converge within 3-4 intervals (rather than 40-90 
+    timesteps of params['int_dt']). The per-target path (vectorized=False) uses the same method without numpy.
+    
+    Measured on synthetic matches (Metrica_Benchmark), 30 surfaces on 50 and 100 cell wide grids with congestion 0, 0.5 and 1 and the 
+    default parameters (the ranges are over repeated runs):
+    
+        path          | integration speed vs euler | total speed vs euler | max. difference from a converged solution (int_dt=0.001)
+        vectorized    | 7.7-18.6x                  | 6.3-10.7x            | 0.0037 (euler: 0.121)
+        per-target    | 10-47x                     | 2.9-12x              | (same as vectorized)
+    
+    The total speedup is smaller than that of the integration, as the arrival times of the players are calculated in the same way.
+    The maximum difference from euler is 0.121, but that is the error of the euler integrator itself: at targets that several players 
+    reach before the ball, the total control rate (about 30/s for seven players) is too large for int_dt=0.04. 99.9% of the 
+    differences from euler are below 0.008-0.025. The maximum difference from a converged solution stays below 0.005 with 
+    tti_sigma=0.2 or 1.0, lambda_att=lambda_def=1.5 or 10 (where euler is up to 0.58 out) and model_converge_tol=1e-3; it is about 
+    0.007 with analytic_int_width=1.33 and 0.015 with 1.8, which are not noticeably faster.
+    
+    Parameters
+    -----------
+        tau: (n_players,N) array of arrival times of each player (of both teams) at each target position
+        lam: (n_players,N) array of ball control parameters (zero for players that are ignored at a target position)
+        ball_travel_time: (N,) array of ball travel times from the ball start position to each target position
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        time_block: number of intervals evaluated together before checking for convergence. Default is 4
+        tti_sigma: optional (N,) array of the tti_sigma parameter at each target position. Default is params['tti_sigma'] everywhere
+        
+    Returrns
+    -----------
+        PPCF: (n_players,N) array of the pitch control contribution of each player at each target position
+        converged: (N,) boolean array, False where the integration failed to converge
+        steps: (N,) array of the number of timesteps (or intervals) integrated at each target position
+    """
+    width = params.get('analytic_int_width',1.0)
+    tol = 0.99*params['model_converge_tol']
+    N = len(ball_travel_time)
+    sigma = np.broadcast_to( params['tti_sigma'] if tti_sigma is None else np.asarray(tti_sigma,dtype=float), (N,) )
+    sigmoid_factor = np.pi/np.sqrt(3.0)/sigma
+    dt = width*sigma
+    n_steps = int(np.ceil(params['max_int_time']/dt.min())) + 1
+    # the first interval runs from the ball arrival time to the (expected) arrival time of the first player, so that the later 
+    # intervals are all spent where the ball is being controlled
+    tau_first = np.min( np.where( lam>0, tau, np.inf ), axis=0 )
+    T0 = np.clip( tau_first, ball_travel_time, ball_travel_time+params['max_int_time'] )
+    # the sigmoid argument of each player grows by sigmoid_factor*dt = pi/sqrt(3)*width in each interval, so exp() of it is only 
+    # evaluated once: at T0 (capped to avoid overflow, which does not change the increments as softplus(z)=z for large z)
+    z_step = np.pi/np.sqrt(3.0)*width
+    z0 = np.minimum( sigmoid_factor*(T0-tau), 700. - z_step*n_steps )
+    w0 = np.exp( z0 )
+    growth = np.exp( z_step )
+    a = lam/sigmoid_factor
+    # the integral of the control rate of each player from the ball arrival time to the end of interval k is a*( L_k - L_b ), where 
+    # L_k = log(1+w0*growth**k) and L_b is the same at the ball arrival time. The control rate at the end of interval k is lam*X/(1+X),
+    # with X = w0*growth**k
+    with np.errstate(under='ignore'):
+        X = np.exp( z0 - sigmoid_factor*(T0-ball_travel_time) )
+    L_prev = np.log1p( X )
+    F_prev = np.einsum('pc,pc->c', a, L_prev) # sum over players of a*L at the end of the previous interval
+    rate = lam*X/(1.+X)
+    f_prev = rate/np.maximum( rate.sum(axis=0), 1e-300 ) # share of each player in the total control rate at the end of the previous interval
+    S = np.ones( N ) # probability that nobody has controlled the ball yet
+    PPCF = np.zeros( lam.shape ) # contribution of each player at each target
+    converged = np.zeros( N, dtype=bool )
+    n_int = np.full( N, n_steps ) # number of intervals integrated
+    active = np.arange(N) # targets that have not converged yet
+    P = np.zeros( lam.shape ) # contribution of each player at the targets that have not converged yet
+    lam_a = lam
+    for i0 in range(0, n_steps, time_block):
+        steps = np.arange(i0, min(i0+time_block,n_steps))
+        # shape: intervals, players, targets (the targets are the last axis, as there are many more of them than intervals)
+        X = (growth**steps)[:,np.newaxis,np.newaxis]*w0
+        Y = 1. + X
+        L = np.log( Y )
+        sig = np.divide( X, Y, out=X )
+        F = np.einsum('pc,tpc->tc', a, L)
+        R = np.maximum( np.einsum('pc,tpc->tc', lam_a, sig), 1e-300 ) # total control rate at the end of each interval
+        S_steps = S*np.exp( F_prev-F )
+        S_start = np.vstack( (S, S_steps[:-1]) )
+        H = np.diff( np.vstack( (F_prev, F) ), axis=0 ) # integral of the total control rate over each interval
+        # stop integrating each target once it has converged (within the convergence tolerance). The drop in S in the last interval 
+        # is limited so that S ends just below the tolerance, as the other methods stop at the first timestep where S<=tol
+        hit = S_steps <= tol
+        done = hit.any(axis=0)
+        last_step = np.where( done, steps[np.argmax(hit,axis=0)], n_steps )
+        dS = np.where( steps[:,np.newaxis]<last_step, S_start-S_steps, (S_start-tol)*(steps[:,np.newaxis]==last_step) )
+        # within each interval, the share of each player in the total control rate is taken to be a quadratic function of the 
+        # integrated total rate h (0<=h<=H), matching the shares at both ends of the interval and the exact integral of the player's
+        # rate, a*(L_k-L_(k-1)). The drop in S is S_start*exp(-h)*dh, so each player gets S_start*H*(w_start*f_start + w_end*f_end + 
+        # w_mean*a*(L_k-L_(k-1))/H), where the weights depend on the moments m_j = int_0^1 s^j*exp(-H*s) ds
+        m0,m1,m2 = _exponential_moments( H )
+        scale = dS/m0 # S_start*H (less in the last interval)
+        w_start = scale*(m0-4.*m1+3.*m2)
+        w_end = scale*(3.*m2-2.*m1)
+        w_mean = scale*6.*(m1-m2)/np.where( H>0, H, 1. )
+        # the share at the start of each interval is the share at the end of the previous one, and the differences of L are
+        # rearranged as in summation by parts, so only the values at the ends of the intervals are needed
+        zero = np.zeros( (1,len(active)) )
+        w_sig = ( w_end + np.vstack( (w_start[1:], zero) ) )/R
+        w_L = w_mean - np.vstack( (w_mean[1:], zero) )
+        P += lam_a*np.einsum('tpc,tc->pc', sig, w_sig) + f_prev*w_start[0] + a*( np.einsum('tpc,tc->pc', L, w_L) - w_mean[0]*L_prev )
+        n_int[active[done]] = last_step[done]+1
+        converged[active[done]] = True
+        if done.all():
+            PPCF[:,active] = P
+            break
+        # carry on with the targets that have not converged
+        keep = ~done
+        PPCF[:,active[done]] = P[:,done]
+        active, P, w0, a, lam_a = active[keep], P[:,keep], w0[:,keep], a[:,keep], lam_a[:,keep]
+        S, L_prev, F_prev = S_steps[-1,keep], L[-1][:,keep], F[-1,keep]
+        f_prev = lam_a*sig[-1][:,keep]/R[-1,keep]
+    return PPCF, converged, n_int
+
+def _exponential_moments(H):
+    # m_j = int_0^1 s^j*exp(-H*s) ds for j=0,1,2, using m_j = (j*m_(j-1) - exp(-H))/H (integration by parts). For small H, where this 
+    # loses precision, the limits as H->0 are used (the error is of order H times the drop in S, which is itself of order H)
+    small = H<1e-3
+    Hs = np.where( small, 1., H )
+    E = np.exp( -Hs )
+    m0 = (1.-E)/Hs
+    m1 = (m0-E)/Hs
+    m2 = (2.*m1-E)/Hs
+    return np.where( small, 1., m0 ), np.where( small, 0.5, m1 ), np.where( small, 1./3., m2 )
+
+def _solve_pitch_control_analytic_scalar(tau, lam, ball_travel_time, params):
+    # solve_pitch_control_analytic() for a single target position, with lists of the arrival times and ball control parameters of 
+    # the players (avoids the overhead of numpy for a handful of players)
+    width = params.get('analytic_int_width',1.0)
+    tol = 0.99*params['model_converge_tol']
+    n_steps = int(math.ceil(params['max_int_time']/(width*params['tti_sigma']))) + 1
+    sigmoid_factor = math.pi/math.sqrt(3.0)/params['tti_sigma']
+    T0 = min( max( min(tau), ball_travel_time ), ball_travel_time+params['max_int_time'] )
+    z_step = math.pi/math.sqrt(3.0)*width
+    growth = math.exp( z_step )
+    z_max = 700. - z_step*n_steps
+    w = [ math.exp( min( sigmoid_factor*(T0-t), z_max ) ) for t in tau ]
+    a = [ l/sigmoid_factor for l in lam ]
+    # values at the ball arrival time
+    shift = math.exp( -sigmoid_factor*(T0-ball_travel_time) )
+    X = [ x*shift for x in w ]
+    L_prev = [ math.log1p(x) for x in X ]
+    F_prev = sum( [ ai*li for ai,li in zip(a,L_prev) ] )
+    f_prev = [ l*x/(1.+x) for l,x in zip(lam,X) ]
+    R = max( sum(f_prev), 1e-300 )
+    f_prev = [ fi/R for fi in f_prev ]
+    S = 1.
+    P = [0.]*len(tau)
+    for k in range(n_steps):
+        L = [ math.log1p(x) for x in w ]
+        f = [ l*x/(1.+x) for l,x in zip(lam,w) ]
+        R = max( sum(f), 1e-300 )
+        f = [ fi/R for fi in f ]
+        F = sum( [ ai*li for ai,li in zip(a,L) ] )
+        S_new = S*math.exp( F_prev-F )
+        H = F-F_prev
+        last = S_new<=tol
+        dS = S-tol if last else S-S_new
+        # see solve_pitch_control_analytic() and _exponential_moments()
+        if H<1e-3:
+            m0,m1,m2 = 1., 0.5, 1./3.
+        else:
+            E = math.exp( -H )
+            m0 = (1.-E)/H
+            m1 = (m0-E)/H
+            m2 = (2.*m1-E)/H
+        scale = dS/m0
+        w_start = scale*(m0-4.*m1+3.*m2)
+        w_end = scale*(3.*m2-2.*m1)
+        w_mean = scale*6.*(m1-m2)/H if H>0 else 0.
+        P = [ p + w_start*fs + w_end*fe + w_mean*ai*(li-lp) for p,fs,fe,ai,li,lp in zip(P,f_prev,f,a,L,L_prev) ]
+        if last:
+            return P, True, k+1
+        S, F_prev, L_prev, f_prev = S_new, F, L, f
+        w = [ x*growth for x in w ]
+    return P, False, n_steps
+
+def solve_pitch_control_adaptive(tau, lam, ball_travel_time, params, tti_sigma=None):
+    """ solve_pitch_control_adaptive
+    
+    Integrates equation 3 of Spearman 2018 for a chunk of contested target positions (see integrate_pitch_control() ) with an 
+    error-controlled timestep (the Bogacki-Shampine 3(2) Runge-Kutta method), rather than the fixed timestep params['int_dt'].
+    Selected by setting params['integration_method'] = 'adaptive'.
+    
+    Each target position has its own timestep, which grows while the control probabilities change slowly (e.g. before any player can 
+    reach the ball) and shrinks while they change quickly, keeping the estimated error of each step below params['adaptive_int_tol'].
+    The integration stops at the same tolerance as the other methods (params['model_converge_tol']), typically after about 10 steps 
+    rather than 40-90 with the default parameters. The exponential in the sigmoid is only evaluated once per step, the players that 
+    are ignored at each target are moved to the last rows (which are dropped when all targets ignore them), and the targets that have 
+    converged are dropped once a quarter of them have. On synthetic matches (Metrica_Benchmark) this is 1.9-2.9x faster than 'euler' 
+    on 50 and 100 cell wide grids, and 2.5-5x faster when evaluating one target at a time (vectorized=False).
+    
+    Parameters
+    -----------
+        tau: (n_players,N) array of arrival times of each player (of both teams) at each target position
+        lam: (n_players,N) array of ball control parameters (zero for players that are ignored at a target position)
+        ball_travel_time: (N,) array of ball travel times from the ball start position to each target position
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        tti_sigma: optional (N,) array of the tti_sigma parameter at each target position. Default is params['tti_sigma'] everywhere
+        
+    Returrns
+    -----------
+        PPCF: (n_players,N) array of the pitch control contribution of each player at each target position
+        converged: (N,) boolean array, False where the integration failed to converge
+        steps: (N,) array of the number of (accepted) timesteps integrated at each target position
+    """
+    tol = params.get('adaptive_int_tol',1e-3)
+    N = len(ball_travel_time)
+    sigmoid_factor = np.pi/np.sqrt(3.0)/np.broadcast_to( params['tti_sigma'] if tti_sigma is None else np.asarray(tti_sigma,dtype=float), (N,) )
+    T_end = ball_travel_time + params['max_int_time']
+    # move the players that are not ignored at each target to the first rows, so that the other rows can be dropped
+    order = np.argsort( lam<=0, axis=0, kind='stable' )
+    n_players = np.count_nonzero( lam>0, axis=0 )
+    n_rows = n_players.max(initial=1)
+    tau_s = np.take_along_axis( tau, order[:n_rows], axis=0 )
+    lam_s = np.take_along_axis( lam, order[:n_rows], axis=0 )
+    PPCF = np.zeros( (n_rows,N) ) # contribution of each (sorted) player at each target
+    converged = np.zeros( N, dtype=bool )
+    n_int = np.zeros( N, dtype=int ) # number of timesteps integrated
+    # state of the targets that are still being integrated. Targets that have finished are only removed from the arrays once a 
+    # quarter of them have finished (until then their timestep is zero)
+    active = np.arange(N)
+    running = np.ones( N, dtype=bool )
+    T = ball_travel_time.astype(float)
+    h = np.full( N, 0.1 ) # initial timestep
+    P = np.zeros( (n_rows,N) )
+    S = np.ones( N ) # probability that nobody has controlled the ball yet (1-sum(P))
+    tau_a,lam_a,sf_a,T_end_a = tau_s,lam_s,sigmoid_factor,T_end
+    while len(active)>0:
+        h = np.minimum( h, T_end_a-T )*running
+        # ball control rate of each player at T, T+h/2, T+3h/4 and T+h (shape: players, active targets). The exponential in the 
+        # sigmoid only needs evaluating at T: at the later times it is multiplied by exp(-sigmoid_factor*c*h)
+        with np.errstate(over='ignore'):
+            E = np.exp( -sf_a*(T-tau_a) )
+        g4 = np.exp( -sf_a*h )
+        g2 = np.sqrt( g4 )
+        r1 = lam_a/(1. + E)
+        r2 = lam_a/(1. + E*g2)
+        r3 = lam_a/(1. + E*(g2*np.sqrt(g2)))
+        r4 = lam_a/(1. + E*g4)
+        # Runge-Kutta stages of dP/dT = S*rate(T): the stages of S only need the total rate over the players
+        S2 = S - 0.5*h*S*r1.sum(axis=0)
+        S3 = S - 0.75*h*S2*r2.sum(axis=0)
+        c1,c2,c3 = h*2./9.*S, h/3.*S2, h*4./9.*S3
+        dP = c1*r1 + c2*r2 + c3*r3
+        S_new = S - dP.sum(axis=0)
+        error = np.max( np.abs( dP - h*( 7./24.*S*r1 + 1./4.*S2*r2 + 1./3.*S3*r3 + 1./8.*S_new*r4 ) ), axis=0 )
+        accept = error<=tol
+        if accept.all():
+            T, P, S = T+h, P+dP, S_new
+        else:
+            T = np.where( accept, T+h, T )
+            P = P + dP*accept
+            S = np.where( accept, S_new, S )
+        n_int[active] += accept & running
+        # next timestep (limited to a factor of 5 change, and to 1s)
+        with np.errstate(divide='ignore'):
+            h = np.minimum( h*np.clip( 0.9*(tol/error)**(1./3.), 0.2, 5. ), 1. )
+        # stop integrating each target once it has converged (within the convergence tolerance), or reached the integration limit
+        hit = accept & running & ( S <= params['model_converge_tol'] )
+        done = hit | ( running & (T>=T_end_a) )
+        if np.any(done):
+            PPCF[:len(P),active[done]] = P[:,done]
+            converged[active[hit]] = True
+            running &= ~done
+            if 4*np.count_nonzero(~running) >= len(active):
+                keep = running
+                active,running,T,h,S = active[keep],running[keep],T[keep],h[keep],S[keep]
+                n_rows = n_players[active].max(initial=1)
+                P = P[:n_rows,keep]
+                tau_a,lam_a,sf_a,T_end_a = tau_s[:n_rows,active],lam_s[:n_rows,active],sigmoid_factor[active],T_end[active]
+    PPCF_players = np.zeros( lam.shape )
+    np.put_along_axis( PPCF_players, order[:len(PPCF)], PPCF, axis=0 )
+    return PPCF_players, converged, n_int
+
+def _solve_pitch_control_adaptive_scalar(tau, lam, ball_travel_time, params):
+    # solve_pitch_control_adaptive() for a single target position, with lists of the arrival times and ball control parameters of 
+    # the players (avoids the overhead of numpy for a handful of players)
+    tol = params.get('adaptive_int_tol',1e-3)
+    sigmoid_factor = math.pi/math.sqrt(3.0)/params['tti_sigma']
+    T_end = ball_travel_time + params['max_int_time']
+    n = len(tau)
+    T, h, S = ball_travel_time, 0.1, 1.
+    P = [0.]*n
+    steps = 0
+    while True:
+        h = min( h, T_end-T )
+        g4 = math.exp( -sigmoid_factor*h )
+        g2 = math.sqrt( g4 )
+        g3 = g2*math.sqrt( g2 )
+        r1,r2,r3,r4 = [0.]*n,[0.]*n,[0.]*n,[0.]*n
+        for i in range(n):
+            x = -sigmoid_factor*(T-tau[i])
+            if x<700.:
+                E = math.exp(x)
+                r1[i],r2[i],r3[i],r4[i] = lam[i]/(1.+E), lam[i]/(1.+E*g2), lam[i]/(1.+E*g3), lam[i]/(1.+E*g4)
+        S2 = S - 0.5*h*S*sum(r1)
+        S3 = S - 0.75*h*S2*sum(r2)
+        c1,c2,c3 = h*2./9.*S, h/3.*S2, h*4./9.*S3
+        dP = [c1*r1[i] + c2*r2[i] + c3*r3[i] for i in range(n)]
+        S_new = S - sum(dP)
+        error = max( [ abs( dP[i] - h*( 7./24.*S*r1[i] + 1./4.*S2*r2[i] + 1./3.*S3*r3[i] + 1./8.*S_new*r4[i] ) ) for i in range(n) ] )
+        accept = error<=tol
+        if accept:
+            T, S = T+h, S_new
+            P = [P[i]+dP[i] for i in range(n)]
+            steps += 1
+        h = min( h*min( max( 0.9*(tol/error)**(1./3.), 0.2 ), 5. ) if error>0 else 5.*h, 1. )
+        if accept and S<=params['model_converge_tol']:
+            return P, True, steps
+        if T>=T_end:
+            return P, False, steps
+
+def get_pitch_control_solver(params):
+    """ get_pitch_control_solver
+    
+    Returns the function that solves the pitch control model for the integration method in params['integration_method'] 
+    ('euler', 'analytic' or 'adaptive'; default is 'euler')
+    
+    Parameters
+    -----------
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        
+    Returrns
+    -----------
+        solve: solve_pitch_control_euler, solve_pitch_control_analytic or solve_pitch_control_adaptive
+    """
+    solvers = {'euler': solve_pitch_control_euler, 'analytic': solve_pitch_control_analytic, 'adaptive': solve_pitch_control_adaptive}
+    method = params.get('integration_method','euler')
+    assert method in solvers, "Unknown integration method: %s" % (method)
+    return solvers[method]
+
+def check_pitch_control_shortcuts(tau_min_att, tau_min_def, ball_travel_time, params):
+    """ check_pitch_control_shortcuts
+    
+    Finds the target positions at which one team arrives so far ahead of the other that the pitch control model does not need to be
+    solved (same tests, in the same order, as calculate_pitch_control_at_target() )
+    
+    Parameters
+    -----------
+        tau_min_att: (N,) array of the arrival time of the first attacking player at each target position
+        tau_min_def: (N,) array of the arrival time of the first defending player at each target position
+        ball_travel_time: (N,) array of ball travel times from the ball start position to each target position
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        
+    Returrns
+    -----------
+        attack_wins: (N,) boolean array, True where the attacking team has full control (PPCFatt=1)
+        defence_wins: (N,) boolean array, True where the defending team has full control (PPCFdef=1)
+    """
+    defence_wins = tau_min_att-np.maximum(ball_travel_time,tau_min_def) >= params['time_to_control_def']
+    attack_wins = ~defence_wins & ( tau_min_def-np.maximum(ball_travel_time,tau_min_att) >= params['time_to_control_att'] )
+    return attack_wins,defence_wins
+
+def generate_pitch_control_for_frame_sequence(frames, attacking_teams, tracking_home, tracking_away, params, GK_numbers, field_dimen = (106.,68.,), n_grid_cells_x = 50, offsides=True, error_tol=None, validate_every=0, progress=None, stats=None):
+    """ generate_pitch_control_for_frame_sequence
+    
+    Evaluates the pitch control surface over the entire field for a sequence of (usually consecutive) frames, reusing the solution 
+    from earlier frames wherever it cannot have changed by more than 'error_tol' (see the incremental_pitch_control class).
+    This is a generator: surfaces are yielded in the same order as 'frames'.
+    
+    Parameters
+    -----------
+        frames: list of frame numbers (index of the tracking DataFrames), e.g. every frame of a passage of play
+        attacking_teams: the team in possession ("Home" or "Away"), either a single value for all frames or a list with one per frame
+        tracking_home: tracking DataFrame for the Home team (must include player velocities)
+        tracking_away: tracking DataFrame for the Away team (must include player velocities)
+        params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+        GK_numbers: tuple containing the player id of the goalkeepers for the (home team, away team)
+        field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+        n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+        offsides: If True, find and remove offside atacking players from the calculation. Default is True.
+        error_tol: largest change in pitch control probability allowed at a reused cell (see incremental_pitch_control). Default is params['model_converge_tol']
+        validate_every: if >0, fully recompute every 'validate_every'th frame and record the maximum deviation of the incremental 
+                        solution (see incremental_pitch_control.max_error). Default is 0 (never)
+        progress: optional dictionary, updated after each frame with the 'n_integrated', 'n_reused' and 'max_error' attributes of the 
+                  incremental_pitch_control object
+        stats: optional pitch_control_stats object to record diagnostics in (see generate_pitch_control_for_event() )
+        
+    Yields
+    -----------
+        frame: frame number
+        PPCFa: Pitch control surface (dimen (n_grid_cells_y,n_grid_cells_x) ) containing pitch control probability for the attcking team.
+    """
+    if isinstance(attacking_teams, str):
+        attacking_teams = [attacking_teams]*len(frames)
+    columns = {'Home': get_team_columns(tracking_home, 'Home'), 'Away': get_team_columns(tracking_away, 'Away')}
+    tracking = {'Home': tracking_home, 'Away': tracking_away}
+    GKid = {'Home': GK_numbers[0], 'Away': GK_numbers[1]}
+    xgrid,ygrid = get_pitch_grid(field_dimen, n_grid_cells_x)
+    model = incremental_pitch_control(xgrid, ygrid, params, error_tol)
+    if offsides:
+        # find the offside players in every frame in one go
+        offside_masks,_ = calculate_offside_masks(tracking_home, tracking_away, GK_numbers, frames)
+    for i,(frame,attacking_teamname) in enumerate(zip(frames,attacking_teams)):
+        assert attacking_teamname in ['Home','Away'], "Team in possession must be either home or away"
+        if stats is not None:
+            stats.frame = frame
+            t0 = time.perf_counter()
+        defending_teamname = 'Away' if attacking_teamname=='Home' else 'Home'
+        attacking_team = initialise_team_state(tracking[attacking_teamname].loc[frame], attacking_teamname, params, GKid[attacking_teamname], columns[attacking_teamname])
+        defending_team = initialise_team_state(tracking[defending_teamname].loc[frame], defending_teamname, params, GKid[defending_teamname], columns[defending_teamname])
+        ball_start_pos = np.array( [tracking_home.loc[frame,'ball_x'], tracking_home.loc[frame,'ball_y']] )
+        if offsides:
+            attacking_team.offside = offside_masks[attacking_teamname][i][attacking_team.inframe]
+        validate = validate_every>0 and i%validate_every==0
+        if stats is not None:
+            stats.time['setup'] += time.perf_counter()-t0
+        PPCFa = model.update(attacking_team, defending_team, ball_start_pos, validate=validate, stats=stats)
+        if progress is not None:
+            progress.update( n_integrated=model.n_integrated, n_reused=model.n_reused, max_error=model.max_error )
+        yield frame, PPCFa
+
+def _pitch_control_change_bound(tau, delta, lam, ball_travel_time, params, times=(0.1,0.2,0.4,0.8,1.6,3.2)):
+    # upper bound on the change in the pitch control probability of either team at each target if the arrival time of each player 
+    # changes from tau to tau+delta (see incremental_pitch_control). The two solutions can only differ if one of the players controls 
+    # the ball in one of them but not in the other before anybody has controlled it in both. This is bounded by the integral of the 
+    # difference of the control rates of each player, times the probability that nobody has controlled the ball in both (which is at 
+    # most S for the later of the two arrival times of each player). The time integral is split at ball_travel_time+times, using the 
+    # value of S at the start of each interval. The integrals of the sigmoids have a closed form (a 'softplus' function).
+    sigmoid_factor = np.pi/np.sqrt(3.0)/params['tti_sigma']
+    def softplus(x):
+        return np.maximum(x,0.) + np.log1p( np.exp(-np.abs(x)) )
+    # only keep the players that take part at each target (moved to the first rows)
+    order = np.argsort( lam<=0, axis=0, kind='stable' )[:max(np.count_nonzero(lam>0,axis=0).max(initial=1),1)]
+    lam = np.take_along_axis( lam, order, axis=0 )
+    z = sigmoid_factor*( ball_travel_time-np.take_along_axis(tau, order, axis=0) )
+    z_shifted = np.where( lam>0, z-sigmoid_factor*np.take_along_axis(delta, order, axis=0), z )
+    # integral of the sigmoid from the ball arrival time to each time (shape: players, targets, times) and to infinity (relative to delta=0)
+    T = sigmoid_factor*np.asarray(times)
+    sp0,sp0_shifted = softplus(z),softplus(z_shifted)
+    G = ( softplus(z[:,:,np.newaxis]+T) - sp0[:,:,np.newaxis] )/sigmoid_factor
+    G_shifted = ( softplus(z_shifted[:,:,np.newaxis]+T) - sp0_shifted[:,:,np.newaxis] )/sigmoid_factor
+    I = np.abs( (z-z_shifted) - (sp0-sp0_shifted) )/sigmoid_factor
+    # upper bound on the probability that nobody has controlled the ball by the start of each interval
+    S = np.exp( -np.einsum('pc,pct->ct', lam, np.where( (z_shifted<z)[:,:,np.newaxis], G_shifted, G )) )
+    S = np.column_stack( (np.ones(len(ball_travel_time)), S) )
+    # integral of the difference of the sigmoids over each interval (the last one ends at infinity)
+    D = np.abs( G-G_shifted )
+    D = np.concatenate( (D[:,:,:1], np.diff(D,axis=2), (I-D[:,:,-1])[:,:,np.newaxis]), axis=2 )
+    return np.einsum('pc,pct,ct->c', lam, D, S)
+
+class incremental_pitch_control(object):
+    """
+    incremental_pitch_control() class
+    
+    Evaluates pitch control surfaces for a sequence of frames (e.g. a 25Hz tracking feed), reusing the solution from earlier frames. 
+    Cells where one team has full control are found with the usual short-cut tests. A contested cell keeps the solution from the 
+    frame it was last integrated at if the same players take part in the integration (those within time_to_control of the first 
+    player of their team) and the solution cannot have changed by more than 'error_tol'. Otherwise it is re-integrated. Cells are 
+    also re-integrated if the players on the field have changed (substitution, offside, change of possession).
+    
+    The bound on the change follows from the model: the solution does not change if the ball travel time and all arrival times shift 
+    by the same amount, so only the change delta_p of the arrival time of each player relative to the ball travel time counts. 
+    The rate at which player p controls the ball then changes by at most lambda_p*|sigmoid(T-tau_p)-sigmoid(T-tau_p-delta_p)|, and 
+    the control probability of either team by no more than the sum over players of the integral of this from the ball arrival time 
+    (which has a closed form). The bound ignores the probability that the ball has already been controlled, so the actual changes 
+    are usually much smaller. The time integration itself (see integrate_pitch_control() ) has its own error, which is not included. 
+    Use update(..., validate=True) to measure the deviation from a full recompute (max_error records the largest deviation found).
+    
+    The bound is only small where the arrival times relative to the ball have hardly changed, so the reuse depends on how much the 
+    players move. On synthetic 25Hz tracking data with the default error_tol, about 2% of the contested cells are reused when every 
+    player is moving (no faster than a full recompute), and about a third when three players are moving (1.3x faster), with a largest 
+    deviation from a full recompute of 0.004 in both cases. Identical frames (e.g. a stoppage) reuse every cell.
+    
+    The arrival time fields are updated with a time_to_intercept_field object, which only reuses the field of a player whose position, 
+    velocity and parameters are exactly the same as in the previous frame: the fields of players that are moving are recalculated in 
+    every frame (a tolerance would add errors to the arrival times that are not included in the bound).
+    
+    __init__ Parameters
+    -----------
+    xgrid: Positions of the pixels in the x-direction (field length)
+    ygrid: Positions of the pixels in the y-direction (field width)
+    params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+    error_tol: largest change in pitch control probability allowed at a reused cell. Default is params['model_converge_tol']
+    
+    methods include:
+    -----------
+    update(attacking_team, defending_team, ball_start_pos, validate=False, stats=None): pitch control surface for the attacking team at the next frame
+        (stats: optional pitch_control_stats object, see generate_pitch_control_for_event() )
+    
+    attributes include:
+    -----------
+    n_integrated, n_reused: total number of contested cells that were re-integrated and reused
+    max_error: largest deviation from a full recompute found by update(..., validate=True)
+    
+    """
+    def __init__(self, xgrid, ygrid, params, error_tol=None):
+        xx,yy = np.meshgrid(xgrid,ygrid)
+        self.shape = xx.shape
+        self.target_positions = np.column_stack( (xx.ravel(), yy.ravel()) )
+        self.params = params
+        self.error_tol = params['model_converge_tol'] if error_tol is None else error_tol
+        self.tti_field = time_to_intercept_field(xgrid, ygrid) # arrival times of each player, updated each frame
+        self.players = None # ids of the players in the previous frame
+        self.tau_ref = None # arrival times at the last integration of each cell
+        self.in_range_ref = None # players that took part in the last integration of each cell
+        self.ball_travel_time_ref = None
+        self.valid = np.zeros( len(self.target_positions), dtype=bool ) # cells with a reusable solution
+        self.failed = np.zeros( len(self.target_positions), dtype=bool ) # cells that failed the error bound in the previous frame
+        self.PPCFatt = np.zeros( len(self.target_positions) )
+        self.PPCFdef = np.zeros( len(self.target_positions) )
+        self.n_integrated = 0
+        self.n_reused = 0
+        self.max_error = 0.
+        
+    def update(self, attacking_team, defending_team, ball_start_pos, validate=False, stats=None):
+        params = self.params
+        onside = ~attacking_team.offside
+        if stats is not None:
+            t0 = time.perf_counter()
+        tau_att = self.tti_field.update(attacking_team)[onside].reshape( -1, len(self.target_positions) )
+        tau_def = self.tti_field.update(defending_team).reshape( -1, len(self.target_positions) )
+        lambda_att = attacking_team.lambda_att[onside]
+        lambda_def = defending_team.lambda_def
+        ball_travel_time = calculate_ball_travel_time(self.target_positions, ball_start_pos, params)
+        tau = np.vstack( (tau_att, tau_def) )
+        tau_min_att = np.nanmin(tau_att,axis=0)
+        tau_min_def = np.nanmin(tau_def,axis=0)
+        in_range = np.vstack( ( tau_att-tau_min_att < params['time_to_control_att'], tau_def-tau_min_def < params['time_to_control_def'] ) )
+        if stats is not None:
+            t1 = time.perf_counter()
+            stats.time['time_to_intercept'] += t1-t0
+        # start again if the players involved have changed
+        players = (attacking_team.teamname, tuple(attacking_team.ids[onside]), tuple(defending_team.ids))
+        if players!=self.players:
+            self.players = players
+            self.valid[:] = False
+            self.tau_ref = tau.copy()
+            self.in_range_ref = in_range.copy()
+            self.ball_travel_time_ref = ball_travel_time.copy()
+        # cells where one team arrives well before the other
+        attack_wins,defence_wins = check_pitch_control_shortcuts(tau_min_att, tau_min_def, ball_travel_time, params)
+        contested = ~(attack_wins | defence_wins)
+        # bound on the change of the solution at each cell since it was last integrated (see the class description). Cells that failed 
+        # the test in the previous frame are re-integrated without testing them again, as they are likely to fail again
+        check = contested & self.valid & ~self.failed & np.all( in_range==self.in_range_ref, axis=0 )
+        reuse = check.copy()
+        if np.any(check):
+            lambdas = np.concatenate( (lambda_att, lambda_def) )
+            delta = (tau[:,check]-self.tau_ref[:,check]) - (ball_travel_time[check]-self.ball_travel_time_ref[check])
+            lam = np.where( in_range[:,check], lambdas[:,np.newaxis], 0. )
+            reuse[check] = _pitch_control_change_bound(self.tau_ref[:,check], delta, lam, self.ball_travel_time_ref[check], params) <= self.error_tol
+        self.failed = check & ~reuse
+        integrate = contested & ~reuse
+        if validate:
+            integrate = contested
+        PPCFatt = np.where(attack_wins, 1., 0.)
+        PPCFdef = np.where(defence_wins, 1., 0.)
+        PPCFatt[reuse] = self.PPCFatt[reuse]
+        PPCFdef[reuse] = self.PPCFdef[reuse]
+        if stats is not None:
+            # the integrated cells are recorded by integrate_pitch_control(), the short-cut and reused cells here
+            stats.n_targets += len(self.target_positions)-int(np.sum(integrate))
+            stats.n_attack_shortcut += int(np.sum(attack_wins))
+            stats.n_defence_shortcut += int(np.sum(defence_wins))
+            stats.targets = self.target_positions[integrate]
+            stats.time['shortcuts'] += time.perf_counter()-t1
+        PPCFatt[integrate],PPCFdef[integrate] = integrate_pitch_control(tau_att[:,integrate], tau_def[:,integrate], lambda_att, lambda_def, ball_travel_time[integrate], params, stats=stats)
+        if validate and np.any(reuse):
+            self.max_error = max( self.max_error, np.max( np.abs(PPCFatt[reuse]-self.PPCFatt[reuse]) ) )
+        # store the arrival times that each re-integrated cell was calculated with
+        self.tau_ref[:,integrate] = tau[:,integrate]
+        self.in_range_ref[:,integrate] = in_range[:,integrate]
+        self.ball_travel_time_ref[integrate] = ball_travel_time[integrate]
+        self.valid = contested & (self.valid | integrate)
+        self.PPCFatt,self.PPCFdef = PPCFatt,PPCFdef
+        self.n_integrated += np.sum(integrate)
+        self.n_reused += np.sum(reuse) if not validate else 0
+        return PPCFatt.reshape(self.shape)
+
+class what_if_pitch_control(object):
+    """
+    what_if_pitch_control() class
+    
+    Pitch control surface for a single instant that can be updated interactively as individual players are moved (e.g. dragging a 
+    defender to a different position). The arrival time of every player at every cell is kept (see time_to_intercept_field), so moving 
+    a player only recalculates that player's arrival times. Only the cells where the moved player takes part in the integration, 
+    before or after the move (i.e. arrives within time_to_control_att/def of the first player of their team), are then re-integrated: 
+    the solution at every other cell is unchanged. The updated surface is identical to a full recompute.
+    
+    If GK_numbers is given, the offside players are found again after every move (moving the last defender can put attackers offside,
+    or onside), and the cells of any player whose offside status changes are also re-integrated.
+    
+    __init__ Parameters
+    -----------
+    attacking_team: team_state object for the attacking team (team in possession). Offside players must already be flagged (see check_offsides_team() )
+    defending_team: team_state object for the defending team. Both team states are copied, so the originals are not changed by moves
+    ball_start_pos: Current position of the ball (start position for a pass). If set to NaN, function will assume that the ball is already at the target position.
+    params: Dictionary of model parameters (default model parameters can be generated using default_model_params() )
+    field_dimen: tuple containing the length and width of the pitch in meters. Default is (106,68)
+    n_grid_cells_x: Number of pixels in the grid (in the x-direction) that covers the surface. Default is 50.
+    GK_numbers: optional tuple containing the player id of the goalkeepers for the (home team, away team). If given, offsides are re-evaluated after each move
+    
+    methods include:
+    -----------
+    move_player(teamname, player_id, position, velocity=None): move a player and return the updated pitch control surface for the attacking team
+    
+    attributes include:
+    -----------
+    PPCFa: the current pitch control surface (dimen (n_grid_cells_y,n_grid_cells_x) ) for the attacking team
+    xgrid, ygrid: positions of the pixels in the x and y directions
+    attacking_team, defending_team: the (moved) team states
+    n_updated: number of cells re-integrated by the last move
+    
+    """
+    def __init__(self, attacking_team, defending_team, ball_start_pos, params, field_dimen = (106.,68.,), n_grid_cells_x = 50, GK_numbers=None):
+        self.params = params
+        self.GK_numbers = GK_numbers
+        self.ball_start_pos = ball_start_pos
+        self.xgrid,self.ygrid = get_pitch_grid(field_dimen, n_grid_cells_x)
+        self.tti_field = time_to_intercept_field(self.xgrid, self.ygrid)
+        self.target_positions = self.tti_field.target_positions()
+        self.ball_travel_time = calculate_ball_travel_time(self.target_positions, ball_start_pos, params)
+        self.attacking_team,self.defending_team = [ self._copy_team(team) for team in (attacking_team,defending_team) ]
+        self.tau,self.in_range = self._arrival_times()
+        self.PPCFatt = np.zeros( len(self.target_positions) )
+        self.PPCFdef = np.zeros( len(self.target_positions) )
+        self._integrate( np.ones(len(self.target_positions),dtype=bool) )
+        self.n_updated = len(self.target_positions)
+        
+    @property
+    def PPCFa(self):
+        return self.PPCFatt.reshape( len(self.ygrid), len(self.xgrid) )
+        
+    def move_player(self, teamname, player_id, position, velocity=None):
+        team = self.attacking_team if teamname==self.attacking_team.teamname else self.defending_team
+        assert teamname==team.teamname, "Team must be either %s or %s" % (self.attacking_team.teamname, self.defending_team.teamname)
+        index = np.flatnonzero( team.ids==player_id )
+        assert len(index)==1, "Player %s not found in %s team" % (player_id, teamname)
+        team.position[index[0]] = position
+        if velocity is not None:
+            team.velocity[index[0]] = velocity
+        changed = np.zeros( len(self.tau), dtype=bool )
+        changed[ index[0] if team is self.attacking_team else len(self.attacking_team.ids)+index[0] ] = True
+        if self.GK_numbers is not None:
+            offside = self.attacking_team.offside.copy()
+            check_offsides_team(self.attacking_team, self.defending_team, self.ball_start_pos, self.GK_numbers)
+            changed[:len(offside)] |= self.attacking_team.offside!=offside
+        # re-integrate every cell where a player that has changed is involved, before or after the change
+        tau,in_range = self._arrival_times()
+        update = np.any( (self.in_range|in_range)[changed], axis=0 )
+        self.tau,self.in_range = tau,in_range
+        self._integrate(update)
+        self.n_updated = np.sum(update)
+        return self.PPCFa
+        
+    def _copy_team(self, team):
+        team = copy.copy(team)
+        team.position = team.position.copy()
+        team.velocity = team.velocity.copy()
+        team.offside = team.offside.copy()
+        return team
+        
+    def _arrival_times(self):
+        # arrival times of all players (attacking players first) at every cell, and the players that take part in the integration at each cell
+        params = self.params
+        n_cells = len(self.target_positions)
+        tau_att = self.tti_field.update(self.attacking_team).reshape( -1, n_cells )
+        tau_def = self.tti_field.update(self.defending_team).reshape( -1, n_cells )
+        onside = ~self.attacking_team.offside
+        tau_min_att = np.nanmin( tau_att[onside], axis=0 )
+        tau_min_def = np.nanmin( tau_def, axis=0 )
+        in_range = np.vstack( ( (tau_att-tau_min_att < params['time_to_control_att']) & onside[:,np.newaxis], tau_def-tau_min_def < params['time_to_control_def'] ) )
+        return np.vstack( (tau_att,tau_def) ), in_range
+        
+    def _integrate(self, cells):
+        n_att = len(self.attacking_team.ids)
+        onside = ~self.attacking_team.offside
+        self.PPCFatt[cells],self.PPCFdef[cells] = integrate_pitch_control(self.tau[:n_att][onside][:,cells], self.tau[n_att:,cells], self.attacking_team.lambda_att[onside],
+                                                                          self.defending_team.lambda_def, self.ball_travel_time[cells], self.params)
@@ -86,4 +86,28 @@ def remove_player_velocities(team):
     columns = [c for c in team.columns if c.split('_')[-1] in ['vx','vy','ax','ay','speed','acceleration']] # Get the player ids
     team = team.drop(columns=columns)
     return team
-    
\ No newline at end of file
+
+def calc_player_max_speeds(team, percentile=99, min_frames=250):
+    """ calc_player_max_speeds( tracking_data )
+    
+    Estimate the maximum speed of each player as a high percentile of their (smoothed) speed over the match, e.g. to individualise the 
+    pitch control model: params['player_max_speed'] = calc_player_max_speeds(tracking_home)
+    
+    Parameters
+    -----------
+        team: the tracking DataFrame for home or away team, including player speeds (see calc_player_velocities)
+        percentile: percentile of the player's speed used as their maximum speed. Default is 99
+        min_frames: players with fewer frames of speed measurements than this are left out. Default is 250 (10 seconds at 25Hz)
+        
+    Returrns
+    -----------
+       max_speeds : dictionary of player name (e.g. 'Home_5') -> maximum speed in meters/second
+
+    """
+    max_speeds = {}
+    for column in [c for c in team.columns if c[:4] in ['Home','Away'] and c.endswith('_speed')]:
+        speed = team[column].values
+        speed = speed[~np.isnan(speed)]
+        if len(speed)>=min_frames:
+            max_speeds[ column[:-len('_speed')] ] = float( np.percentile(speed, percentile) )
+    return max_speeds
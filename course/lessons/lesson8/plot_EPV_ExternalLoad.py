@@ -79,6 +79,10 @@ pass_events['Poss_Seq'] = pass_events['Team'].ne(
 
 home_poss = pass_events[pass_events['Team']=='Home']
 
+#calculate epv added by every home pass at once
+home_eepv_added,_ = mepv.calculate_epv_added_for_passes(home_poss.index, events, tracking_home, tracking_away, GK_numbers, EPV, params)
+home_eepv_added = pd.Series(home_eepv_added, index=home_poss.index)
+
 home_poss_list = []
 for i in np.unique(home_poss['Poss_Seq']):
     #start of the sequence
@@ -97,15 +101,9 @@ for i in np.unique(home_poss['Poss_Seq']):
         player_distance = tracking_poss.loc[tracking_poss[column] >= 3,column].sum() / 25. / 1000
         poss_distance.append(player_distance)
 
-    #calculate epv added
-    eepv_added = []
-    for i in pass_poss.index:
-        EEPV_added, EPV_diff = mepv.calculate_epv_added(i, events, tracking_home, tracking_away, GK_numbers,
-                                                        EPV, params)
-        eepv_added.append(EEPV_added)
     #sum it
     total_dist = np.sum(poss_distance)
-    total_eepv = np.sum(eepv_added)
+    total_eepv = home_eepv_added[pass_poss.index].sum()
     home_poss_list.append([total_dist, total_eepv])
 #save in a dataframe
 home_eepv_df = pd.DataFrame(np.array(home_poss_list).reshape(68,2), columns = ['HomeDist','EEPV'])
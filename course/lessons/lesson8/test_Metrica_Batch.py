@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for Metrica_Batch: the diagnostics collected in the worker processes are merged into the caller's pitch_control_stats object.
+Run with: python -m pytest -q test_Metrica_Batch.py
+"""
+
+import numpy as np
+import Metrica_PitchControl as mpc
+import Metrica_Batch as mbatch
+import Metrica_Benchmark as mbench
+
+def test_worker_stats_are_merged():
+    tracking_home, tracking_away, events, GK_numbers = mbench.generate_synthetic_match(n_frames=3, seed=2)
+    params = mpc.default_model_params()
+    frames, teams = events['Start Frame'].values, events['Team'].values
+    stats = mpc.pitch_control_stats()
+    surfaces = [PPCFa for _,PPCFa in mbatch.generate_pitch_control_for_frames(frames, teams, tracking_home, tracking_away, params, GK_numbers, n_workers=1, stats=stats)]
+    # the same frames evaluated in this process
+    reference = mpc.pitch_control_stats()
+    for event_id in events.index:
+        mpc.generate_pitch_control_for_event(event_id, events, tracking_home, tracking_away, params, GK_numbers, vectorized=True, stats=reference)
+    assert stats.n_targets == reference.n_targets == len(frames)*surfaces[0].size
+    assert stats.n_integrated == reference.n_integrated
+    assert np.array_equal(stats.steps, reference.steps)
+
+def test_frame_sequence_accepts_stats():
+    tracking_home, tracking_away, events, GK_numbers = mbench.generate_synthetic_match(n_frames=3, seed=2)
+    params = mpc.default_model_params()
+    stats, progress = mpc.pitch_control_stats(), {}
+    surfaces = list( mpc.generate_pitch_control_for_frame_sequence(tracking_home.index, 'Home', tracking_home, tracking_away, params, GK_numbers, progress=progress, stats=stats) )
+    assert stats.n_targets == len(surfaces)*surfaces[0][1].size
+    assert stats.n_integrated == progress['n_integrated']
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for Metrica_Cache: a surface cached for one ball position (or one match) must not be returned for another ball position at the same
+frame (or another match sharing the cache directory).
+Run with: python -m pytest -q test_Metrica_Cache.py
+"""
+
+import numpy as np
+import Metrica_PitchControl as mpc
+import Metrica_Batch as mbatch
+import Metrica_Cache as mcache
+import Metrica_Benchmark as mbench
+
+def test_key_includes_ball_start_position():
+    cache = mcache.pitch_control_cache(match_id=1)
+    params = mpc.default_model_params()
+    key = cache.key(10, 'Home', params, ball_start_pos=np.array([1.,2.]))
+    assert key == cache.key(10, 'Home', params, ball_start_pos=np.array([1.001,2.]))
+    assert key != cache.key(10, 'Home', params, ball_start_pos=np.array([5.,2.]))
+    assert key != cache.key(10, 'Home', params, ball_start_pos=np.array([np.nan,np.nan]))
+
+def test_frames_entry_not_returned_for_event():
+    tracking_home, tracking_away, events, GK_numbers = mbench.generate_synthetic_match(n_frames=2, seed=1)
+    params = mpc.default_model_params()
+    cache = mcache.pitch_control_cache(match_id=1)
+    frame, team = events.loc[0,'Start Frame'], events.loc[0,'Team']
+    # fill the cache from a different ball position (as the tracking ball position can differ from the event start position)
+    ball = events.loc[[0],['Start X','Start Y']].to_numpy(dtype=float) + 10.
+    list( mbatch.generate_pitch_control_for_frames([frame], [team], tracking_home, tracking_away, params, GK_numbers, ball_positions=ball, n_workers=1, cache=cache) )
+    PPCFa,_,_ = mpc.generate_pitch_control_for_event(0, events, tracking_home, tracking_away, params, GK_numbers, vectorized=True, cache=cache)
+    PPCFref,_,_ = mpc.generate_pitch_control_for_event(0, events, tracking_home, tracking_away, params, GK_numbers, vectorized=True)
+    assert np.allclose(PPCFa, PPCFref, atol=1e-12)
+    # the event surface is now cached under its own key
+    assert cache.hits == 0
+    mpc.generate_pitch_control_for_event(0, events, tracking_home, tracking_away, params, GK_numbers, vectorized=True, cache=cache)
+    assert cache.hits == 1
+
+def test_cachedir_shared_between_matches(tmp_path):
+    params = mpc.default_model_params()
+    cacheA = mcache.pitch_control_cache(match_id='A', cachedir=str(tmp_path))
+    cacheB = mcache.pitch_control_cache(match_id='B', cachedir=str(tmp_path))
+    cacheA.put(cacheA.key(10, 'Home', params), np.zeros((3,2)))
+    assert cacheB.get(cacheB.key(10, 'Home', params)) is None
+    # without a match_id, surfaces of different matches would share keys on disk
+    try:
+        mcache.pitch_control_cache(cachedir=str(tmp_path))
+    except AssertionError:
+        pass
+    else:
+        assert False, "a cachedir without a match_id should be refused"